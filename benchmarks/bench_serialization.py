@@ -0,0 +1,114 @@
+"""对比列表接口两种响应序列化方式的耗时
+
+    python benchmarks/bench_serialization.py [--items 100] [--nodes 50] [--rounds 500]
+
+baseline: 返回BaseResponse，由FastAPI按response_model校验并jsonable_encoder后编码
+fast:     FAST_JSON_RESPONSES开启后的respond，直接编码为JSON
+两者都经过完整的ASGI请求处理（httpx.ASGITransport），不访问数据库。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+from bson import ObjectId
+from fastapi import FastAPI
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mongodbcon"))
+
+from config import settings  # noqa: E402
+from schemas import BaseResponse  # noqa: E402
+from serialization import respond  # noqa: E402
+
+
+def make_page(items: int, nodes: int):
+    """构造一页graph文档，结构与CRUDGraph.get_multi(projection="*")的返回一致"""
+    # 与驱动返回的时间一致：不带时区的UTC，毫秒精度
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    graphs = []
+    for i in range(items):
+        graphs.append({
+            "id": str(ObjectId()),
+            "user_id": f"user-{i % 10}",
+            "graph_id": f"graph-{i}",
+            "graph_name": f"图{i}",
+            "graph_description": "benchmark",
+            "graph_category": "bench",
+            "graph_tags": ["a", "b"],
+            "graph_data": {
+                "nodes": [{"id": f"n{j}", "label": f"节点{j}", "x": j * 1.5, "y": j * 2.5} for j in range(nodes)],
+                "edges": [{"source": f"n{j}", "target": f"n{j + 1}"} for j in range(nodes - 1)]
+            },
+            "version": 1,
+            "created_at": now,
+            "updated_at": now
+        })
+    return {"items": graphs, "total": items, "page": 1, "size": items, "pages": 1}
+
+
+def build_app(page) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/baseline", response_model=BaseResponse)
+    async def baseline():
+        return BaseResponse(status="success", message="获取graph列表成功", data=page)
+
+    @app.get("/fast", response_model=BaseResponse)
+    async def fast():
+        return respond(status="success", message="获取graph列表成功", data=page)
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, rounds: int):
+    for _ in range(min(rounds, 20)):
+        await client.get(path)
+    timings = []
+    body = b""
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = await client.get(path)
+        body = response.content
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+        "bytes": len(body)
+    }
+
+
+async def main(items: int, nodes: int, rounds: int):
+    # respond在请求时读取配置，这里固定开启以便对比
+    settings.FAST_JSON_RESPONSES = True
+    app = build_app(make_page(items, nodes))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline = await measure(client, "/baseline", rounds)
+        fast = await measure(client, "/fast", rounds)
+        # 两种方式的响应内容必须一致
+        assert json.loads((await client.get("/baseline")).content) == json.loads((await client.get("/fast")).content)
+    print(json.dumps({
+        "items": items,
+        "nodes_per_graph": nodes,
+        "rounds": rounds,
+        "baseline": baseline,
+        "fast": fast,
+        "speedup": round(baseline["mean_ms"] / fast["mean_ms"], 2)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="响应序列化基准测试")
+    parser.add_argument("--items", type=int, default=100, help="每页文档数")
+    parser.add_argument("--nodes", type=int, default=50, help="每个graph_data的节点数")
+    parser.add_argument("--rounds", type=int, default=500, help="每种方式的请求次数")
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.nodes, args.rounds))
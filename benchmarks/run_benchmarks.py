@@ -0,0 +1,365 @@
+"""CRUD和代码生成接口的基准测试
+
+在进程内通过httpx.ASGITransport并发请求mongodbcon/main.py和根目录main.py两个应用（手动执行lifespan），
+先经批量接口写入N个用户、产品和graph，再逐个接口测量延迟分位数(p50/p95/p99)和吞吐(rps)，结果写入JSON便于对比。
+
+    # 进程内存储，不需要mongod
+    python benchmarks/run_benchmarks.py --backend memory
+    # 本地mongod（使用独立的数据库，开始前会清空该数据库）
+    MONGO_HOST=localhost python benchmarks/run_benchmarks.py --backend mongodb --db-name benchmark
+
+其他配置（如FAST_JSON_RESPONSES、DOC_CACHE_BACKEND）通过环境变量传入，会记录在结果中。
+
+memory后端的查询、索引和排序是进程内的模拟实现，没有网络往返，各接口的相对快慢与mongod不同；
+其结果标记为"representative": false，只用于同一后端下的前后对比，容量评估应使用mongodb后端。
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MONGODB_DIR = ROOT_DIR / "mongodbcon"
+
+# 代码生成使用的默认spec
+DEFAULT_SPEC = """name: BenchAgent
+nodes:
+  - name: model
+  - name: tools
+edges:
+  - from: __start__
+    to: model
+  - from: tools
+    to: model
+  - from: model
+    condition: route_after_model
+    paths: [tools, __end__]
+"""
+
+# (方法, 路径, 请求参数)
+Request = Tuple[str, str, Dict[str, Any]]
+
+
+def _load_app(name: str, path: Path):
+    """按文件路径加载应用模块（两个应用都叫main.py）"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def make_graph_data(nodes: int) -> Dict[str, Any]:
+    return {
+        "nodes": [{"id": f"n{i}", "label": f"节点{i}", "x": i * 1.5, "y": i * 2.5} for i in range(nodes)],
+        "edges": [{"source": f"n{i}", "target": f"n{i + 1}"} for i in range(max(nodes - 1, 0))]
+    }
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def measure(client, build: Callable[[int], Request], total: int, concurrency: int,
+                  warmup: int) -> Dict[str, Any]:
+    """以concurrency个并发连续发送total个请求"""
+    for i in range(warmup):
+        method, url, kwargs = build(total + i)
+        await client.request(method, url, **kwargs)
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            method, url, kwargs = build(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            key = str(response.status_code)
+            statuses[key] = statuses.get(key, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if int(status) >= 400),
+        "statuses": statuses,
+        "rps": round(total / elapsed, 1) if elapsed else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None
+    }
+
+
+async def _bulk_seed(client, path: str, items: List[Dict[str, Any]], chunk: int) -> List[str]:
+    ids = []
+    for start in range(0, len(items), chunk):
+        response = await client.post(path, json=items[start:start + chunk])
+        response.raise_for_status()
+        results = response.json()["data"]["results"]
+        failed = [result for result in results if result["id"] is None]
+        if failed:
+            raise RuntimeError(f"写入{path}失败: {failed[0]}")
+        ids.extend(result["id"] for result in results)
+    return ids
+
+
+async def seed(client, args, run_id: str, rng: random.Random) -> Dict[str, Any]:
+    """通过批量接口写入测试数据，返回各集合的ID"""
+    users = [
+        {
+            "username": f"bench_{run_id}_{i}", "email": f"bench{i}@example.com",
+            "full_name": f"用户{i}", "password": "benchmark"
+        }
+        for i in range(args.users)
+    ]
+    products = [
+        {
+            "name": f"产品{i}",
+            "description": "benchmark",
+            "price": round(rng.uniform(1, 1000), 2),
+            "category": f"category-{i % args.categories}",
+            "tags": ["bench"]
+        }
+        for i in range(args.products)
+    ]
+    graph_data = make_graph_data(args.graph_nodes)
+    graphs = [
+        {
+            "user_id": f"user-{run_id}-{i % max(args.users, 1)}",
+            "graph_id": f"graph-{i}",
+            "graph_name": f"graph{i}",
+            "graph_category": "benchmark",
+            "graph_data": graph_data
+        }
+        for i in range(args.graphs)
+    ]
+    start = time.perf_counter()
+    seeded = {
+        "user_ids": await _bulk_seed(client, "/api/generator/users/bulk", users, args.seed_chunk),
+        "product_ids": await _bulk_seed(client, "/api/generator/products/bulk", products, args.seed_chunk),
+        "graph_keys": [(graph["user_id"], graph["graph_id"]) for graph in graphs]
+    }
+    await _bulk_seed(client, "/api/generator/graphs/bulk", graphs, args.seed_chunk)
+    seeded["seconds"] = round(time.perf_counter() - start, 3)
+    return seeded
+
+
+def _deep_cursor(ids: List[str], page_size: int) -> str:
+    """最后一页的键集游标（无筛选的列表按_id排序）"""
+    from bson import ObjectId
+    from crud import encode_cursor
+    ordered = sorted(ObjectId(id) for id in ids)
+    return encode_cursor([ordered[max(len(ordered) - page_size - 1, 0)]])
+
+
+def build_scenarios(args, seeded: Dict[str, Any], run_id: str, rng: random.Random) -> Dict[str, Callable[[int], Request]]:
+    api = "/api/generator"
+    user_ids, product_ids, graph_keys = seeded["user_ids"], seeded["product_ids"], seeded["graph_keys"]
+    size = args.page_size
+    deep_page = max(args.products // size, 1)
+    graph_data = make_graph_data(args.graph_nodes)
+    # 预先选定每个请求访问的文档，保证同样的参数得到同样的访问序列
+    picks = [rng.random() for _ in range(args.requests + args.warmup)]
+
+    def pick(items: list, i: int):
+        return items[int(picks[i % len(picks)] * len(items))]
+
+    scenarios: Dict[str, Callable[[int], Request]] = {
+        "create_user": lambda i: ("POST", f"{api}/users", {"json": {
+            "username": f"new_{run_id}_{i}", "email": f"new{i}@example.com", "password": "benchmark"
+        }}),
+        "create_product": lambda i: ("POST", f"{api}/products", {"json": {
+            "name": f"新产品{i}", "price": 9.9, "category": "category-new"
+        }}),
+        "create_graph": lambda i: ("POST", f"{api}/graphs", {"json": {
+            "user_id": f"new-{run_id}", "graph_id": f"graph-{i}", "graph_name": f"graph{i}",
+            "graph_category": "benchmark", "graph_data": graph_data
+        }}),
+    }
+    if user_ids:
+        scenarios.update({
+            "get_user": lambda i: ("GET", f"{api}/users/{pick(user_ids, i)}", {}),
+            "list_users_shallow": lambda i: ("GET", f"{api}/users", {"params": {"page": 1, "size": size}}),
+            "update_user": lambda i: ("PUT", f"{api}/users/{pick(user_ids, i)}", {"json": {"full_name": f"更新{i}"}}),
+        })
+    if product_ids:
+        deep_cursor = _deep_cursor(product_ids, size)
+        scenarios.update({
+            "get_product": lambda i: ("GET", f"{api}/products/{pick(product_ids, i)}", {}),
+            "list_products_shallow": lambda i: ("GET", f"{api}/products", {"params": {"page": 1, "size": size}}),
+            "list_products_deep": lambda i: ("GET", f"{api}/products", {"params": {"page": deep_page, "size": size}}),
+            "list_products_deep_cursor": lambda i: ("GET", f"{api}/products", {
+                "params": {"cursor": deep_cursor, "size": size, "with_total": "false"}
+            }),
+            "list_products_category": lambda i: ("GET", f"{api}/products", {
+                "params": {"category": f"category-{i % args.categories}", "size": size}
+            }),
+            "update_product": lambda i: ("PUT", f"{api}/products/{pick(product_ids, i)}", {"json": {"price": 19.9}}),
+        })
+    if graph_keys:
+        graph_deep_page = max(args.graphs // size, 1)
+        scenarios.update({
+            "get_graph": lambda i: ("GET", "{}/graphs/{}/{}".format(api, *pick(graph_keys, i)), {}),
+            "list_graphs_shallow": lambda i: ("GET", f"{api}/graphs", {"params": {"page": 1, "size": size}}),
+            "list_graphs_deep": lambda i: ("GET", f"{api}/graphs", {"params": {"page": graph_deep_page, "size": size}}),
+            "list_graphs_full": lambda i: ("GET", f"{api}/graphs", {"params": {"page": 1, "size": size, "fields": "*"}}),
+            "set_graph": lambda i: ("PUT", "{}/graphs/{}/{}".format(api, *pick(graph_keys, i)), {
+                "json": {"graph_data": graph_data}
+            }),
+        })
+    return scenarios
+
+
+def build_generate_scenarios(spec: str) -> Dict[str, Callable[[int], Request]]:
+    return {
+        # 相同spec，命中结果缓存
+        "generate_cached": lambda i: ("POST", "/api/generate", {"json": {
+            "spec": spec, "language": "python", "format": "yaml"
+        }}),
+        # 每次不同的spec，实际在进程池中生成
+        "generate_uncached": lambda i: ("POST", "/api/generate", {"json": {
+            "spec": f"{spec}# {uuid.uuid4().hex}\n", "language": "python", "format": "yaml"
+        }}),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+    from config import settings
+    from database import Database
+
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    mongodb_app = _load_app("benchmark_mongodb_app", MONGODB_DIR / "main.py")
+    generator_app = None
+    if not args.skip_generate:
+        try:
+            generator_app = _load_app("benchmark_generator_app", ROOT_DIR / "main.py")
+        except ImportError as e:
+            print(f"无法加载代码生成应用，跳过generate: {e}", file=sys.stderr)
+
+    results: Dict[str, Any] = {}
+    meta: Dict[str, Any] = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": vars(args),
+        "settings": {
+            name: getattr(settings, name) for name in (
+                "MONGO_BACKEND", "MONGO_DB_NAME", "DOC_CACHE_BACKEND", "COALESCE_READS",
+                "FAST_JSON_RESPONSES", "GRAPH_COMPRESSION", "GRAPH_WRITE_BEHIND", "COUNT_CACHE_TTL_SECONDS"
+            ) if hasattr(settings, name)
+        }
+    }
+    meta["representative"] = settings.MONGO_BACKEND != "memory"
+    if not meta["representative"]:
+        print("注意: memory后端的结果不代表mongod上的性能，只用于同一后端下的前后对比", file=sys.stderr)
+
+    async with mongodb_app.router.lifespan_context(mongodb_app):
+        # 每次在空数据库上运行，结果可复现
+        await Database.client.drop_database(settings.MONGO_DB_NAME)
+        await Database.ensure_indexes()
+
+        transport = httpx.ASGITransport(app=mongodb_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            seeded = await seed(client, args, run_id, rng)
+            meta["seed_seconds"] = seeded["seconds"]
+            for name, build in build_scenarios(args, seeded, run_id, rng).items():
+                if args.only and name not in args.only:
+                    continue
+                results[name] = await measure(client, build, args.requests, args.concurrency, args.warmup)
+                print(f"{name:28s} rps={results[name]['rps']:>9} p50={results[name]['p50_ms']:>8}ms "
+                      f"p99={results[name]['p99_ms']:>8}ms errors={results[name]['errors']}")
+            meta["cache_stats"] = (await client.get("/api/generator/cache/stats")).json().get("data")
+
+        if generator_app is not None:
+            spec = Path(args.spec_file).read_text(encoding="utf-8") if args.spec_file else DEFAULT_SPEC
+            async with generator_app.router.lifespan_context(generator_app):
+                transport = httpx.ASGITransport(app=generator_app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                    for name, build in build_generate_scenarios(spec).items():
+                        if args.only and name not in args.only:
+                            continue
+                        results[name] = await measure(
+                            client, build, args.generate_requests, args.concurrency, min(args.warmup, 1)
+                        )
+                        print(f"{name:28s} rps={results[name]['rps']:>9} p50={results[name]['p50_ms']:>8}ms "
+                              f"p99={results[name]['p99_ms']:>8}ms errors={results[name]['errors']}")
+
+    meta["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return {"meta": meta, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CRUD和代码生成接口基准测试")
+    parser.add_argument("--backend", choices=["memory", "mongodb"], default="memory", help="存储后端")
+    parser.add_argument("--db-name", default="benchmark", help="使用的数据库（开始前清空）")
+    parser.add_argument("--users", type=int, default=1000, help="预置用户数")
+    parser.add_argument("--products", type=int, default=5000, help="预置产品数")
+    parser.add_argument("--graphs", type=int, default=500, help="预置graph数")
+    parser.add_argument("--graph-nodes", type=int, default=50, help="每个graph_data的节点数")
+    parser.add_argument("--categories", type=int, default=20, help="产品类别数")
+    parser.add_argument("--page-size", type=int, default=100, help="列表接口每页大小")
+    parser.add_argument("--requests", type=int, default=1000, help="每个接口的请求数")
+    parser.add_argument("--generate-requests", type=int, default=50, help="代码生成接口的请求数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--warmup", type=int, default=10, help="每个接口正式测量前的预热请求数")
+    parser.add_argument("--seed", type=int, default=42, help="随机数种子")
+    parser.add_argument("--seed-chunk", type=int, default=1000, help="预置数据时每次批量写入的条数")
+    parser.add_argument("--spec-file", help="代码生成使用的spec文件，默认使用内置的示例")
+    parser.add_argument("--skip-generate", action="store_true", help="不测试代码生成接口")
+    parser.add_argument("--only", nargs="*", help="只运行指定的接口")
+    parser.add_argument("--output", help="结果JSON路径，默认benchmarks/results/<时间>.json")
+    args = parser.parse_args()
+
+    # 配置在导入时读取，需在导入应用之前设置
+    os.environ["MONGO_BACKEND"] = args.backend
+    os.environ["MONGO_DB_NAME"] = args.db_name
+    sys.path.insert(0, str(MONGODB_DIR))
+
+    report = asyncio.run(run(args))
+    output = Path(args.output) if args.output else \
+        ROOT_DIR / "benchmarks" / "results" / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"结果已写入{output}")
+
+
+if __name__ == "__main__":
+    main()
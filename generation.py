@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import metadata
+from typing import Any, Dict, List, Optional, Tuple
+
+from langgraphgenpy.langgraph_gen.generate import generate_from_spec
+
+
+# 进程池大小、排队上限（超出时拒绝请求）和结果缓存条数
+GENERATOR_WORKERS = int(os.getenv("GENERATOR_WORKERS", os.cpu_count() or 1))
+GENERATOR_QUEUE_LIMIT = int(os.getenv("GENERATOR_QUEUE_LIMIT", 32))
+GENERATOR_CACHE_SIZE = int(os.getenv("GENERATOR_CACHE_SIZE", 256))
+# 批量生成接口单次最多接受的spec数
+GENERATOR_BATCH_MAX = int(os.getenv("GENERATOR_BATCH_MAX", 1000))
+# 等待其他worker生成同一结果时的轮询间隔（秒）
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", 0.2))
+
+logger = logging.getLogger(__name__)
+
+
+def _generator_version() -> str:
+    """生成器版本，参与持久化缓存的键；生成逻辑变化后旧结果自动失效"""
+    version = os.getenv("GENERATOR_VERSION")
+    if version:
+        return version
+    try:
+        return metadata.version("langgraphgenpy")
+    except metadata.PackageNotFoundError:
+        return "0"
+
+
+class GeneratorBusyError(Exception):
+    """生成任务排队已满"""
+
+
+def spec_hash(spec: str, spec_format: str, language: str, templates: List[str]) -> str:
+    """生成结果的缓存键：(spec, 格式, 语言, 模板)的SHA-256"""
+    payload = json.dumps([spec, spec_format, language, list(templates)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _generate(spec: str, spec_format: str, language: str, templates: List[str]) -> Tuple[str, ...]:
+    # 在子进程中执行，必须是模块级函数
+    return tuple(generate_from_spec(spec, spec_format, language=language, templates=templates))
+
+
+class GenerationService:
+    """在进程池中执行CPU密集的代码生成，避免阻塞事件循环，并按内容缓存生成结果"""
+
+    def __init__(self, workers: int = GENERATOR_WORKERS, queue_limit: int = GENERATOR_QUEUE_LIMIT,
+                 cache_size: int = GENERATOR_CACHE_SIZE):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.cache_size = cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        # 正在生成的请求，相同请求等待同一结果
+        self._inflight: Dict[str, "asyncio.Future[Tuple[str, ...]]"] = {}
+        # 持久化缓存(mongodbcon中的CRUDGeneratedCode)，由应用启动时按配置设置
+        self.store: Optional[Any] = None
+        self.generator_version = _generator_version()
+        # 已提交到进程池(执行中+排队中)的任务数
+        self.pending = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.persistent_hits = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        """丢弃已损坏的进程池
+
+        同一进程池上的多个请求会先后收到BrokenProcessPool，只在它仍是当前进程池时置空，
+        避免关掉其他请求已重建的进程池；关闭时不等待，以免阻塞事件循环。
+        """
+        if self._executor is executor:
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def generate(self, spec: str, language: str, templates: List[str],
+                       spec_format: str = "yaml", wait: bool = False) -> Tuple[str, ...]:
+        """生成代码，返回与templates一一对应的结果
+
+        排队已满时抛出GeneratorBusyError；wait=True时不受排队上限限制（调用方需自行限制并发）。
+        """
+        key = spec_hash(spec, spec_format, language, templates)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # 发起生成的请求被取消（如批量请求的客户端断开），重新发起
+                return await self.generate(spec, language, templates, spec_format, wait)
+        self.cache_misses += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._load_or_generate(key, spec, spec_format, language, list(templates), wait)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self._inflight.pop(key, None)
+
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    async def _load_or_generate(self, key: str, spec: str, spec_format: str, language: str,
+                                templates: List[str], wait: bool) -> Tuple[str, ...]:
+        """先查持久化缓存；未命中时占位生成，其他worker已在生成时等待其结果"""
+        if self.store is None:
+            return await self._submit(spec, spec_format, language, templates, wait)
+
+        while True:
+            try:
+                record = await self.store.get_result(key, self.generator_version)
+                if record is not None and record["status"] == "done":
+                    self.persistent_hits += 1
+                    return tuple(record["outputs"])
+                acquired = await self.store.acquire(key, self.generator_version)
+            except Exception as e:
+                # 持久化缓存不可用时不影响生成
+                logger.warning(f"读取代码生成持久化缓存失败，直接生成: {e}")
+                return await self._submit(spec, spec_format, language, templates, wait)
+            if acquired:
+                break
+            await asyncio.sleep(GENERATION_POLL_INTERVAL)
+
+        try:
+            result = await self._submit(spec, spec_format, language, templates, wait)
+        except BaseException:
+            try:
+                await self.store.release(key, self.generator_version)
+            except Exception as e:
+                logger.warning(f"释放代码生成占位失败: {e}")
+            raise
+        try:
+            await self.store.store(key, self.generator_version, list(result))
+        except Exception as e:
+            logger.warning(f"写入代码生成持久化缓存失败: {e}")
+        return result
+
+    async def _submit(self, spec: str, spec_format: str, language: str, templates: List[str],
+                      wait: bool) -> Tuple[str, ...]:
+        if not wait and self.pending >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise GeneratorBusyError("代码生成任务过多，请稍后重试")
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        self.pending += 1
+        try:
+            result = await loop.run_in_executor(executor, _generate, spec, spec_format, language, templates)
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，下次提交时重建后交由调用方重试
+            self.failed += 1
+            self._discard(executor)
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": max(self.pending - self.workers, 0),
+            "cache_size": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "persistent_hits": self.persistent_hits,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+# 生成服务实例（每个worker进程一个）
+generation_service = GenerationService()
@@ -3,17 +3,43 @@ from pathlib import Path
 
 root_dir = Path(__file__).parent.parent
 sys.path.append(str(root_dir))
+# mongodbcon模块使用平铺导入
+sys.path.append(str(Path(__file__).parent / "mongodbcon"))
 
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from langgraphgenpy.langgraph_gen.generate import generate_from_spec
+from fastapi.responses import PlainTextResponse, StreamingResponse
 # from langgraphgenpy.langgraph_gen.generatenoconditional import generate_from_spec
 
 from langgraphgenpy.openapi.schemas import  CodeGenerationRequest, CodeGenerationResponse
+from langgraphgenpy.openapi.generation import generation_service, GeneratorBusyError, GENERATOR_BATCH_MAX
+from config import settings
+
+
+# 应用生命周期：启动/关闭代码生成进程池，启用持久化缓存时连接MongoDB
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    generation_service.start()
+    if settings.GENERATION_CACHE_PERSISTENT:
+        # 只在启用时导入CRUD层和数据库连接，且只同步generated_code集合的索引
+        from crud import CRUDGeneratedCode
+        from database import Database
+        from models import GeneratedCode
+        await Database.connect(models=[GeneratedCode])
+        generation_service.store = CRUDGeneratedCode(Database.get_db()[GeneratedCode.Config.collection])
+    yield
+    generation_service.shutdown()
+    if settings.GENERATION_CACHE_PERSISTENT:
+        generation_service.store = None
+        await Database.disconnect()
 
 
 # 初始化FastAPI应用
-app = FastAPI(title="Mongo Server Template")
+app = FastAPI(title="Mongo Server Template", lifespan=lifespan)
 
 # 配置CORS（允许前端跨域访问）
 app.add_middleware(
@@ -25,15 +51,14 @@ app.add_middleware(
 )
 
 
-@app.post("/api/generate", response_model=CodeGenerationResponse)
-async def generate_code_handler(request: CodeGenerationRequest):
-    """处理代码生成请求"""
+async def _generate_response(request: CodeGenerationRequest, wait: bool = False) -> CodeGenerationResponse:
+    """执行一次代码生成，生成失败时返回带错误信息的响应"""
     try:
-        stub, impl = generate_from_spec(
+        stub, impl = await generation_service.generate(
             request.spec,
-            "yaml",
-            language=request.language,
-            templates=["stub", "implementation"]
+            request.language,
+            ["stub", "implementation"],
+            wait=wait
         )
 
 
@@ -42,6 +67,8 @@ async def generate_code_handler(request: CodeGenerationRequest):
             implementation=impl
         )
 
+    except GeneratorBusyError:
+        raise
     except Exception as e:
         return CodeGenerationResponse(
             success=False,
@@ -51,12 +78,74 @@ async def generate_code_handler(request: CodeGenerationRequest):
         )
 
 
+@app.post("/api/generate", response_model=CodeGenerationResponse)
+async def generate_code_handler(request: CodeGenerationRequest):
+    """处理代码生成请求（在进程池中执行，相同请求直接返回缓存结果）"""
+    try:
+        return await _generate_response(request)
+    except GeneratorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+
+async def _batch_stream(requests: List[CodeGenerationRequest]) -> AsyncIterator[str]:
+    """并行生成，按完成顺序逐行输出{"index": 序号, ...CodeGenerationResponse}"""
+    # 每个批次最多占用与进程数相同的并发，避免挤占单个请求的排队名额
+    semaphore = asyncio.Semaphore(generation_service.workers)
+
+    async def run(index: int, request: CodeGenerationRequest):
+        async with semaphore:
+            return index, await _generate_response(request, wait=True)
+
+    tasks = [asyncio.create_task(run(index, request)) for index, request in enumerate(requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, response = await next_done
+            yield json.dumps({"index": index, **response.model_dump()}, ensure_ascii=False) + "\n"
+    finally:
+        # 客户端断开时取消尚未完成的生成
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/api/generate/batch")
+async def generate_batch_handler(requests: List[CodeGenerationRequest]):
+    """批量代码生成，以NDJSON流按完成顺序返回每个spec的结果"""
+    if len(requests) > GENERATOR_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"单次最多提交{GENERATOR_BATCH_MAX}个spec")
+    return StreamingResponse(_batch_stream(requests), media_type="application/x-ndjson")
+
+
 # 健康检查接口
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "langgraph-gen-api"}
 
 
+# 代码生成指标（Prometheus文本格式）
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    stats = generation_service.stats()
+    lines = []
+    for name, kind in (
+        ("workers", "gauge"),
+        ("queue_limit", "gauge"),
+        ("in_flight", "gauge"),
+        ("queue_depth", "gauge"),
+        ("cache_size", "gauge"),
+        ("cache_hits", "counter"),
+        ("cache_misses", "counter"),
+        ("persistent_hits", "counter"),
+        ("coalesced", "counter"),
+        ("rejected", "counter"),
+        ("completed", "counter"),
+        ("failed", "counter"),
+    ):
+        metric = f"generator_{name}_total" if kind == "counter" else f"generator_{name}"
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.append(f"{metric} {stats[name]}")
+    return "\n".join(lines) + "\n"
+
+
 
 if __name__ == "__main__":
     import uvicorn
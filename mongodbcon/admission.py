@@ -0,0 +1,202 @@
+"""准入控制
+
+每个进程同时处理的请求数不超过ADMISSION_MAX_CONCURRENCY(默认等于连接池大小)，并按请求类别限制并发：
+read(单条读取)、write(单条写入)、list(列表查询)、bulk(批量写入、批量获取和导出)。
+超出限制的请求进入有界等待队列，按类别优先级(read > write > list > bulk)获得空闲名额；
+队列已满或等待超过ADMISSION_QUEUE_TIMEOUT_MS时直接返回503和Retry-After，
+避免请求在连接池上排队直到serverSelectionTimeoutMS后才以500失败。
+"""
+import asyncio
+import bisect
+import itertools
+import json
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from config import settings
+from metrics import ADMISSION_SHED, ADMISSION_WAIT
+
+# 类别 -> 优先级，数值越小越优先
+PRIORITIES = {"read": 0, "write": 1, "list": 2, "bulk": 3}
+
+_API_PREFIX = "/api/generator"
+# 不受限制的运维接口
+_EXEMPT_PATHS = re.compile(r"^/(admin|cache)(/|$)")
+_BULK_PATHS = re.compile(r"/(bulk|batch-get|export)$")
+_LIST_PATHS = re.compile(r"^/(users|products|graphs)/?$")
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """按请求方法和路径确定类别，不受准入控制的请求返回None"""
+    if not path.startswith(_API_PREFIX):
+        return None
+    path = path[len(_API_PREFIX):]
+    if _EXEMPT_PATHS.match(path):
+        return None
+    if _BULK_PATHS.search(path):
+        return "bulk"
+    if method in ("GET", "HEAD"):
+        return "list" if _LIST_PATHS.match(path) else "read"
+    if method in ("POST", "PUT", "PATCH", "DELETE"):
+        return "write"
+    return None
+
+
+class AdmissionController:
+    """按类别限制并发的许可分配器，等待队列按(优先级, 到达顺序)排序"""
+
+    def __init__(self, max_concurrency: int, limits: Dict[str, int], max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.limits = limits
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active: Dict[str, int] = {name: 0 for name in PRIORITIES}
+        self._total = 0
+        # (优先级, 序号, 类别, future)
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.admitted = 0
+        self.shed: Dict[str, Dict[str, int]] = {name: {"queue_full": 0, "timeout": 0} for name in PRIORITIES}
+
+    def _can_run(self, request_class: str) -> bool:
+        return self._total < self.max_concurrency and self._active[request_class] < self.limits[request_class]
+
+    def _grant(self, request_class: str):
+        self._total += 1
+        self._active[request_class] += 1
+        self.admitted += 1
+
+    def _shed(self, request_class: str, reason: str):
+        self.shed[request_class][reason] += 1
+        ADMISSION_SHED.labels(request_class, reason).inc()
+
+    async def acquire(self, request_class: str) -> bool:
+        """获取许可，被拒绝时返回False；返回True时调用方必须在请求结束后release"""
+        # 同类请求已在排队时不插队；其他类别排队只可能是因为各自的类别上限
+        if self._can_run(request_class) and not any(waiter[2] == request_class for waiter in self._waiters):
+            self._grant(request_class)
+            return True
+
+        priority = PRIORITIES[request_class]
+        if len(self._waiters) >= self.max_queue:
+            # max_queue为0时不排队
+            if not self._waiters or self._waiters[-1][0] <= priority:
+                self._shed(request_class, "queue_full")
+                return False
+            lowest = self._waiters[-1]
+            # 队列已满时挤出优先级最低、最晚到达的等待者
+            self._waiters.pop()
+            self._shed(lowest[2], "queue_full")
+            lowest[3].set_result(False)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._sequence), request_class, future)
+        # 序号唯一，元组比较不会比较到future
+        bisect.insort(self._waiters, waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 客户端断开：已分到的许可要归还
+            self._remove(waiter)
+            if future.done() and not future.cancelled() and future.result():
+                self.release(request_class)
+            raise
+        ADMISSION_WAIT.labels(request_class).observe(time.perf_counter() - start)
+
+        if not future.done():
+            self._remove(waiter)
+            future.cancel()
+            self._shed(request_class, "timeout")
+            return False
+        return future.result()
+
+    def _remove(self, waiter: Tuple[int, int, str, asyncio.Future]):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, request_class: str):
+        self._total -= 1
+        self._active[request_class] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """按优先级把空闲名额分给可以运行的等待者"""
+        index = 0
+        while index < len(self._waiters) and self._total < self.max_concurrency:
+            _, _, request_class, future = self._waiters[index]
+            if future.done():
+                del self._waiters[index]
+            elif self._can_run(request_class):
+                del self._waiters[index]
+                self._grant(request_class)
+                future.set_result(True)
+            else:
+                index += 1
+
+    def stats(self) -> Dict[str, object]:
+        queued = {name: 0 for name in PRIORITIES}
+        for _, _, request_class, _ in self._waiters:
+            queued[request_class] += 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "limits": dict(self.limits),
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": dict(self._active),
+            "queued": queued,
+            "admitted": self.admitted,
+            "shed": {name: dict(counts) for name, counts in self.shed.items()}
+        }
+
+
+class AdmissionMiddleware:
+    """在路由之前按类别获取许可，拒绝时返回503"""
+
+    def __init__(self, app, controller: "AdmissionController", retry_after: int = 1):
+        self.app = app
+        self.controller = controller
+        self.retry_after = retry_after
+        self._body = json.dumps({"detail": "服务繁忙，请稍后重试"}, ensure_ascii=False).encode("utf-8")
+
+    async def __call__(self, scope, receive, send):
+        request_class = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if request_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(request_class):
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(self._body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": self._body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(request_class)
+
+
+# 进程内的准入控制器
+admission_controller = AdmissionController(
+    max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+    limits={
+        "read": settings.ADMISSION_READ_LIMIT,
+        "write": settings.ADMISSION_WRITE_LIMIT,
+        "list": settings.ADMISSION_LIST_LIMIT,
+        "bulk": settings.ADMISSION_BULK_LIMIT
+    },
+    max_queue=settings.ADMISSION_MAX_QUEUE,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_MS / 1000
+)
@@ -0,0 +1,94 @@
+"""条件请求
+
+ETag由文档标识、updated_at(毫秒精度，与MongoDB存储精度一致)和字段投影计算，Last-Modified取updated_at。
+GET带If-None-Match/If-Modified-Since且未变化时返回304；PUT带If-Match时只在ETag一致的情况下写入，否则返回412。
+判断只需要updated_at，由调用方通过缓存或只含updated_at的投影查询取得，不读取和序列化完整文档。
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, List, Optional
+from fastapi import HTTPException, Request, status
+
+# 只与读相关的条件请求头
+_READ_CONDITION_HEADERS = ("if-none-match", "if-modified-since")
+
+
+def _utc(updated_at: datetime) -> datetime:
+    # 驱动默认返回不带时区的UTC时间
+    if updated_at.tzinfo is None:
+        return updated_at.replace(tzinfo=timezone.utc)
+    return updated_at.astimezone(timezone.utc)
+
+
+def make_etag(key: str, updated_at: datetime, projection: Optional[Dict[str, int]] = None) -> str:
+    """强ETag；不同的字段投影是不同的表示，ETag也不同"""
+    millis = int(_utc(updated_at).timestamp() * 1000)
+    variant = ",".join(f"{field}:{flag}" for field, flag in sorted(projection.items())) if projection else ""
+    digest = hashlib.sha1(f"{key}:{millis}:{variant}".encode("utf-8")).hexdigest()[:24]
+    return f'"{digest}"'
+
+
+def validator_headers(key: str, updated_at: Optional[datetime],
+                      projection: Optional[Dict[str, int]] = None) -> Dict[str, str]:
+    """响应中的ETag和Last-Modified头；没有updated_at的文档不返回"""
+    if updated_at is None:
+        return {}
+    return {
+        "ETag": make_etag(key, updated_at, projection),
+        "Last-Modified": format_datetime(_utc(updated_at).replace(microsecond=0), usegmt=True)
+    }
+
+
+def _etags(header: str) -> List[str]:
+    # If-None-Match按弱比较，去掉W/前缀
+    return [tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()]
+
+
+def has_read_conditions(request: Request) -> bool:
+    return any(name in request.headers for name in _READ_CONDITION_HEADERS)
+
+
+def check_not_modified(request: Request, key: str, updated_at: Optional[datetime],
+                       projection: Optional[Dict[str, int]] = None):
+    """资源未变化时以304结束请求（由HTTPException处理器返回空响应体）
+
+    同时带If-None-Match和If-Modified-Since时只按If-None-Match判断。
+    """
+    if updated_at is None:
+        return
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etags = _etags(if_none_match)
+        not_modified = "*" in etags or make_etag(key, updated_at, projection) in etags
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is None:
+            return
+        try:
+            since = _utc(parsedate_to_datetime(if_modified_since))
+        except (TypeError, ValueError):
+            # 无法解析的日期按规范忽略
+            return
+        # HTTP日期只有秒级精度
+        not_modified = _utc(updated_at).replace(microsecond=0) <= since
+    if not_modified:
+        raise HTTPException(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers=validator_headers(key, updated_at, projection)
+        )
+
+
+def check_if_match(request: Request, key: str, updated_at: Optional[datetime]):
+    """If-Match不满足(资源不存在或ETag不一致)时返回412；updated_at为资源当前的值，不存在时为None"""
+    if_match = request.headers.get("if-match")
+    if if_match is None:
+        return
+    etags = [tag.strip() for tag in if_match.split(",") if tag.strip()]
+    # If-Match按强比较，弱ETag不匹配
+    matched = updated_at is not None and ("*" in etags or make_etag(key, updated_at) in etags)
+    if not matched:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="资源不存在或已被修改"
+        )
@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -15,14 +16,93 @@ class MongoDBSettings:
     MONGO_DB_NAME: str = os.getenv("MONGO_DB_NAME", "test_db")
     MONGO_AUTH_SOURCE: str = os.getenv("MONGO_AUTH_SOURCE", "admin")
     
+    # 存储后端：mongodb(连接MONGO_URI)或memory(进程内实现，用于测试和压测)
+    MONGO_BACKEND: str = os.getenv("MONGO_BACKEND", "mongodb")
+    
     # 连接池配置
     MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
     MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", 10))
     
+    # 准入控制(默认关闭)：每个进程同时处理的请求数(默认同连接池大小)及各类请求的并发上限，
+    # 排队数上限和最长排队时间(毫秒)，超出时返回503并在Retry-After中给出重试间隔(秒)
+    ADMISSION_CONTROL: bool = os.getenv("ADMISSION_CONTROL", "false").lower() in ("1", "true", "yes")
+    ADMISSION_MAX_CONCURRENCY: int = int(os.getenv("ADMISSION_MAX_CONCURRENCY", MONGO_MAX_POOL_SIZE))
+    ADMISSION_READ_LIMIT: int = int(os.getenv("ADMISSION_READ_LIMIT", MONGO_MAX_POOL_SIZE))
+    ADMISSION_WRITE_LIMIT: int = int(os.getenv("ADMISSION_WRITE_LIMIT", max(1, MONGO_MAX_POOL_SIZE * 6 // 10)))
+    ADMISSION_LIST_LIMIT: int = int(os.getenv("ADMISSION_LIST_LIMIT", max(1, MONGO_MAX_POOL_SIZE * 4 // 10)))
+    ADMISSION_BULK_LIMIT: int = int(os.getenv("ADMISSION_BULK_LIMIT", max(1, MONGO_MAX_POOL_SIZE // 10)))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", 200))
+    ADMISSION_QUEUE_TIMEOUT_MS: int = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", 1000))
+    ADMISSION_RETRY_AFTER_SECONDS: int = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 1))
+    
     # 连接超时配置
     MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
     MONGO_CONNECT_TIMEOUT_MS: int = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
     
+    # 请求截止时间(毫秒，默认0即不限制)，CRUD操作按剩余时间设置maxTimeMS，用尽时返回504；
+    # REQUEST_TIMEOUT_ROUTES按路由函数名覆盖，格式为"name=ms,..."(0表示该路由不限制)；
+    # 客户端可通过请求头X-Request-Timeout-Ms为单个请求指定，最长不超过REQUEST_TIMEOUT_MAX_MS
+    REQUEST_TIMEOUT_MS: int = int(os.getenv("REQUEST_TIMEOUT_MS", 0))
+    REQUEST_TIMEOUT_MAX_MS: int = int(os.getenv("REQUEST_TIMEOUT_MAX_MS", 60000))
+    REQUEST_TIMEOUT_ROUTES: Dict[str, int] = {
+        name.strip(): int(timeout_ms)
+        for name, timeout_ms in (
+            item.split("=", 1) for item in os.getenv("REQUEST_TIMEOUT_ROUTES", "").split(",") if item.strip()
+        )
+    }
+    
+    # 启动时根据模型声明创建缺失的索引；关闭时只检查，声明的唯一索引缺失时仍然拒绝启动
+    MONGO_CREATE_INDEXES: bool = os.getenv("MONGO_CREATE_INDEXES", "true").lower() in ("1", "true", "yes")
+    
+    # 计数缓存：带筛选条件的count结果缓存时间（秒），0表示不缓存
+    COUNT_CACHE_TTL_SECONDS: float = float(os.getenv("COUNT_CACHE_TTL_SECONDS", 30))
+    
+    # 批量写入：每批insert_many的文档数及单次请求的最大条数
+    BULK_CHUNK_SIZE: int = int(os.getenv("BULK_CHUNK_SIZE", 1000))
+    BULK_MAX_ITEMS: int = int(os.getenv("BULK_MAX_ITEMS", 10000))
+    
+    # 文档缓存：none(默认)、memory(进程内LRU)或redis(多进程共享)；
+    # memory只在本进程内失效，多worker部署时其他worker的写入要等TTL过期后才可见，应使用redis
+    DOC_CACHE_BACKEND: str = os.getenv("DOC_CACHE_BACKEND", "none")
+    DOC_CACHE_MAX_SIZE: int = int(os.getenv("DOC_CACHE_MAX_SIZE", 10000))
+    DOC_CACHE_TTL_SECONDS: float = float(os.getenv("DOC_CACHE_TTL_SECONDS", 60))
+    DOC_CACHE_REDIS_URL: str = os.getenv("DOC_CACHE_REDIS_URL", "redis://localhost:6379/0")
+    
+    # 按ID批量获取：每次$in查询的ID数及单次请求的最大ID数
+    BATCH_GET_CHUNK_SIZE: int = int(os.getenv("BATCH_GET_CHUNK_SIZE", 500))
+    BATCH_GET_MAX_IDS: int = int(os.getenv("BATCH_GET_MAX_IDS", 1000))
+    
+    # 导出接口：游标每批从服务端取回的文档数
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+    
+    # graph_data压缩存储：none(不压缩)、zlib或zstd；BSON编码后超过阈值(字节)的graph_data才压缩
+    GRAPH_COMPRESSION: str = os.getenv("GRAPH_COMPRESSION", "none")
+    GRAPH_COMPRESSION_THRESHOLD: int = int(os.getenv("GRAPH_COMPRESSION_THRESHOLD", 64 * 1024))
+    GRAPH_COMPRESSION_LEVEL: int = int(os.getenv("GRAPH_COMPRESSION_LEVEL", 3))
+    
+    # 代码生成结果持久化缓存(generated_code集合)：是否启用、过期时间、单条结果大小上限、生成占位租期
+    GENERATION_CACHE_PERSISTENT: bool = os.getenv("GENERATION_CACHE_PERSISTENT", "false").lower() in ("1", "true", "yes")
+    GENERATED_CODE_TTL_SECONDS: int = int(os.getenv("GENERATED_CODE_TTL_SECONDS", 7 * 24 * 3600))
+    GENERATED_CODE_MAX_BYTES: int = int(os.getenv("GENERATED_CODE_MAX_BYTES", 4 * 1024 * 1024))
+    GENERATION_LEASE_SECONDS: float = float(os.getenv("GENERATION_LEASE_SECONDS", 120))
+    
+    # 合并相同的并发读(get/get_multi)；COALESCE_READS_EXCLUDE为不合并的路由函数名，逗号分隔
+    COALESCE_READS: bool = os.getenv("COALESCE_READS", "true").lower() in ("1", "true", "yes")
+    COALESCE_READS_EXCLUDE: List[str] = [name.strip() for name in os.getenv("COALESCE_READS_EXCLUDE", "").split(",") if name.strip()]
+    
+    # graph保存写缓冲：合并同一graph的连续保存，定期或缓冲数达到上限时批量写入
+    GRAPH_WRITE_BEHIND: bool = os.getenv("GRAPH_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+    GRAPH_WRITE_BEHIND_FLUSH_SECONDS: float = float(os.getenv("GRAPH_WRITE_BEHIND_FLUSH_SECONDS", 1.0))
+    GRAPH_WRITE_BEHIND_MAX_PENDING: int = int(os.getenv("GRAPH_WRITE_BEHIND_MAX_PENDING", 1000))
+    
+    # 快速响应序列化：直接用orjson编码响应，跳过response_model的二次校验和jsonable_encoder
+    FAST_JSON_RESPONSES: bool = os.getenv("FAST_JSON_RESPONSES", "false").lower() in ("1", "true", "yes")
+    
+    # 慢查询记录：耗时阈值(毫秒，默认0即关闭)、异步explain的抽样比例、最多保留的查询结构数
+    SLOW_QUERY_MS: float = float(os.getenv("SLOW_QUERY_MS", 0))
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE: float = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", 0.0))
+    SLOW_QUERY_MAX_SHAPES: int = int(os.getenv("SLOW_QUERY_MAX_SHAPES", 1000))
+    
     # URI构建
     @property
     def MONGO_URI(self) -> str:
@@ -1,19 +1,639 @@
-from typing import Type, TypeVar, List, Optional, Dict, Any
+from typing import Type, TypeVar, List, Optional, Dict, Any, Tuple, Union, AsyncIterator, Awaitable, Callable
 from motor.motor_asyncio import AsyncIOMotorCollection
 from pydantic import BaseModel
-from bson import ObjectId
-from datetime import datetime, timezone
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import ObjectId, Binary, json_util
+from bson.errors import InvalidId
+import bson
+from datetime import datetime, timezone, timedelta
+from collections import OrderedDict, deque
+from config import settings
+from deadline import DeadlineExceeded, bounded, is_timeout, remaining
+import abc
+import asyncio
+import base64
+import copy
+import logging
+import time
+import zlib
 
 
+logger = logging.getLogger(__name__)
+
 # 泛型类型变量
 T = TypeVar('T', bound=BaseModel)
 
+
+class InvalidCursorError(ValueError):
+    """分页游标无效"""
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """将排序键的取值编码为不透明的分页游标"""
+    raw = json_util.dumps(values).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """解析分页游标，返回排序键的取值"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception as e:
+        raise InvalidCursorError("无效的分页游标") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursorError("无效的分页游标")
+    return values
+
+
+class InvalidFieldsError(ValueError):
+    """字段投影参数无效"""
+
+
+def build_projection(model: Type[BaseModel], fields: Optional[str]) -> Optional[Dict[str, int]]:
+    """将逗号分隔的字段列表(如"name,price")转换为包含式投影
+
+    fields为空时返回None（由调用方决定默认投影），"*"表示返回全部字段；
+    id总是返回，不在模型中的字段名会抛出InvalidFieldsError。
+    """
+    if fields is None:
+        return None
+    fields = fields.strip()
+    if fields == "*":
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown:
+        raise InvalidFieldsError(f"未知字段: {', '.join(unknown)}")
+    return {name: 1 for name in names if name != "id"} or {"_id": 1}
+
+
+def default_projection(model: Type[BaseModel], fields: Optional[str]) -> Optional[Dict[str, int]]:
+    """列表接口的投影：未指定fields时使用模型的summary_projection"""
+    if fields is None:
+        return getattr(model.Config, "summary_projection", None)
+    return build_projection(model, fields)
+
+
+def apply_projection(document: Dict[str, Any], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    """在已取回的(返回格式)文档上应用顶层字段投影，用于从缓存的完整文档中取子集"""
+    if not projection:
+        return document
+    if any(projection.values()):
+        return {key: value for key, value in document.items() if key == "id" or projection.get(key)}
+    return {key: value for key, value in document.items() if key not in projection}
+
+
+class InvalidPatchError(ValueError):
+    """JSON Patch无效或不受支持"""
+
+
+class PatchConflictError(Exception):
+    """版本号或test条件不满足"""
+
+    def __init__(self, message: str, current_version: Optional[int] = None):
+        super().__init__(message)
+        self.current_version = current_version
+
+
+def _pointer_segments(pointer: str) -> List[str]:
+    """解析JSON Pointer(RFC 6901)，拒绝无法映射为MongoDB点路径的片段"""
+    if not pointer.startswith("/"):
+        raise InvalidPatchError(f"无效的路径: {pointer}")
+    segments = [segment.replace("~1", "/").replace("~0", "~") for segment in pointer[1:].split("/")]
+    for segment in segments:
+        if not segment or "." in segment or segment.startswith("$"):
+            raise InvalidPatchError(f"不支持的路径: {pointer}")
+    return segments
+
+
+def _json_equal(left: Any, right: Any) -> bool:
+    """按JSON语义比较(test操作)：布尔值与数字不相等，对象不考虑键顺序"""
+    if isinstance(left, bool) or isinstance(right, bool):
+        return isinstance(left, bool) and isinstance(right, bool) and left == right
+    if isinstance(left, dict) and isinstance(right, dict):
+        return left.keys() == right.keys() and all(_json_equal(left[key], right[key]) for key in left)
+    if isinstance(left, list) and isinstance(right, list):
+        return len(left) == len(right) and all(_json_equal(a, b) for a, b in zip(left, right))
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left == right
+    return type(left) is type(right) and left == right
+
+
+def _array_index(array: List[Any], segment: str, pointer: str, allow_end: bool = False) -> int:
+    """数组下标：不带前导零的非负整数，allow_end时可以等于数组长度(插入到末尾)"""
+    if not segment.isdigit() or (len(segment) > 1 and segment.startswith("0")):
+        raise InvalidPatchError(f"无效的数组下标: {pointer}")
+    index = int(segment)
+    if index > len(array) or (index == len(array) and not allow_end):
+        raise InvalidPatchError(f"数组下标越界: {pointer}")
+    return index
+
+
+def _resolve(document: Any, segments: List[str], pointer: str) -> Any:
+    """按路径片段取值，路径不存在时抛出InvalidPatchError"""
+    value = document
+    for segment in segments:
+        if isinstance(value, dict):
+            if segment not in value:
+                raise InvalidPatchError(f"路径不存在: {pointer}")
+            value = value[segment]
+        elif isinstance(value, list):
+            value = value[_array_index(value, segment, pointer)]
+        else:
+            raise InvalidPatchError(f"路径不存在: {pointer}")
+    return value
+
+
+def json_patch_to_update(document: Dict[str, Any], operations: List[Dict[str, Any]],
+                         root: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """在root字段的当前值document上按顺序应用JSON Patch(RFC 6902)，并转换为MongoDB更新
+
+    返回(应用补丁后的值, 更新文档)，document本身不被修改：
+    - 对象按键修改：变化的键路径 -> $set，删除的键 -> $unset
+    - 数组插入连续的一段元素(含/-追加)：$push（插入位置不在末尾时带$position）
+    - 数组删除元素、不连续的插入，或同一数组内还有其他路径要写入：整体$set该数组
+      （下标按补丁中的顺序逐条生效）
+    - test不满足时抛出PatchConflictError，路径不存在或无效时抛出InvalidPatchError
+    对象还是数组以document中的实际类型为准；某条路径的上层已被整体写入时不再单独写入。
+    """
+    document = copy.deepcopy(document)
+    # 需要写入的路径(片段元组)
+    touched: List[Tuple[str, ...]] = []
+    # 数组路径 -> [插入起点, 插入个数, 插入前的长度]；None表示需要整体写入该数组
+    inserts: Dict[Tuple[str, ...], Optional[List[int]]] = {}
+
+    for operation in operations:
+        op = operation.get("op")
+        pointer = operation.get("path", "")
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise InvalidPatchError(f"{op}操作缺少value")
+        segments = _pointer_segments(pointer)
+        parent = _resolve(document, segments[:-1], pointer)
+        last = segments[-1]
+
+        if op == "test":
+            if not _json_equal(_resolve(parent, [last], pointer), operation["value"]):
+                raise PatchConflictError(f"test条件不满足: {pointer}")
+            continue
+        if op not in ("add", "remove", "replace"):
+            raise InvalidPatchError(f"不支持的操作: {op}")
+
+        if isinstance(parent, dict):
+            if op == "add":
+                parent[last] = copy.deepcopy(operation["value"])
+            elif last not in parent:
+                raise InvalidPatchError(f"路径不存在: {pointer}")
+            elif op == "remove":
+                del parent[last]
+            else:
+                parent[last] = copy.deepcopy(operation["value"])
+            touched.append(tuple(segments))
+        elif isinstance(parent, list):
+            array = tuple(segments[:-1])
+            block = inserts.get(array)
+            if op == "add":
+                index = len(parent) if last == "-" else _array_index(parent, last, pointer, allow_end=True)
+                if array not in inserts:
+                    inserts[array] = [index, 1, len(parent)]
+                elif block is not None and block[0] <= index <= block[0] + block[1]:
+                    # 插入到已插入的一段之中或两端，仍是连续的一段
+                    block[1] += 1
+                else:
+                    inserts[array] = None
+                parent.insert(index, copy.deepcopy(operation["value"]))
+            elif op == "remove":
+                del parent[_array_index(parent, last, pointer)]
+                inserts[array] = None
+            else:
+                # 替换元素不改变其他元素的下标，只写入该元素；替换刚插入的元素时随$push写入
+                index = _array_index(parent, last, pointer)
+                parent[index] = copy.deepcopy(operation["value"])
+                if block is None or not block[0] <= index < block[0] + block[1]:
+                    touched.append(tuple(segments))
+        else:
+            raise InvalidPatchError(f"路径不存在: {pointer}")
+
+    # 同一更新中$push的数组内不能再写入其他路径，否则与MongoDB的路径冲突，改为整体写入
+    pushes: Dict[Tuple[str, ...], List[int]] = {}
+    for array, block in inserts.items():
+        if block is None or any(len(path) > len(array) and path[:len(array)] == array
+                                for path in [*touched, *inserts]):
+            touched.append(array)
+        else:
+            pushes[array] = block
+
+    sets: Dict[str, Any] = {}
+    unsets: Dict[str, Any] = {}
+    written: List[Tuple[str, ...]] = []
+    for segments in sorted(dict.fromkeys(touched), key=len):
+        if any(segments[:len(prefix)] == prefix for prefix in written):
+            continue
+        written.append(segments)
+        path = ".".join([root, *segments])
+        try:
+            sets[path] = _resolve(document, list(segments), path)
+        except InvalidPatchError:
+            unsets[path] = ""
+
+    pushed: Dict[str, Any] = {}
+    for array, (start, count, length) in pushes.items():
+        if any(array[:len(prefix)] == prefix for prefix in written):
+            continue
+        path = ".".join([root, *array])
+        values = _resolve(document, list(array), path)[start:start + count]
+        pushed[path] = {"$each": values} if start == length else {"$each": values, "$position": start}
+
+    update: Dict[str, Any] = {}
+    if sets:
+        update["$set"] = sets
+    if unsets:
+        update["$unset"] = unsets
+    if pushed:
+        update["$push"] = pushed
+    return document, update
+
+
+# 压缩后的graph_data及其编码方式在文档中的字段名
+COMPRESSED_GRAPH_FIELD = "graph_data_z"
+GRAPH_CODEC_FIELD = "graph_codec"
+
+
+def _compress(codec: str, raw: bytes, level: int) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(raw, level)
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("GRAPH_COMPRESSION=zstd需要安装zstandard包") from e
+        return zstandard.ZstdCompressor(level=level).compress(raw)
+    raise ValueError(f"不支持的压缩方式: {codec}")
+
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("读取zstd压缩的graph_data需要安装zstandard包") from e
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"不支持的压缩方式: {codec}")
+
+
+def compress_graph_data(graph_data: Dict[str, Any], codec: Optional[str] = None,
+                        threshold: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """BSON编码后超过阈值时返回压缩存储字段{graph_data_z, graph_codec}，否则返回None（内联存储）"""
+    codec = (codec or settings.GRAPH_COMPRESSION).lower()
+    if codec == "none":
+        return None
+    raw = bson.encode(graph_data)
+    if len(raw) < (threshold if threshold is not None else settings.GRAPH_COMPRESSION_THRESHOLD):
+        return None
+    return {
+        COMPRESSED_GRAPH_FIELD: Binary(_compress(codec, raw, settings.GRAPH_COMPRESSION_LEVEL)),
+        GRAPH_CODEC_FIELD: codec
+    }
+
+
+def decompress_graph_data(blob: bytes, codec: str) -> Dict[str, Any]:
+    """还原压缩存储的graph_data"""
+    return bson.decode(_decompress(codec, bytes(blob)))
+
+
+class CountCache:
+    """count结果缓存，按集合命名空间和筛选条件存储，带过期时间"""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Tuple[float, int]]] = {}
+
+    @staticmethod
+    def make_key(filters: Dict[str, Any]) -> str:
+        return json_util.dumps(filters, sort_keys=True)
+
+    def get(self, namespace: str, key: str) -> Optional[int]:
+        entry = self._entries.get(namespace, {}).get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[namespace][key]
+            return None
+        return value
+
+    def set(self, namespace: str, key: str, value: int, ttl: float):
+        self._entries.setdefault(namespace, {})[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, namespace: str):
+        self._entries.pop(namespace, None)
+
+
+# 进程内共享的count缓存（CRUD实例按请求创建）
+count_cache = CountCache()
+
+
+class DocumentCache(abc.ABC):
+    """文档缓存接口，CRUDBase.get等读操作通过它读穿，写操作使对应条目失效
+
+    读穿时先取键的失效代数(generation)再查询数据库，写入缓存时带上该代数：
+    其间键被delete过则不写入，避免并发写之前查到的旧文档在失效之后又被写回缓存。
+    """
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """批量读取，返回与keys一一对应的结果（未命中为None）"""
+        return [await self.get(key) for key in keys]
+
+    @abc.abstractmethod
+    async def generation(self, key: str) -> Any:
+        """键当前的失效代数，在查询数据库之前读取"""
+        ...
+
+    async def generations(self, keys: List[str]) -> List[Any]:
+        """批量读取失效代数，返回与keys一一对应的结果"""
+        return [await self.generation(key) for key in keys]
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Dict[str, Any], generation: Any = None):
+        """写入条目；generation不为空时，键在读取该代数之后被delete过则不写入"""
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, *keys: str):
+        ...
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+
+class LRUDocumentCache(DocumentCache):
+    """进程内LRU缓存，超过max_size按最近最少使用淘汰，条目超过ttl秒后失效"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # 每次delete递增的计数，作为读取时的失效代数
+        self._counter = 0
+        # 最近被delete的键 -> delete时的计数，超过max_size时清理最早的一半
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        # 已清理的记录中最大的计数，代数小于它的写入无法判断，一律跳过
+        self._pruned_below = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_sets = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(value)
+
+    async def generation(self, key: str) -> int:
+        return self._counter
+
+    async def set(self, key: str, value: Dict[str, Any], generation: Optional[int] = None):
+        if generation is not None and (generation < self._pruned_below
+                                       or self._invalidated.get(key, 0) > generation):
+            self.stale_sets += 1
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, dict(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+            self._counter += 1
+            self._invalidated[key] = self._counter
+            self._invalidated.move_to_end(key)
+        if len(self._invalidated) > self.max_size:
+            for _ in range(len(self._invalidated) // 2):
+                _, self._pruned_below = self._invalidated.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_sets": self.stale_sets
+        }
+
+
+class RedisDocumentCache(DocumentCache):
+    """Redis共享缓存，供多个worker/实例共用；淘汰由Redis的maxmemory策略负责
+
+    失效代数保存在gen:前缀的计数键中，delete时递增；带代数的set由脚本比较计数后再写入。
+    """
+
+    # 计数键不变时才写入：KEYS=[文档键, 计数键]，ARGV=[值, 过期毫秒, 读取时的代数]
+    _SET_IF_GENERATION = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[3] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+end
+"""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "doc:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("DOC_CACHE_BACKEND=redis需要安装redis包") from e
+        self._client = redis.from_url(url)
+        self._set_if_generation = self._client.register_script(self._SET_IF_GENERATION)
+        self.ttl = ttl
+        self.prefix = prefix
+        # 计数键需比读穿一次查询的耗时长得多，过期后的重置才不会与读取时的代数相同
+        self.generation_ttl = max(ttl, 600)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._client.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json_util.loads(raw)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        if not keys:
+            return []
+        # 一次MGET往返
+        raws = await self._client.mget([self.prefix + key for key in keys])
+        hits = sum(1 for raw in raws if raw is not None)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return [json_util.loads(raw) if raw is not None else None for raw in raws]
+
+    async def generation(self, key: str) -> str:
+        raw = await self._client.get(self.prefix + "gen:" + key)
+        return raw.decode() if raw is not None else "0"
+
+    async def generations(self, keys: List[str]) -> List[str]:
+        if not keys:
+            return []
+        raws = await self._client.mget([self.prefix + "gen:" + key for key in keys])
+        return [raw.decode() if raw is not None else "0" for raw in raws]
+
+    async def set(self, key: str, value: Dict[str, Any], generation: Optional[str] = None):
+        if generation is None:
+            await self._client.set(self.prefix + key, json_util.dumps(value), px=int(self.ttl * 1000))
+            return
+        await self._set_if_generation(
+            keys=[self.prefix + key, self.prefix + "gen:" + key],
+            args=[json_util.dumps(value), int(self.ttl * 1000), generation]
+        )
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        # 先递增计数再删除：删除之后不会再有带旧代数的写入成功
+        pipeline = self._client.pipeline(transaction=True)
+        for key in keys:
+            pipeline.incr(self.prefix + "gen:" + key)
+            pipeline.pexpire(self.prefix + "gen:" + key, int(self.generation_ttl * 1000))
+        pipeline.delete(*(self.prefix + key for key in keys))
+        await pipeline.execute()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+_document_cache: Optional[DocumentCache] = None
+
+
+def get_document_cache() -> Optional[DocumentCache]:
+    """按DOC_CACHE_BACKEND创建进程内共享的文档缓存，none时返回None
+
+    memory缓存只在本进程内失效：多worker部署时其他worker的写入不会清理本进程的条目，
+    在TTL内可能返回旧文档（及基于旧updated_at的304），此时应使用redis。
+    """
+    global _document_cache
+    if _document_cache is None:
+        backend = settings.DOC_CACHE_BACKEND.lower()
+        if backend == "memory":
+            _document_cache = LRUDocumentCache(settings.DOC_CACHE_MAX_SIZE, settings.DOC_CACHE_TTL_SECONDS)
+        elif backend == "redis":
+            _document_cache = RedisDocumentCache(settings.DOC_CACHE_REDIS_URL, settings.DOC_CACHE_TTL_SECONDS)
+    return _document_cache
+
+
+R = TypeVar('R')
+
+
+class SingleFlight:
+    """合并相同的并发读：同一键的查询执行期间，后到的调用等待并共享第一个调用的结果
+
+    查询在发起调用的请求的截止时间内执行；等待的调用按各自的截止时间等待，
+    发起调用因截止时间用尽失败时，等待的调用在自己的时间预算内重新查询，而不是共享超时错误。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[R]]) -> R:
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # asyncio.wait超时或被取消时不会取消future，不影响发起查询的请求
+            await asyncio.wait([future], timeout=remaining())
+            if not future.done():
+                raise DeadlineExceeded()
+            if future.cancelled():
+                # 发起查询的请求被取消，由当前调用重新执行
+                return await self.do(key, fn)
+            error = future.exception()
+            if error is not None and is_timeout(error):
+                # 发起查询的请求的截止时间可能早于当前请求，按当前请求的预算重新查询
+                self.executed += 1
+                return await fn()
+            return future.result()
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.executed += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        return result
+
+    def forget_prefix(self, prefix: str):
+        """之后的调用不再加入键以prefix开头的进行中查询（已在等待的调用不受影响）"""
+        for key in [key for key in self._calls if key.startswith(prefix)]:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced
+        }
+
+
+# 进程内共享的读合并器
+read_flight = SingleFlight()
+
+
+def coalesce_enabled(route: str) -> bool:
+    """按配置判断某个路由的读操作是否合并"""
+    return settings.COALESCE_READS and route not in settings.COALESCE_READS_EXCLUDE
+
+
 class CRUDBase:
     """CRUD操作基础类"""
+
+    # 写操作需要取回的字段，用于清理除ID之外的缓存键（None表示只按ID清理）
+    invalidation_projection: Optional[Dict[str, int]] = None
     
-    def __init__(self, collection: AsyncIOMotorCollection):
+    def __init__(self, collection: AsyncIOMotorCollection, cache: Optional[DocumentCache] = None,
+                 coalesce: Optional[bool] = None):
         self.collection = collection
+        self.cache = cache if cache is not None else get_document_cache()
+        self.coalesce = settings.COALESCE_READS if coalesce is None else coalesce
     
+    @bounded
     async def create(self, obj_in: BaseModel) -> str:
         """创建文档"""
         # 转换为字典并添加创建时间
@@ -22,62 +642,372 @@ class CRUDBase:
         obj_dict["updated_at"] = datetime.now(timezone.utc)
         
         # 插入文档
-        result = await self.collection.insert_one(obj_dict)
+        result = await self.collection.insert_one(self._to_storage(obj_dict))
+        self._invalidate_counts()
         return str(result.inserted_id)
+
+    @bounded
+    async def create_many(self, objs_in: List[BaseModel], chunk_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """批量创建文档
+
+        按chunk_size分批执行无序insert_many，单条失败(如重复键)不影响其余文档。
+        返回与输入顺序一致的结果列表：成功为{"id": ...}，失败为{"id": None, "error": ..., "code": ...}。
+        """
+        chunk_size = chunk_size or settings.BULK_CHUNK_SIZE
+        now = datetime.now(timezone.utc)
+        documents = []
+        for obj_in in objs_in:
+            obj_dict = obj_in.model_dump(by_alias=True, exclude_unset=True)
+            # 预先分配_id，批量写入部分失败时仍能得到每条成功文档的ID
+            if obj_dict.get("_id") is None:
+                obj_dict["_id"] = ObjectId()
+            obj_dict["created_at"] = now
+            obj_dict["updated_at"] = now
+            documents.append(self._to_storage(obj_dict))
+
+        results: List[Dict[str, Any]] = [{"id": str(document["_id"])} for document in documents]
+        for start in range(0, len(documents), chunk_size):
+            try:
+                await self.collection.insert_many(documents[start:start + chunk_size], ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    results[start + error["index"]] = {
+                        "id": None,
+                        "error": error.get("errmsg"),
+                        "code": error.get("code")
+                    }
+        if documents:
+            self._invalidate_counts()
+        return results
     
-    async def get(self, id: str) -> Optional[Dict[str, Any]]:
-        """根据ID获取文档"""
-        try:
-            obj = await self.collection.find_one({"_id": ObjectId(id)})
+    @bounded
+    async def get(self, id: str, projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        """根据ID获取文档（经文档缓存读穿）
+
+        缓存只保存完整文档：指定projection时命中缓存则在本地取子集，未命中则按投影查询且不写入缓存。
+        """
+        key = self._cache_key(id)
+        if self.cache is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return apply_projection(cached, projection)
+
+        async def fetch() -> Optional[Dict[str, Any]]:
+            cacheable = self.cache is not None and not projection
+            generation = await self.cache.generation(key) if cacheable else None
+            obj = await self.collection.find_one({"_id": ObjectId(id)}, self._storage_projection(projection))
             if obj:
-                obj["id"] = str(obj["_id"])
-                del obj["_id"]
+                obj = self._to_output(obj)
+                if cacheable:
+                    await self.cache.set(key, obj, generation)
             return obj
-        except Exception:
+
+        try:
+            return await self._read(["get", id, projection], fetch)
+        except Exception as e:
+            # 超时由bounded转换为DeadlineExceeded，其余错误(如无效ID)视为文档不存在
+            if is_timeout(e):
+                raise
             return None
     
+    @bounded
+    async def get_updated_at(self, id: str, fresh: bool = False) -> Optional[datetime]:
+        """只取文档的updated_at，用于条件请求；fresh=False时优先读缓存，文档不存在时返回None"""
+        object_id = self._object_id(id)
+        if object_id is None:
+            return None
+        if self.cache is not None and not fresh:
+            cached = await self.cache.get(self._cache_key(id))
+            if cached is not None:
+                return cached.get("updated_at")
+        document = await self.collection.find_one({"_id": object_id}, {"updated_at": 1})
+        return document.get("updated_at") if document else None
+
+    @bounded
+    async def get_many(self, ids: List[str], projection: Optional[Dict[str, int]] = None,
+                       chunk_size: Optional[int] = None) -> Tuple[List[Dict[str, Any]], List[str], List[str]]:
+        """按ID批量获取文档，每chunk_size个ID执行一次$in查询
+
+        返回(按输入顺序排列的文档, 不存在的ID, 格式无效的ID)，重复的ID只返回一次。
+        有文档缓存时先读缓存，只查询未命中的ID；投影规则同get。
+        """
+        chunk_size = chunk_size or settings.BATCH_GET_CHUNK_SIZE
+        object_ids: Dict[str, ObjectId] = {}
+        invalid: List[str] = []
+        for id in ids:
+            if id in object_ids or id in invalid:
+                continue
+            object_id = self._object_id(id)
+            if object_id is None:
+                invalid.append(id)
+            else:
+                object_ids[id] = object_id
+
+        found: Dict[ObjectId, Dict[str, Any]] = {}
+        if self.cache is not None and object_ids:
+            cached = await self.cache.get_many([self._cache_key(str(object_id)) for object_id in object_ids.values()])
+            for object_id, document in zip(object_ids.values(), cached):
+                if document is not None:
+                    found[object_id] = apply_projection(document, projection)
+
+        pending = [object_id for object_id in object_ids.values() if object_id not in found]
+        cacheable = self.cache is not None and not projection and bool(pending)
+        generations: Dict[ObjectId, Any] = {}
+        if cacheable:
+            keys = [self._cache_key(str(object_id)) for object_id in pending]
+            generations = dict(zip(pending, await self.cache.generations(keys)))
+        for start in range(0, len(pending), chunk_size):
+            cursor = self.collection.find(
+                {"_id": {"$in": pending[start:start + chunk_size]}},
+                self._storage_projection(projection),
+                batch_size=chunk_size
+            )
+            async for document in cursor:
+                object_id = document["_id"]
+                document = self._to_output(document)
+                found[object_id] = document
+                if cacheable:
+                    await self.cache.set(self._cache_key(document["id"]), document, generations[object_id])
+
+        documents = [found[object_id] for object_id in object_ids.values() if object_id in found]
+        missing = [id for id, object_id in object_ids.items() if object_id not in found]
+        return documents, missing, invalid
+
+    @bounded
     async def get_multi(self, skip: int = 0, limit: int = 100, 
-                       filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+                       filters: Optional[Dict[str, Any]] = None,
+                       projection: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
         """获取多个文档"""
         if filters is None:
             filters = {}
-            
-        cursor = self.collection.find(filters).skip(skip).limit(limit)
-        results = []
+
+        async def fetch() -> List[Dict[str, Any]]:
+            cursor = self.collection.find(filters, self._storage_projection(projection)).skip(skip).limit(limit)
+            results = []
+            async for document in cursor:
+                results.append(self._to_output(document))
+            return results
+
+        return await self._read(["get_multi", filters, projection, skip, limit], fetch)
+
+    async def iter_documents(self, filters: Optional[Dict[str, Any]] = None,
+                             projection: Optional[Dict[str, int]] = None,
+                             batch_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """通过单个游标逐条产出文档，不在内存中聚合结果（用于导出）"""
+        cursor = self.collection.find(
+            filters or {},
+            self._storage_projection(projection),
+            batch_size=batch_size or settings.EXPORT_BATCH_SIZE
+        )
         async for document in cursor:
-            document["id"] = str(document["_id"])
-            del document["_id"]
-            results.append(document)
-        return results
+            yield self._to_output(document)
+
+    @staticmethod
+    def _keyset_filter(sort_keys: List[str], values: List[Any]) -> Dict[str, Any]:
+        """构建"排在游标之后"的查询条件: (k1, k2, ...) > (v1, v2, ...)"""
+        branches = []
+        for i, key in enumerate(sort_keys):
+            branch = {k: v for k, v in zip(sort_keys[:i], values[:i])}
+            branch[key] = {"$gt": values[i]}
+            branches.append(branch)
+        return branches[0] if len(branches) == 1 else {"$or": branches}
+
+    @bounded
+    async def get_page_after(self, cursor: Optional[str] = None, limit: int = 100,
+                             filters: Optional[Dict[str, Any]] = None,
+                             sort_keys: Optional[List[str]] = None,
+                             projection: Optional[Dict[str, int]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """基于游标的键集分页，返回(文档列表, 下一页游标)
+
+        按sort_keys(末尾总是_id)升序遍历，每页开销与页深无关；
+        cursor为空时从第一页开始，没有更多数据时下一页游标为None。
+        """
+        if filters is None:
+            filters = {}
+        sort_keys = list(sort_keys or [])
+        if not sort_keys or sort_keys[-1] != "_id":
+            sort_keys.append("_id")
+
+        query = filters
+        if cursor:
+            values = decode_cursor(cursor, len(sort_keys))
+            keyset = self._keyset_filter(sort_keys, values)
+            query = {"$and": [filters, keyset]} if filters else keyset
+        # 包含式投影需要带上排序键以生成下一页游标
+        if projection and any(projection.values()):
+            projection = {**projection, **{key: 1 for key in sort_keys}}
+
+        # 多取一条用于判断是否还有下一页
+        cursor_obj = self.collection.find(query, self._storage_projection(projection)).sort(
+            [(key, ASCENDING) for key in sort_keys]
+        ).limit(limit + 1)
+        documents = [document async for document in cursor_obj]
+
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            last = documents[-1]
+            next_cursor = encode_cursor([last.get(key) for key in sort_keys])
+
+        return [self._to_output(document) for document in documents], next_cursor
     
-    async def update(self, id: str, obj_in: BaseModel) -> bool:
-        """更新文档"""
-        # 检查文档是否存在
-        existing = await self.get(id)
-        if not existing:
-            return False
-        
+    @bounded
+    async def update(self, id: str, obj_in: Union[BaseModel, Dict[str, Any]],
+                     return_document: bool = False,
+                     conditions: Optional[Dict[str, Any]] = None) -> Union[bool, Optional[Dict[str, Any]]]:
+        """更新文档（单次往返）
+
+        return_document=False时返回文档是否存在(按matched_count判断，内容未变化也视为成功)；
+        return_document=True时通过find_one_and_update返回更新后的文档，文档不存在时返回None。
+        conditions为附加的查询条件(如{"updated_at": ...}用于比较并更新)，不满足时视同文档不存在。
+        """
+        object_id = self._object_id(id)
+        if object_id is None:
+            return None if return_document else False
+        query = {"_id": object_id, **(conditions or {})}
+
         # 准备更新数据
-        update_data = obj_in.model_dump(by_alias=True, exclude_unset=True)
-        if update_data:
-            update_data["updated_at"] = datetime.now(timezone.utc)
+        if isinstance(obj_in, BaseModel):
+            update_data = obj_in.model_dump(by_alias=True, exclude_unset=True)
+        else:
+            update_data = dict(obj_in)
+        update_data.pop("_id", None)
+        if not update_data:
+            existing = await self.get(id)
+            return existing if return_document else existing is not None
+        update_data["updated_at"] = datetime.now(timezone.utc)
+
+        if return_document:
+            document = await self.collection.find_one_and_update(
+                query,
+                self._storage_update(update_data),
+                return_document=ReturnDocument.AFTER
+            )
+            if document is None:
+                return None
+            self._invalidate_counts()
+            await self._invalidate(id, document)
+            return self._to_output(document)
+
+        if self.invalidation_projection is not None:
+            document = await self.collection.find_one_and_update(
+                query,
+                self._storage_update(update_data),
+                projection=self.invalidation_projection
+            )
+            if document is None:
+                return False
+        else:
             result = await self.collection.update_one(
-                {"_id": ObjectId(id)},
-                {"$set": update_data}
+                query,
+                self._storage_update(update_data)
             )
-            return result.modified_count > 0
-        return False
+            if result.matched_count == 0:
+                return False
+            document = None
+        self._invalidate_counts()
+        await self._invalidate(id, document)
+        return True
     
+    @bounded
     async def delete(self, id: str) -> bool:
         """删除文档"""
-        result = await self.collection.delete_one({"_id": ObjectId(id)})
-        return result.deleted_count > 0
+        object_id = self._object_id(id)
+        if object_id is None:
+            return False
+        if self.invalidation_projection is not None:
+            document = await self.collection.find_one_and_delete(
+                {"_id": object_id},
+                projection=self.invalidation_projection
+            )
+            if document is None:
+                return False
+        else:
+            result = await self.collection.delete_one({"_id": object_id})
+            if result.deleted_count == 0:
+                return False
+            document = None
+        self._invalidate_counts()
+        await self._invalidate(id, document)
+        return True
     
-    async def count(self, filters: Optional[Dict[str, Any]] = None) -> int:
-        """统计文档数量"""
+    @bounded
+    async def count(self, filters: Optional[Dict[str, Any]] = None, exact: bool = False) -> int:
+        """统计文档数量
+
+        默认策略：无筛选条件时使用集合元数据估算(estimated_document_count)，
+        有筛选条件时按条件缓存count_documents结果COUNT_CACHE_TTL_SECONDS秒；
+        exact=True时总是执行精确计数。
+        """
         if filters is None:
             filters = {}
-        return await self.collection.count_documents(filters)
+        if exact:
+            return await self.collection.count_documents(filters)
+        if not filters:
+            return await self.collection.estimated_document_count()
+
+        ttl = settings.COUNT_CACHE_TTL_SECONDS
+        if ttl <= 0:
+            return await self.collection.count_documents(filters)
+        key = count_cache.make_key(filters)
+        total = count_cache.get(self.collection.full_name, key)
+        if total is None:
+            total = await self.collection.count_documents(filters)
+            count_cache.set(self.collection.full_name, key, total, ttl)
+        return total
+
+    async def _read(self, key_parts: List[Any], fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """执行读操作；开启合并时相同(集合, 操作, 条件, 投影, skip, limit)的并发读只查询一次"""
+        if not self.coalesce:
+            return await fetch()
+        key = json_util.dumps([self.collection.full_name, *key_parts])
+        result = await read_flight.do(key, fetch)
+        # 每个调用方拿到各自的副本，互不影响
+        if isinstance(result, list):
+            return [dict(document) for document in result]
+        if isinstance(result, dict):
+            return dict(result)
+        return result
+
+    def _invalidate_counts(self):
+        """写操作后使该集合的count缓存失效，并让之后的读不再合并到写之前发起的查询"""
+        count_cache.invalidate(self.collection.full_name)
+        read_flight.forget_prefix(json_util.dumps([self.collection.full_name])[:-1] + ",")
+
+    @staticmethod
+    def _object_id(id: str) -> Optional[ObjectId]:
+        """将字符串ID转换为ObjectId，格式无效时返回None"""
+        try:
+            return ObjectId(id)
+        except (InvalidId, TypeError):
+            return None
+
+    def _to_storage(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """将待写入的文档转换为存储格式（子类可覆盖）"""
+        return document
+
+    def _storage_update(self, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        """将字段更新转换为存储格式的更新文档（子类可覆盖）"""
+        return {"$set": update_data}
+
+    def _storage_projection(self, projection: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+        """将按模型字段给出的投影转换为存储字段上的投影（子类可覆盖）"""
+        return projection
+
+    def _to_output(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """将数据库文档转换为返回格式（_id转为字符串id）"""
+        document["id"] = str(document.pop("_id"))
+        return document
+
+    def _cache_key(self, id: str) -> str:
+        # ObjectId不区分大小写，按规范形式作为键，不同写法的ID读写同一条目
+        object_id = self._object_id(id)
+        return f"{self.collection.full_name}:{object_id if object_id is not None else id}"
+
+    async def _invalidate(self, id: str, document: Optional[Dict[str, Any]] = None):
+        """写操作后使文档缓存失效，document为写操作返回的文档（子类可据此清理其他缓存键）"""
+        if self.cache is not None:
+            await self.cache.delete(self._cache_key(id))
 
 # 用户CRUD操作
 class CRUDUser(CRUDBase):
@@ -89,27 +1019,522 @@ class CRUDProduct(CRUDBase):
     """产品CRUD操作"""
     pass
 
+# 代码生成结果缓存操作
+class CRUDGeneratedCode(CRUDBase):
+    """代码生成结果缓存CRUD操作
+
+    每个(spec_hash, generator_version)对应一条文档：生成前先插入status=pending的占位文档，
+    占位成功的进程负责生成并写回结果，其余进程轮询等待，从而在多个worker之间只生成一次。
+    """
+
+    @staticmethod
+    def _key(spec_hash: str, generator_version: str) -> Dict[str, Any]:
+        return {"spec_hash": spec_hash, "generator_version": generator_version}
+
+    @bounded
+    async def get_result(self, spec_hash: str, generator_version: str) -> Optional[Dict[str, Any]]:
+        """返回{"status", "outputs", "lease_expires_at"}，不存在时返回None"""
+        return await self.collection.find_one(
+            self._key(spec_hash, generator_version),
+            {"_id": 0, "status": 1, "outputs": 1, "lease_expires_at": 1}
+        )
+
+    @bounded
+    async def acquire(self, spec_hash: str, generator_version: str,
+                      lease_seconds: Optional[float] = None) -> bool:
+        """尝试占有生成任务；已有结果或他人正在生成(占位未过期)时返回False"""
+        now = datetime.now(timezone.utc)
+        lease_expires_at = now + timedelta(seconds=lease_seconds or settings.GENERATION_LEASE_SECONDS)
+        try:
+            await self.collection.insert_one({
+                **self._key(spec_hash, generator_version),
+                "status": "pending",
+                "lease_expires_at": lease_expires_at,
+                "created_at": now,
+                "updated_at": now
+            })
+            return True
+        except DuplicateKeyError:
+            # 接管已过期的占位（原生成进程已退出）
+            result = await self.collection.update_one(
+                {
+                    **self._key(spec_hash, generator_version),
+                    "status": "pending",
+                    "lease_expires_at": {"$lt": now}
+                },
+                {"$set": {"lease_expires_at": lease_expires_at, "updated_at": now}}
+            )
+            return result.modified_count > 0
+
+    @bounded
+    async def store(self, spec_hash: str, generator_version: str, outputs: List[str]) -> bool:
+        """写入生成结果；超过GENERATED_CODE_MAX_BYTES时不保存并释放占位"""
+        size = sum(len(output.encode("utf-8")) for output in outputs)
+        if size > settings.GENERATED_CODE_MAX_BYTES:
+            await self.release(spec_hash, generator_version)
+            return False
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            self._key(spec_hash, generator_version),
+            {
+                "$set": {
+                    "status": "done",
+                    "outputs": list(outputs),
+                    "size": size,
+                    "created_at": now,
+                    "updated_at": now
+                },
+                "$unset": {"lease_expires_at": ""}
+            },
+            upsert=True
+        )
+        return True
+
+    @bounded
+    async def release(self, spec_hash: str, generator_version: str):
+        """生成失败时删除占位，让等待者自行生成"""
+        await self.collection.delete_one({**self._key(spec_hash, generator_version), "status": "pending"})
+
 # Graph操作
 class CRUDGraph(CRUDBase):
     """Graph CRUD操作"""
-    def __init__(self, collection: AsyncIOMotorCollection):
-        super().__init__(collection)
+
+    invalidation_projection = {"user_id": 1, "graph_id": 1}
+
+    def __init__(self, collection: AsyncIOMotorCollection, cache: Optional[DocumentCache] = None,
+                 coalesce: Optional[bool] = None):
+        super().__init__(collection, cache, coalesce)
         self.graph_collection = collection.database["graphs"]
 
-    async def set_graph(self, user_id: str, graph_id: str, graph_data: Dict[str, Any]):
-        """设置用户的Graph数据"""
-        await self.graph_collection.update_one(
-            {"user_id": user_id, "graph_id": graph_id},
-            {"$set": {"graph_data": graph_data}},
-            upsert=True
+    def _graph_cache_key(self, user_id: str, graph_id: str) -> str:
+        return f"{self.graph_collection.full_name}:graph:{user_id}:{graph_id}"
+
+    def _to_storage(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        compressed = compress_graph_data(document["graph_data"]) if "graph_data" in document else None
+        if compressed:
+            document = {key: value for key, value in document.items() if key != "graph_data"}
+            document.update(compressed)
+        return document
+
+    def _storage_projection(self, projection: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+        # graph_data可能以压缩字段存储，投影时两者同进同出；不需要graph_data时不读取压缩数据
+        if projection and "graph_data" in projection:
+            flag = projection["graph_data"]
+            projection = {**projection, COMPRESSED_GRAPH_FIELD: flag, GRAPH_CODEC_FIELD: flag}
+        return projection
+
+    def _to_output(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        # 只有实际取回了压缩数据(即需要graph_data)时才解压
+        blob = document.pop(COMPRESSED_GRAPH_FIELD, None)
+        codec = document.pop(GRAPH_CODEC_FIELD, None)
+        if blob is not None:
+            document["graph_data"] = decompress_graph_data(blob, codec)
+        return super()._to_output(document)
+
+    def _storage_update(self, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        if "graph_data" not in update_data:
+            return super()._storage_update(update_data)
+        fields = {key: value for key, value in update_data.items() if key != "graph_data"}
+        update = self._graph_data_update(update_data["graph_data"])
+        update["$set"].update(fields)
+        return update
+
+    @staticmethod
+    def _graph_data_update(graph_data: Dict[str, Any]) -> Dict[str, Any]:
+        """整体写入graph_data的更新：按配置选择压缩或内联存储，并清理另一种形式的旧字段"""
+        compressed = compress_graph_data(graph_data)
+        if compressed:
+            return {"$set": compressed, "$unset": {"graph_data": ""}}
+        return {
+            "$set": {"graph_data": graph_data},
+            "$unset": {COMPRESSED_GRAPH_FIELD: "", GRAPH_CODEC_FIELD: ""}
+        }
+
+    async def _invalidate(self, id: str, document: Optional[Dict[str, Any]] = None):
+        await super()._invalidate(id, document)
+        if self.cache is not None and document and "user_id" in document and "graph_id" in document:
+            await self.cache.delete(self._graph_cache_key(document["user_id"], document["graph_id"]))
+
+    @bounded
+    async def set_graph(self, user_id: str, graph_id: str, graph_data: Dict[str, Any],
+                        expected_updated_at: Optional[datetime] = None) -> Optional[datetime]:
+        """设置用户的Graph数据，返回写入的updated_at
+
+        启用写缓冲(GRAPH_WRITE_BEHIND)时只放入缓冲区，由后台批量写入。
+        expected_updated_at不为空时直接写库，仅当graph存在且updated_at未变化时写入，否则返回None。
+        """
+        if expected_updated_at is None and graph_write_buffer.running:
+            return graph_write_buffer.put(user_id, graph_id, graph_data)
+        query: Dict[str, Any] = {"user_id": user_id, "graph_id": graph_id}
+        if expected_updated_at is not None:
+            # 比较的是已落库的数据，先写入该graph在缓冲中的保存
+            await graph_write_buffer.flush([(user_id, graph_id)])
+            query["updated_at"] = expected_updated_at
+        updated_at = datetime.now(timezone.utc)
+        update = self._graph_data_update(graph_data)
+        update["$set"]["updated_at"] = updated_at
+        update["$inc"] = {"version": 1}
+        # 只取回_id，用于同时清理按ID缓存的文档
+        graph = await self.graph_collection.find_one_and_update(
+            query,
+            update,
+            projection={"_id": 1},
+            upsert=expected_updated_at is None,
+            return_document=ReturnDocument.AFTER
         )
+        if graph is None:
+            return None
+        self._invalidate_counts()
+        await self._invalidate(str(graph["_id"]), {"user_id": user_id, "graph_id": graph_id})
+        return updated_at
+
+    @bounded
+    async def get_graph_updated_at(self, user_id: str, graph_id: str, fresh: bool = False) -> Optional[datetime]:
+        """只取graph的updated_at，用于条件请求
+
+        fresh=False时依次以写缓冲、缓存为准；fresh=True时先写入缓冲中的保存再查询数据库。
+        """
+        if fresh:
+            await graph_write_buffer.flush([(user_id, graph_id)])
+        else:
+            pending = graph_write_buffer.get(user_id, graph_id)
+            if pending is not None:
+                return pending.updated_at
+            if self.cache is not None:
+                cached = await self.cache.get(self._graph_cache_key(user_id, graph_id))
+                if cached is not None:
+                    return cached.get("updated_at")
+        graph = await self.graph_collection.find_one({"user_id": user_id, "graph_id": graph_id}, {"updated_at": 1})
+        return graph.get("updated_at") if graph else None
     
-    async def get_graph(self, user_id: str, graph_id: str) -> Optional[Dict[str, Any]]:
-        """获取用户的Graph数据"""
-        graph = await self.graph_collection.find_one({"user_id": user_id, "graph_id": graph_id})
-        if graph:
-            graph["id"] = str(graph["_id"])
-            del graph["_id"]
-        return graph
+    @bounded
+    async def get_graph(self, user_id: str, graph_id: str,
+                        projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        """获取用户的Graph数据（经文档缓存读穿，投影规则同get）
+
+        写缓冲中有尚未落库的保存时，以缓冲中的graph_data为准（读己之写）。
+        """
+        pending = graph_write_buffer.get(user_id, graph_id)
+        if pending is None:
+            return await self._load_graph(user_id, graph_id, projection)
+
+        graph = await self._load_graph(user_id, graph_id)
+        if graph is None:
+            # 尚未落库的新graph
+            graph = {"user_id": user_id, "graph_id": graph_id, "version": 0}
+        saves = 0 if pending.written else pending.saves
+        graph = {
+            **graph,
+            "graph_data": pending.graph_data,
+            "version": (graph.get("version") or 0) + saves,
+            "updated_at": pending.updated_at
+        }
+        return apply_projection(graph, projection)
+
+    @bounded
+    async def get_many(self, ids: List[str], projection: Optional[Dict[str, int]] = None,
+                       chunk_size: Optional[int] = None) -> Tuple[List[Dict[str, Any]], List[str], List[str]]:
+        if not graph_write_buffer.running:
+            return await super().get_many(ids, projection, chunk_size)
+
+        # 与get_graph一致，以写缓冲中尚未落库的保存为准；需要user_id/graph_id定位缓冲，先取完整文档再投影
+        documents, missing, invalid = await super().get_many(ids, None, chunk_size)
+        merged = []
+        for document in documents:
+            pending = graph_write_buffer.get(document.get("user_id"), document.get("graph_id"))
+            if pending is not None:
+                saves = 0 if pending.written else pending.saves
+                document = {
+                    **document,
+                    "graph_data": pending.graph_data,
+                    "version": (document.get("version") or 0) + saves,
+                    "updated_at": pending.updated_at
+                }
+            merged.append(apply_projection(document, projection))
+        return merged, missing, invalid
+
+    async def _load_graph(self, user_id: str, graph_id: str,
+                          projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        key = self._graph_cache_key(user_id, graph_id)
+        if self.cache is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return apply_projection(cached, projection)
+
+        async def fetch() -> Optional[Dict[str, Any]]:
+            cacheable = self.cache is not None and not projection
+            generation = await self.cache.generation(key) if cacheable else None
+            graph = await self.graph_collection.find_one(
+                {"user_id": user_id, "graph_id": graph_id},
+                self._storage_projection(projection)
+            )
+            if graph:
+                graph = self._to_output(graph)
+                if cacheable:
+                    await self.cache.set(key, graph, generation)
+            return graph
+
+        return await self._read(["get_graph", user_id, graph_id, projection], fetch)
+
+    @bounded
+    async def patch_graph(self, user_id: str, graph_id: str, operations: List[Dict[str, Any]],
+                          expected_version: Optional[int] = None) -> Optional[int]:
+        """按JSON Patch局部更新graph_data，只写入变化的子路径
+
+        读取当前的graph_data，按顺序应用补丁后以一次原子更新写入，更新以读取时的version和updated_at为条件；
+        其间graph被并发修改时重新读取并应用。压缩存储的graph_data无法按子路径更新，整体写入。
+        expected_version不为空时进行乐观并发检查；返回更新后的版本号，Graph不存在时返回None。
+        版本号或test条件不满足时抛出PatchConflictError。
+        """
+        # 补丁基于已落库的数据，先写入该graph在缓冲中的保存
+        await graph_write_buffer.flush([(user_id, graph_id)])
+        for _ in range(3):
+            current = await self.graph_collection.find_one(
+                {"user_id": user_id, "graph_id": graph_id},
+                {"graph_data": 1, COMPRESSED_GRAPH_FIELD: 1, GRAPH_CODEC_FIELD: 1, "version": 1, "updated_at": 1}
+            )
+            if current is None:
+                return None
+            # 尚未保存过版本号的文档视为版本0
+            version = current.get("version")
+            if expected_version is not None and (version or 0) != expected_version:
+                raise PatchConflictError("graph版本已变化", version or 0)
+
+            compressed = COMPRESSED_GRAPH_FIELD in current
+            if compressed:
+                graph_data = decompress_graph_data(current[COMPRESSED_GRAPH_FIELD], current[GRAPH_CODEC_FIELD])
+            else:
+                graph_data = current.get("graph_data", {})
+            try:
+                graph_data, update = json_patch_to_update(graph_data, operations, "graph_data")
+            except PatchConflictError as e:
+                e.current_version = version or 0
+                raise
+            if compressed:
+                update = self._graph_data_update(graph_data)
+
+            update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+            update["$inc"] = {"version": 1}
+            # version为None时匹配没有该字段的文档
+            graph = await self.graph_collection.find_one_and_update(
+                {"_id": current["_id"], "version": version, "updated_at": current.get("updated_at")},
+                update,
+                projection={"version": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if graph is not None:
+                self._invalidate_counts()
+                await self._invalidate(str(graph["_id"]), {"user_id": user_id, "graph_id": graph_id})
+                return graph["version"]
+        raise PatchConflictError("graph在更新过程中被并发修改")
+
+
+class _PendingGraph:
+    """写缓冲中某个graph最后一次保存的数据"""
+    __slots__ = ("graph_data", "saves", "updated_at", "written", "retried")
+
+    def __init__(self, graph_data: Dict[str, Any], saves: int = 1):
+        self.graph_data = graph_data
+        # 合并的保存次数，落库时版本号按此递增，与逐次写入一致
+        self.saves = saves
+        # 最后一次保存的时间，落库时写入updated_at
+        self.updated_at = datetime.now(timezone.utc)
+        # 已写入数据库、尚未清理缓存
+        self.written = False
+        # 已因并发插入的重复键错误重试过一次
+        self.retried = False
+
+
+class GraphWriteBuffer:
+    """set_graph的写缓冲
+
+    按(user_id, graph_id)合并尚未落库的保存，只保留最后一次；每隔flush_interval秒或缓冲数达到max_pending时，
+    以一次无序bulk_write写入全部缓冲。写入失败(网络、任务被取消等)的保存重新放回缓冲；
+    单条写错误中并发upsert引起的重复键错误重试一次，其余记录日志并在stats的recent_errors中保留后丢弃。
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.collection: Optional[AsyncIOMotorCollection] = None
+        self._pending: "OrderedDict[Tuple[str, str], _PendingGraph]" = OrderedDict()
+        # 正在写入的保存，写入完成前读仍以其为准
+        self._flushing: Dict[Tuple[str, str], _PendingGraph] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # 最近被丢弃的保存及其错误
+        self.recent_errors: "deque[Dict[str, Any]]" = deque(maxlen=20)
+        self.saves = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+        # 在当前事件循环中重新创建同步原语
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台写入并写入剩余的缓冲
+
+        不取消后台任务：通知其结束并等待进行中的写入完成，避免已从缓冲取出的保存丢失。
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"graph写缓冲关闭时写入失败，{len(self._pending)}个graph的保存未落库: {e}")
+
+    def put(self, user_id: str, graph_id: str, graph_data: Dict[str, Any]) -> datetime:
+        """放入一次保存，返回其updated_at"""
+        key = (user_id, graph_id)
+        previous = self._pending.pop(key, None)
+        pending = self._pending[key] = _PendingGraph(graph_data, previous.saves + 1 if previous else 1)
+        self.saves += 1
+        if previous is not None:
+            self.coalesced += 1
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+        return pending.updated_at
+
+    def get(self, user_id: str, graph_id: str) -> Optional[_PendingGraph]:
+        key = (user_id, graph_id)
+        return self._pending.get(key) or self._flushing.get(key)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"graph写缓冲写入失败: {e}")
+
+    async def flush(self, keys: Optional[List[Tuple[str, str]]] = None):
+        """写入缓冲中的保存；keys为空时写入全部"""
+        async with self._flush_lock:
+            if keys is None:
+                batch, self._pending = self._pending, OrderedDict()
+            else:
+                batch = OrderedDict((key, self._pending.pop(key)) for key in keys if key in self._pending)
+            if not batch or self.collection is None:
+                return
+            self._flushing = dict(batch)
+            try:
+                await self._write(batch)
+            finally:
+                self._flushing = {}
+
+    async def _write(self, batch: "OrderedDict[Tuple[str, str], _PendingGraph]"):
+        keys = list(batch)
+        operations = []
+        for (user_id, graph_id), pending in batch.items():
+            update = CRUDGraph._graph_data_update(pending.graph_data)
+            update["$set"]["updated_at"] = pending.updated_at
+            update["$inc"] = {"version": pending.saves}
+            operations.append(UpdateOne({"user_id": user_id, "graph_id": graph_id}, update, upsert=True))
+
+        failed = set()
+        retried = set()
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                key = keys[error["index"]]
+                pending = batch[key]
+                if error.get("code") == 11000 and not pending.retried:
+                    # 并发upsert同时插入了同一graph，重试时按已存在的文档更新
+                    pending.retried = True
+                    retried.add(error["index"])
+                    self._requeue(key, pending)
+                    continue
+                failed.add(error["index"])
+                self._record_error(key, error)
+        except BaseException:
+            # 整批未确认写入(包括任务被取消)，放回缓冲等待下次写入；
+            # 实际已写入时重写同样的数据，只有版本号多递增
+            for key, pending in batch.items():
+                self._requeue(key, pending)
+            self.failed += len(batch)
+            raise
+        self.flushes += 1
+        self.written += len(batch) - len(failed) - len(retried)
+        self.failed += len(failed)
+
+        for index, key in enumerate(keys):
+            if index not in retried:
+                batch[key].written = True
+        await self._invalidate([key for index, key in enumerate(keys) if index not in failed and index not in retried])
+
+    def _requeue(self, key: Tuple[str, str], pending: _PendingGraph):
+        """放回缓冲等待下次写入（缓冲中已有更新的保存时以新的为准）"""
+        newer = self._pending.get(key)
+        if newer is None:
+            self._pending[key] = pending
+        else:
+            newer.saves += pending.saves
+
+    def _record_error(self, key: Tuple[str, str], error: Dict[str, Any]):
+        user_id, graph_id = key
+        logger.error(
+            f"graph ({user_id}, {graph_id}) 写入失败，已丢弃: [{error.get('code')}] {error.get('errmsg')}"
+        )
+        self.recent_errors.append({
+            "user_id": user_id,
+            "graph_id": graph_id,
+            "code": error.get("code"),
+            "errmsg": error.get("errmsg"),
+            "at": datetime.now(timezone.utc)
+        })
+
+    async def _invalidate(self, keys: List[Tuple[str, str]]):
+        """清理count缓存以及按graph键和按ID缓存的文档"""
+        if not keys:
+            return
+        crud = CRUDGraph(self.collection)
+        crud._invalidate_counts()
+        if crud.cache is None:
+            return
+        cursor = self.collection.find(
+            {"$or": [{"user_id": user_id, "graph_id": graph_id} for user_id, graph_id in keys]},
+            {"_id": 1, "user_id": 1, "graph_id": 1}
+        )
+        async for document in cursor:
+            await crud._invalidate(str(document["_id"]), document)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "pending": len(self._pending),
+            "saves": self.saves,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+            "recent_errors": list(self.recent_errors)
+        }
 
 
+# graph写缓冲实例，GRAPH_WRITE_BEHIND开启时由应用启动
+graph_write_buffer = GraphWriteBuffer(
+    flush_interval=settings.GRAPH_WRITE_BEHIND_FLUSH_SECONDS,
+    max_pending=settings.GRAPH_WRITE_BEHIND_MAX_PENDING
+)
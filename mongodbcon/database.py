@@ -1,5 +1,11 @@
+from typing import Any, Dict, List, Optional, Type
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
 from config import settings
+from models import DOCUMENT_MODELS
+from metrics import mongo_event_listeners
+from slow_queries import slow_query_recorder
+import asyncio
 import logging
 
 # 配置日志
@@ -12,17 +18,29 @@ class Database:
     db: AsyncIOMotorDatabase = None
     
     @classmethod
-    async def connect(cls):
-        """建立数据库连接"""
+    async def connect(cls, models: Optional[List[Type]] = None):
+        """建立数据库连接，并同步models(默认为全部DOCUMENT_MODELS)的索引"""
         try:
-            # 创建异步MongoDB客户端
-            cls.client = AsyncIOMotorClient(
-                settings.MONGO_URI,
-                maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
-                minPoolSize=settings.MONGO_MIN_POOL_SIZE,
-                serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
-                connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS
-            )
+            if settings.MONGO_BACKEND.lower() == "memory":
+                # 进程内后端，不需要mongod
+                from memory_backend import MemoryClient
+                cls.client = MemoryClient()
+            else:
+                event_listeners = mongo_event_listeners()
+                if settings.SLOW_QUERY_MS > 0:
+                    event_listeners.append(slow_query_recorder)
+
+                # 创建异步MongoDB客户端
+                cls.client = AsyncIOMotorClient(
+                    settings.MONGO_URI,
+                    maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+                    # 命令耗时、连接池指标和慢查询记录
+                    event_listeners=event_listeners
+                )
+            slow_query_recorder.bind(asyncio.get_running_loop(), cls.client)
             
             # 获取数据库实例
             cls.db = cls.client[settings.MONGO_DB_NAME]
@@ -34,11 +52,63 @@ class Database:
         except Exception as e:
             logger.error(f"连接MongoDB数据库失败: {e}")
             raise
+
+        await cls.ensure_indexes(create=settings.MONGO_CREATE_INDEXES, models=models)
+    
+    @classmethod
+    async def ensure_indexes(cls, create: bool = True, models: Optional[List[Type]] = None):
+        """按模型Config.indexes同步索引：create为True时创建缺失的索引，未声明的索引只记录日志不删除
+
+        用户名、(user_id, graph_id)等的唯一性只由唯一索引保证，声明的唯一索引不存在或无法创建时
+        抛出RuntimeError阻止服务启动；普通索引创建失败只记录日志。
+        """
+        for model in models if models is not None else DOCUMENT_MODELS:
+            indexes = getattr(model.Config, "indexes", [])
+            collection = cls.db[model.Config.collection]
+            existing = await collection.index_information()
+            declared = {index.document["name"] for index in indexes}
+
+            undeclared = set(existing) - declared - {"_id_"}
+            if undeclared:
+                logger.warning(f"集合{collection.name}存在未声明的索引: {sorted(undeclared)}")
+
+            missing = [index for index in indexes if index.document["name"] not in existing]
+            if missing and create:
+                # 逐个创建，某个索引失败不影响其他索引
+                for index in missing:
+                    try:
+                        await collection.create_indexes([index])
+                        logger.info(f"集合{collection.name}已创建索引: {index.document['name']}")
+                    except OperationFailure as e:
+                        # 已有数据违反唯一约束或索引定义冲突
+                        logger.error(f"集合{collection.name}创建索引{index.document['name']}失败: {e}")
+                existing = await collection.index_information()
+
+            unconfirmed = [
+                index.document["name"] for index in indexes
+                if index.document.get("unique") and not cls._has_unique_index(existing, index.document)
+            ]
+            if unconfirmed:
+                raise RuntimeError(
+                    f"集合{collection.name}缺少唯一索引{unconfirmed}，唯一性无法保证；"
+                    f"请清理重复数据后重启，或手动创建索引(MONGO_CREATE_INDEXES=false时不会自动创建)"
+                )
+
+    @staticmethod
+    def _has_unique_index(existing: Dict[str, Any], document: Dict[str, Any]) -> bool:
+        """index_information中是否有同名、同键且唯一的索引"""
+        information = existing.get(document["name"])
+        return (
+            information is not None
+            and bool(information.get("unique"))
+            and list(information["key"]) == list(document["key"].items())
+        )
     
     @classmethod
     async def disconnect(cls):
         """关闭数据库连接"""
         if cls.client:
+            slow_query_recorder.unbind()
             cls.client.close()
             logger.info("MongoDB数据库连接已关闭")
     
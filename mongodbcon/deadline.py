@@ -0,0 +1,92 @@
+"""请求截止时间
+
+路由依赖request_deadline按路由配置(REQUEST_TIMEOUT_MS/REQUEST_TIMEOUT_ROUTES)或X-Request-Timeout-Ms请求头
+确定本次请求的截止时间。CRUD方法经bounded在剩余时间内执行：驱动(pymongo.timeout)据此为每条命令设置maxTimeMS，
+并限制等待连接和选择服务器的时间，客户端不再需要结果时服务端也随之停止执行。
+时间用尽时抛出DeadlineExceeded，返回504。
+"""
+import functools
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+import pymongo
+from fastapi import HTTPException, Request, status
+from pymongo.errors import PyMongoError
+from config import settings
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+TIMEOUT_HEADER = "x-request-timeout-ms"
+
+# 当前请求的截止时间(time.monotonic)，None表示不限制
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    """请求的时间预算已用尽；是HTTPException，路由中的except HTTPException会原样抛出"""
+
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="请求处理超时")
+
+
+async def request_deadline(request: Request) -> AsyncIterator[None]:
+    """路由依赖：在请求处理期间设置截止时间
+
+    默认取REQUEST_TIMEOUT_ROUTES中该路由函数名的配置，否则为REQUEST_TIMEOUT_MS；
+    请求头X-Request-Timeout-Ms可另行指定，最长不超过REQUEST_TIMEOUT_MAX_MS。
+    """
+    route = request.scope.get("route")
+    timeout_ms = settings.REQUEST_TIMEOUT_ROUTES.get(getattr(route, "name", None), settings.REQUEST_TIMEOUT_MS)
+    header = request.headers.get(TIMEOUT_HEADER)
+    if header is not None:
+        try:
+            timeout_ms = int(header)
+            if timeout_ms <= 0:
+                raise ValueError
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="X-Request-Timeout-Ms必须为正整数(毫秒)"
+            )
+        timeout_ms = min(timeout_ms, settings.REQUEST_TIMEOUT_MAX_MS)
+    token = _deadline.set(time.monotonic() + timeout_ms / 1000 if timeout_ms > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的时间(秒)，不限制时返回None；已用尽时抛出DeadlineExceeded"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+
+def is_timeout(error: BaseException) -> bool:
+    """是否为截止时间用尽导致的错误（DeadlineExceeded或驱动的超时错误）"""
+    return isinstance(error, DeadlineExceeded) or (isinstance(error, PyMongoError) and error.timeout)
+
+
+def bounded(method: F) -> F:
+    """在当前请求剩余的时间内执行异步CRUD方法，驱动的超时错误转换为DeadlineExceeded"""
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        budget = remaining()
+        if budget is None:
+            return await method(*args, **kwargs)
+        try:
+            # 嵌套调用时驱动取内外层中较早的截止时间
+            with pymongo.timeout(budget):
+                return await method(*args, **kwargs)
+        except PyMongoError as e:
+            if is_timeout(e):
+                raise DeadlineExceeded() from e
+            raise
+
+    return wrapper
@@ -1,8 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+from config import settings
+from crud import graph_write_buffer
 from database import Database
+from models import Graph
 from routes import router
+from metrics import MetricsMiddleware, mark_process_dead, render_metrics
+from admission import AdmissionMiddleware, admission_controller
 from contextlib import asynccontextmanager
 
 # 定义应用的生命周期管理器
@@ -10,9 +15,13 @@ from contextlib import asynccontextmanager
 async def lifespan(app: FastAPI):
     # 应用启动时连接数据库
     await Database.connect()
+    if settings.GRAPH_WRITE_BEHIND:
+        graph_write_buffer.start(Database.get_db()[Graph.Config.collection])
     yield
-    # 应用关闭时断开数据库连接
+    # 写入缓冲中尚未落库的graph后再断开数据库连接
+    await graph_write_buffer.stop()
     await Database.disconnect()
+    mark_process_dead()
 
 # 创建FastAPI应用，使用lifespan参数
 app = FastAPI(
@@ -22,6 +31,14 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# 准入控制（最先添加，位于CORS之内，503响应同样带CORS头）
+if settings.ADMISSION_CONTROL:
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission_controller,
+        retry_after=settings.ADMISSION_RETRY_AFTER_SECONDS
+    )
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +48,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求计数与耗时指标
+app.add_middleware(MetricsMiddleware)
+
 # 注册路由
 app.include_router(router)
 
@@ -43,6 +63,13 @@ async def health_check():
         "service": "MongoDB FastAPI Service"
     }
 
+# Prometheus指标
+@app.get("/metrics", tags=["health"])
+async def metrics():
+    """导出Prometheus指标"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # 根路径
 @app.get("/", tags=["root"])
 async def root():
@@ -0,0 +1,1101 @@
+"""进程内MongoDB后端（MONGO_BACKEND=memory）
+
+提供与Motor接口兼容的客户端/数据库/集合实现，覆盖CRUD层用到的操作，
+用于在没有mongod的环境下运行、测试和压测整个API。
+
+- 文档以BSON编码保存，读写语义（类型转换、无时区的UTC datetime、返回副本）与真实驱动一致
+- 支持常用查询操作符、点路径、投影、排序，以及$set/$unset/$inc/$push/$pull/$addToSet/$setOnInsert
+- 索引：唯一约束、TTL过期，等值条件命中索引时只检查候选文档
+- 不产生命令监听事件，慢查询记录和MongoDB命令指标在该后端下为空
+- 查询遵守maxTimeMS(max_time_ms)和pymongo.timeout()，超时抛出ExecutionTimeout
+
+所有操作在事件循环线程中同步完成，单个操作天然原子。
+"""
+import bisect
+import functools
+import itertools
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+import bson
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import (
+    BulkWriteError, DocumentTooLarge, DuplicateKeyError, ExecutionTimeout, OperationFailure, WriteError
+)
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+try:
+    from pymongo import _csot
+except ImportError:  # 驱动版本低于4.2，不支持pymongo.timeout()
+    _csot = None
+
+
+# 单个文档的BSON大小上限，与服务端一致
+MAX_BSON_SIZE = 16 * 1024 * 1024
+# TTL索引的过期检查间隔（秒），与服务端TTL监视器的默认周期一致
+TTL_MONITOR_INTERVAL = 60
+
+_MISSING = object()
+
+
+def _time_limit(max_time_ms: Optional[int]) -> Optional[float]:
+    """本次操作可用的时间(秒)：maxTimeMS与pymongo.timeout()剩余时间中较小者，都未设置时为None"""
+    limits = []
+    if max_time_ms:
+        limits.append(max_time_ms / 1000)
+    remaining = _csot.remaining() if _csot is not None else None
+    if remaining is not None:
+        limits.append(remaining)
+    if not limits:
+        return None
+    if min(limits) <= 0:
+        raise _time_exceeded()
+    return min(limits)
+
+
+def _time_exceeded() -> ExecutionTimeout:
+    return ExecutionTimeout(
+        "operation exceeded time limit", 50,
+        {"ok": 0, "errmsg": "operation exceeded time limit", "code": 50, "codeName": "MaxTimeMSExpired"}
+    )
+
+
+def _normalize(value: Any) -> Any:
+    """经BSON往返，使查询条件和写入值与存储的文档类型一致（如有时区的datetime转为UTC）"""
+    return bson.decode(bson.encode({"v": value}))["v"]
+
+
+# 常见类型的比较顺序，避免逐个isinstance判断
+_TYPE_RANKS = {type(None): 1, int: 2, float: 2, str: 3, dict: 4, list: 5, bytes: 6, ObjectId: 7, bool: 8, datetime: 9}
+
+
+def _type_rank(value: Any) -> int:
+    """BSON类型的比较顺序"""
+    rank = _TYPE_RANKS.get(type(value))
+    if rank is not None:
+        return rank
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _compare(a: Any, b: Any) -> int:
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if isinstance(a, dict):
+        for (key_a, value_a), (key_b, value_b) in zip(a.items(), b.items()):
+            result = _compare(key_a, key_b) or _compare(value_a, value_b)
+            if result:
+                return result
+        return _compare(len(a), len(b))
+    if isinstance(a, list):
+        for value_a, value_b in zip(a, b):
+            result = _compare(value_a, value_b)
+            if result:
+                return result
+        return _compare(len(a), len(b))
+    if a is None or a == b:
+        return 0
+    try:
+        return -1 if a < b else 1
+    except TypeError:
+        return 0
+
+
+def _equal(a: Any, b: Any) -> bool:
+    return _type_rank(a) == _type_rank(b) and _compare(a, b) == 0
+
+
+def _lookup(document: Any, path: str) -> List[Any]:
+    """返回点路径上的全部取值（经过数组时按元素展开），字段不存在时返回空列表"""
+    values = [document]
+    for segment in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if segment in value:
+                    found.append(value[segment])
+            elif isinstance(value, list):
+                if segment.isdigit():
+                    if int(segment) < len(value):
+                        found.append(value[int(segment)])
+                else:
+                    found.extend(item[segment] for item in value if isinstance(item, dict) and segment in item)
+        values = found
+    return values
+
+
+def _is_operator_dict(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and all(key.startswith("$") for key in value)
+
+
+def _match_value(values: List[Any], condition: Any) -> bool:
+    """values为_lookup的结果，condition为字段条件（操作符文档或等值）"""
+    if _is_operator_dict(condition):
+        return all(_match_operator(values, op, operand) for op, operand in condition.items())
+    return _match_equal(values, condition)
+
+
+def _match_equal(values: List[Any], expected: Any) -> bool:
+    if expected is None and not values:
+        return True
+    for value in values:
+        if _equal(value, expected):
+            return True
+        if isinstance(value, list) and any(_equal(item, expected) for item in value):
+            return True
+    return False
+
+
+def _expand(values: List[Any]) -> Iterable[Any]:
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _match_operator(values: List[Any], op: str, operand: Any) -> bool:
+    if op == "$eq":
+        return _match_equal(values, operand)
+    if op == "$ne":
+        return not _match_equal(values, operand)
+    if op == "$in":
+        return any(_match_equal(values, item) for item in operand)
+    if op == "$nin":
+        return not any(_match_equal(values, item) for item in operand)
+    if op == "$exists":
+        return bool(values) == bool(operand)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        for value in _expand(values):
+            if _type_rank(value) != _type_rank(operand):
+                continue
+            result = _compare(value, operand)
+            if (op == "$gt" and result > 0) or (op == "$gte" and result >= 0) \
+                    or (op == "$lt" and result < 0) or (op == "$lte" and result <= 0):
+                return True
+        return False
+    if op == "$not":
+        return not _match_value(values, operand)
+    if op == "$size":
+        return any(isinstance(value, list) and len(value) == operand for value in values)
+    if op == "$elemMatch":
+        return any(
+            isinstance(value, list) and any(_match_element(item, operand) for item in value)
+            for value in values
+        )
+    raise OperationFailure(f"内存后端不支持查询操作符: {op}", code=2)
+
+
+def _match_element(element: Any, condition: Any) -> bool:
+    """数组元素是否满足条件（$elemMatch/$pull）"""
+    if _is_operator_dict(condition):
+        return _match_value([element], condition)
+    if isinstance(condition, dict):
+        return isinstance(element, dict) and match(element, condition)
+    return _equal(element, condition)
+
+
+def match(document: Dict[str, Any], query: Optional[Mapping[str, Any]]) -> bool:
+    """文档是否满足查询条件"""
+    if not query:
+        return True
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(match(document, branch) for branch in condition):
+                return False
+        elif key == "$or":
+            if not any(match(document, branch) for branch in condition):
+                return False
+        elif key == "$nor":
+            if any(match(document, branch) for branch in condition):
+                return False
+        elif key.startswith("$"):
+            raise OperationFailure(f"内存后端不支持查询操作符: {key}", code=2)
+        elif not _match_value(_lookup(document, key), condition):
+            return False
+    return True
+
+
+def project(document: Dict[str, Any], projection: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """按包含式或排除式投影返回文档（支持点路径，_id默认返回）"""
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = bool(projection.get("_id", 1))
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if any(fields.values()) or (not fields and include_id):
+        if not all(fields.values()):
+            raise OperationFailure("投影不能同时包含和排除字段", code=31254)
+        result = {}
+        if include_id and "_id" in document:
+            result["_id"] = document["_id"]
+        for path in fields:
+            _copy_path(document, result, path.split("."))
+        return result
+    result = dict(document)
+    if not include_id:
+        result.pop("_id", None)
+    for path in fields:
+        _unset_path(result, path)
+    return result
+
+
+def _copy_path(source: Any, target: Dict[str, Any], segments: List[str]):
+    head, rest = segments[0], segments[1:]
+    if not isinstance(source, dict) or head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = value
+    elif isinstance(value, dict):
+        _copy_path(value, target.setdefault(head, {}), rest)
+    elif isinstance(value, list):
+        items = target.setdefault(head, [])
+        for item in value:
+            if isinstance(item, dict):
+                projected = {}
+                _copy_path(item, projected, rest)
+                items.append(projected)
+
+
+def _sort_spec(key_or_list: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, Mapping):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+
+def _sort_records(records: Iterable["_Record"], spec: List[Tuple[str, int]]) -> List["_Record"]:
+    """按排序键排序；数组字段按整体比较，缺失字段视为null"""
+    def sort_values(record: "_Record") -> List[Any]:
+        values = []
+        for key, _ in spec:
+            found = _lookup(record.document, key)
+            values.append(found[0] if found else None)
+        return values
+
+    def compare(a: Tuple[List[Any], "_Record"], b: Tuple[List[Any], "_Record"]) -> int:
+        for value_a, value_b, (_, direction) in zip(a[0], b[0], spec):
+            result = _compare(value_a, value_b)
+            if result:
+                return result if direction >= 0 else -result
+        return 0
+
+    # 排序键只计算一次
+    decorated = [(sort_values(record), record) for record in records]
+    decorated.sort(key=functools.cmp_to_key(compare))
+    return [record for _, record in decorated]
+
+
+# ---- 更新操作 ----
+
+def _path_error(path: str) -> WriteError:
+    return WriteError(f"无法在路径{path}上创建或修改字段", code=28)
+
+
+def _child(container: Any, segment: str, path: str) -> Any:
+    """取出(必要时创建)中间层容器"""
+    if isinstance(container, dict):
+        value = container.get(segment)
+        if value is None:
+            value = container[segment] = {}
+        if not isinstance(value, (dict, list)):
+            raise _path_error(path)
+        return value
+    if isinstance(container, list) and segment.isdigit():
+        index = int(segment)
+        container.extend([None] * (index + 1 - len(container)))
+        if container[index] is None:
+            container[index] = {}
+        if not isinstance(container[index], (dict, list)):
+            raise _path_error(path)
+        return container[index]
+    raise _path_error(path)
+
+
+def _parent(document: Dict[str, Any], path: str, create: bool) -> Tuple[Any, str]:
+    """返回(路径最后一段所在的容器, 最后一段)；create=False且路径不存在时容器为None"""
+    segments = path.split(".")
+    container: Any = document
+    for segment in segments[:-1]:
+        if create:
+            container = _child(container, segment, path)
+            continue
+        if isinstance(container, dict) and isinstance(container.get(segment), (dict, list)):
+            container = container[segment]
+        elif isinstance(container, list) and segment.isdigit() and int(segment) < len(container) \
+                and isinstance(container[int(segment)], (dict, list)):
+            container = container[int(segment)]
+        else:
+            return None, segments[-1]
+    return container, segments[-1]
+
+
+def _get(container: Any, key: str) -> Any:
+    if isinstance(container, dict):
+        return container.get(key, _MISSING)
+    if isinstance(container, list) and key.isdigit() and int(key) < len(container):
+        return container[int(key)]
+    return _MISSING
+
+
+def _assign(container: Any, key: str, value: Any, path: str):
+    if isinstance(container, dict):
+        container[key] = value
+    elif isinstance(container, list) and key.isdigit():
+        index = int(key)
+        container.extend([None] * (index + 1 - len(container)))
+        container[index] = value
+    else:
+        raise _path_error(path)
+
+
+def _set_path(document: Dict[str, Any], path: str, value: Any):
+    container, key = _parent(document, path, create=True)
+    _assign(container, key, value, path)
+
+
+def _unset_path(document: Dict[str, Any], path: str):
+    container, key = _parent(document, path, create=False)
+    if isinstance(container, dict):
+        container.pop(key, None)
+    elif isinstance(container, list) and key.isdigit() and int(key) < len(container):
+        # 与服务端一致：$unset数组元素留下null
+        container[int(key)] = None
+
+
+def _array_at(document: Dict[str, Any], path: str, create: bool) -> Optional[list]:
+    container, key = _parent(document, path, create=create)
+    if container is None:
+        return None
+    current = _get(container, key)
+    if current is _MISSING or current is None:
+        if not create:
+            return None
+        current = []
+        _assign(container, key, current, path)
+    if not isinstance(current, list):
+        raise WriteError(f"字段{path}不是数组", code=2)
+    return current
+
+
+def apply_update(document: Dict[str, Any], update: Mapping[str, Any], inserting: bool = False):
+    """就地对文档应用更新操作符"""
+    if not update or not all(key.startswith("$") for key in update):
+        raise ValueError("更新文档必须只包含更新操作符")
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set_path(document, path, value)
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set_path(document, path, value)
+            elif op == "$unset":
+                _unset_path(document, path)
+            elif op == "$inc":
+                container, key = _parent(document, path, create=True)
+                current = _get(container, key)
+                if current is _MISSING or current is None:
+                    _assign(container, key, value, path)
+                elif isinstance(current, bool) or not isinstance(current, (int, float)):
+                    raise WriteError(f"不能对非数值字段{path}执行$inc", code=14)
+                else:
+                    _assign(container, key, current + value, path)
+            elif op in ("$push", "$addToSet"):
+                if isinstance(value, dict) and "$each" in value:
+                    items, position = list(value["$each"]), value.get("$position")
+                else:
+                    items, position = [value], None
+                array = _array_at(document, path, create=True)
+                if op == "$addToSet":
+                    for item in items:
+                        if not any(_equal(existing, item) for existing in array):
+                            array.append(item)
+                elif position is None:
+                    array.extend(items)
+                else:
+                    index = position if position >= 0 else max(len(array) + position, 0)
+                    array[index:index] = items
+            elif op == "$pull":
+                array = _array_at(document, path, create=False)
+                if array is not None:
+                    array[:] = [item for item in array if not _match_element(item, value)]
+            else:
+                raise WriteError(f"内存后端不支持更新操作符: {op}", code=9)
+
+
+def _upsert_document(query: Mapping[str, Any]) -> Dict[str, Any]:
+    """由查询条件中的等值字段构造upsert插入的初始文档"""
+    document: Dict[str, Any] = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for branch in condition:
+                for sub_key, value in _upsert_document(branch).items():
+                    document.setdefault(sub_key, value)
+        elif key.startswith("$"):
+            continue
+        elif _is_operator_dict(condition):
+            if "$eq" in condition:
+                _set_path(document, key, condition["$eq"])
+        else:
+            _set_path(document, key, condition)
+    return document
+
+
+# ---- 存储 ----
+
+def _hashable(value: Any) -> Any:
+    """索引键：将取值转换为可哈希形式（只用于缩小候选范围，最终仍按查询条件逐条判断）"""
+    if isinstance(value, dict):
+        return ("d", tuple((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return ("l", tuple(_hashable(item) for item in value))
+    return value
+
+
+def _is_id_range(condition: Any) -> bool:
+    """_id上只有ObjectId的范围比较"""
+    return isinstance(condition, dict) and bool(condition) and set(condition) <= {"$gt", "$gte", "$lt", "$lte"} \
+        and all(isinstance(value, ObjectId) for value in condition.values())
+
+
+class _Record:
+    __slots__ = ("document", "raw", "seq")
+
+    def __init__(self, document: Dict[str, Any], raw: bytes, seq: int):
+        self.document = document
+        self.raw = raw
+        self.seq = seq
+
+
+class _Index:
+    """索引：完整键和首字段各一张哈希表"""
+
+    def __init__(self, name: str, keys: List[Tuple[str, Any]], unique: bool = False,
+                 expire_after_seconds: Optional[int] = None):
+        self.name = name
+        self.keys = keys
+        self.fields = [field for field, _ in keys]
+        self.unique = unique
+        self.expire_after_seconds = expire_after_seconds
+        self.entries: Dict[Any, Set[Any]] = {}
+        self.prefix: Dict[Any, Set[Any]] = {}
+        # 出现数组取值后不再用于查询（数组元素的等值匹配无法通过整体取值定位）
+        self.multikey = False
+
+    def info(self) -> Dict[str, Any]:
+        info: Dict[str, Any] = {"v": 2, "key": list(self.keys)}
+        if self.unique:
+            info["unique"] = True
+        if self.expire_after_seconds is not None:
+            info["expireAfterSeconds"] = self.expire_after_seconds
+        return info
+
+    def key_of(self, document: Dict[str, Any]) -> Tuple[Any, ...]:
+        values = []
+        for field in self.fields:
+            found = _lookup(document, field)
+            value = found[0] if len(found) == 1 else (found or None)
+            if isinstance(value, list):
+                self.multikey = True
+            values.append(_hashable(value))
+        return tuple(values)
+
+    def add(self, key: Tuple[Any, ...], id_key: Any):
+        self.entries.setdefault(key, set()).add(id_key)
+        self.prefix.setdefault(key[0], set()).add(id_key)
+
+    def remove(self, key: Tuple[Any, ...], id_key: Any):
+        for table, entry in ((self.entries, key), (self.prefix, key[0])):
+            ids = table.get(entry)
+            if ids is not None:
+                ids.discard(id_key)
+                if not ids:
+                    del table[entry]
+
+
+class MemoryCursor:
+    """find返回的游标，支持sort/skip/limit链式调用和async for"""
+
+    def __init__(self, collection: "MemoryCollection", filter: Optional[Mapping[str, Any]],
+                 projection: Optional[Mapping[str, Any]], skip: int = 0, limit: int = 0,
+                 sort: Any = None, max_time_ms: Optional[int] = None):
+        self._collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._skip = skip
+        self._limit = limit
+        self._sort = _sort_spec(sort) if sort else None
+        self._max_time_ms = max_time_ms
+        self._results = None
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "MemoryCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+    def max_time_ms(self, max_time_ms: Optional[int]) -> "MemoryCursor":
+        self._max_time_ms = max_time_ms
+        return self
+
+    def __aiter__(self) -> "MemoryCursor":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._results is None:
+            records = self._collection._select(
+                self._filter, self._sort, self._skip, self._limit, max_time_ms=self._max_time_ms
+            )
+            self._results = iter(records)
+        try:
+            record = next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+        return self._collection._output(record, self._projection)
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        documents = []
+        async for document in self:
+            documents.append(document)
+            if length and len(documents) >= length:
+                break
+        return documents
+
+
+class MemoryCollection:
+    """与AsyncIOMotorCollection接口兼容的进程内集合"""
+
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._documents: Dict[Any, _Record] = {}
+        self._indexes: Dict[str, _Index] = {}
+        self._seq = itertools.count()
+        self._last_expire_check = 0.0
+        # 按_id排序的ObjectId列表，用于_id上的范围查询（键集分页）；插入或删除后重建
+        self._sorted_ids: Optional[List[ObjectId]] = None
+
+    # ---- 内部 ----
+
+    def _encode(self, document: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        raw = bson.encode(document)
+        if len(raw) > MAX_BSON_SIZE:
+            raise DocumentTooLarge(f"文档大小{len(raw)}超过上限{MAX_BSON_SIZE}")
+        return bson.decode(raw), raw
+
+    def _output(self, record: _Record, projection: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+        # 每次返回独立的副本
+        return project(bson.decode(record.raw), projection)
+
+    def _check_unique(self, document: Dict[str, Any], id_key: Any):
+        for index in self._indexes.values():
+            if not index.unique:
+                continue
+            owners = index.entries.get(index.key_of(document), ())
+            if any(owner != id_key for owner in owners):
+                dup = {field: (_lookup(document, field) or [None])[0] for field in index.fields}
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {index.name} dup key: {dup}",
+                    code=11000,
+                    details={"index": 0, "code": 11000, "keyPattern": dict(index.keys), "keyValue": dup}
+                )
+
+    def _store(self, document: Dict[str, Any], previous: Optional[_Record] = None) -> _Record:
+        """写入新文档或替换已有文档，维护索引；违反唯一约束时抛出DuplicateKeyError"""
+        document, raw = self._encode(document)
+        id_key = _hashable(document["_id"])
+        if previous is None and id_key in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: {{ _id: {document['_id']!r} }}",
+                code=11000,
+                details={"index": 0, "code": 11000, "keyPattern": {"_id": 1}, "keyValue": {"_id": document["_id"]}}
+            )
+        self._check_unique(document, id_key)
+        if previous is not None:
+            for index in self._indexes.values():
+                index.remove(index.key_of(previous.document), id_key)
+        record = _Record(document, raw, previous.seq if previous is not None else next(self._seq))
+        if previous is None:
+            self._sorted_ids = None
+        self._documents[id_key] = record
+        for index in self._indexes.values():
+            index.add(index.key_of(document), id_key)
+        return record
+
+    def _remove(self, record: _Record):
+        id_key = _hashable(record.document["_id"])
+        del self._documents[id_key]
+        self._sorted_ids = None
+        for index in self._indexes.values():
+            index.remove(index.key_of(record.document), id_key)
+
+    def _candidates(self, query: Mapping[str, Any]) -> Iterable[_Record]:
+        """按_id或索引上的等值条件缩小扫描范围，按插入顺序返回候选文档"""
+        if not query:
+            return list(self._documents.values())
+        ids = None
+        condition = query.get("_id", _MISSING)
+        if condition is not _MISSING and not isinstance(condition, dict):
+            ids = {_hashable(condition)}
+        elif isinstance(condition, dict) and set(condition) == {"$in"}:
+            ids = {_hashable(value) for value in condition["$in"]}
+        elif _is_id_range(condition):
+            ids = self._id_range(condition)
+        else:
+            equalities = {
+                key: _hashable(value) for key, value in query.items()
+                if not key.startswith("$") and not isinstance(value, (dict, list))
+            }
+            best = None
+            for index in self._indexes.values():
+                if index.multikey or index.fields[0] not in equalities:
+                    continue
+                if all(field in equalities for field in index.fields):
+                    best = index.entries.get(tuple(equalities[field] for field in index.fields), set())
+                    break
+                candidates = index.prefix.get(equalities[index.fields[0]], set())
+                if best is None or len(candidates) < len(best):
+                    best = candidates
+            ids = best
+        if ids is None:
+            return list(self._documents.values())
+        records = [self._documents[id_key] for id_key in ids if id_key in self._documents]
+        records.sort(key=lambda record: record.seq)
+        return records
+
+    def _id_range(self, condition: Mapping[str, ObjectId]) -> Optional[Set[Any]]:
+        """_id上的范围条件通过二分查找定位；存在非ObjectId的_id时返回None（全表扫描）"""
+        bounds = self._id_bounds(condition)
+        if bounds is None:
+            return None
+        return set(self._sorted_ids[bounds[0]:bounds[1]])
+
+    def _id_bounds(self, condition: Mapping[str, ObjectId]) -> Optional[Tuple[int, int]]:
+        """范围条件在有序_id列表中对应的[start, end)；存在非ObjectId的_id时返回None"""
+        if self._sorted_ids is None:
+            ids = [record.document["_id"] for record in self._documents.values()]
+            if not all(isinstance(id, ObjectId) for id in ids):
+                return None
+            self._sorted_ids = sorted(ids)
+        start, end = 0, len(self._sorted_ids)
+        for op, value in condition.items():
+            if op == "$gt":
+                start = max(start, bisect.bisect_right(self._sorted_ids, value))
+            elif op == "$gte":
+                start = max(start, bisect.bisect_left(self._sorted_ids, value))
+            elif op == "$lt":
+                end = min(end, bisect.bisect_left(self._sorted_ids, value))
+            else:
+                end = min(end, bisect.bisect_right(self._sorted_ids, value))
+        return start, end
+
+    def _id_ordered(self, query: Mapping[str, Any], direction: int) -> Optional[Iterable[_Record]]:
+        """只按_id排序时沿有序_id列表按排序方向扫描（相当于走_id索引），limit时取够即停，无需整体排序
+
+        只用于_id范围条件或空查询（其他条件交给_candidates按索引缩小范围），无法使用时返回None。
+        """
+        condition = query.get("_id", _MISSING)
+        if condition is _MISSING:
+            if query:
+                return None
+            condition = {}
+        elif not _is_id_range(condition):
+            return None
+        bounds = self._id_bounds(condition)
+        if bounds is None:
+            return None
+        start, end = bounds
+        positions = range(start, end) if direction >= 0 else range(end - 1, start - 1, -1)
+        return (self._documents[self._sorted_ids[position]] for position in positions)
+
+    def _select(self, query: Optional[Mapping[str, Any]], sort: Optional[List[Tuple[str, int]]] = None,
+                skip: int = 0, limit: int = 0, max_time_ms: Optional[int] = None) -> List[_Record]:
+        time_limit = _time_limit(max_time_ms)
+        started = time.monotonic()
+        self._expire()
+        query = _normalize(query or {})
+        ordered = self._id_ordered(query, sort[0][1]) if sort and len(sort) == 1 and sort[0][0] == "_id" else None
+        if ordered is not None:
+            records: Iterable[_Record] = (record for record in ordered if match(record.document, query))
+        else:
+            records = (record for record in self._candidates(query) if match(record.document, query))
+            if sort:
+                records = _sort_records(records, sort)
+        selected = list(itertools.islice(records, skip or 0, (skip or 0) + limit if limit else None))
+        # 单个操作同步完成无法中途中止，执行完后按耗时判断是否超时（写操作此时尚未修改数据）
+        if time_limit is not None and time.monotonic() - started > time_limit:
+            raise _time_exceeded()
+        return selected
+
+    def _expire(self):
+        """按TTL索引删除过期文档（与服务端一样周期性执行）"""
+        now = time.monotonic()
+        if now - self._last_expire_check < TTL_MONITOR_INTERVAL:
+            return
+        self._last_expire_check = now
+        current = datetime.now(timezone.utc).replace(tzinfo=None)
+        for index in list(self._indexes.values()):
+            if index.expire_after_seconds is None or len(index.fields) != 1:
+                continue
+            deadline = current - timedelta(seconds=index.expire_after_seconds)
+            expired = [
+                record for record in self._documents.values()
+                if isinstance(record.document.get(index.fields[0]), datetime)
+                and record.document[index.fields[0]] < deadline
+            ]
+            for record in expired:
+                self._remove(record)
+
+    def _update(self, query: Mapping[str, Any], update: Mapping[str, Any], upsert: bool = False,
+                multi: bool = False, sort: Any = None,
+                max_time_ms: Optional[int] = None) -> Tuple[int, int, Any, List[Tuple[_Record, _Record]]]:
+        """返回(匹配数, 修改数, upsert的_id, [(更新前, 更新后)])"""
+        update = _normalize(update)
+        records = self._select(
+            query, _sort_spec(sort) if sort else None, limit=0 if multi else 1, max_time_ms=max_time_ms
+        )
+        changes = []
+        modified = 0
+        for record in records:
+            document = bson.decode(record.raw)
+            apply_update(document, update)
+            if not _equal(document.get("_id"), record.document.get("_id")):
+                raise WriteError("不能修改不可变字段_id", code=66)
+            if bson.encode(document) == record.raw:
+                changes.append((record, record))
+                continue
+            changes.append((record, self._store(document, previous=record)))
+            modified += 1
+        if records or not upsert:
+            return len(records), modified, None, changes
+
+        document = _upsert_document(_normalize(query))
+        apply_update(document, update, inserting=True)
+        document.setdefault("_id", ObjectId())
+        record = self._store(document)
+        return 0, 0, document["_id"], [(None, record)]
+
+    # ---- 写操作 ----
+
+    async def insert_one(self, document: Dict[str, Any], *args, **kwargs) -> InsertOneResult:
+        # pymongo.timeout()的时间已用尽时不再写入
+        _time_limit(None)
+        if "_id" not in document:
+            # 与驱动一致：为调用方的文档补上_id
+            document["_id"] = ObjectId()
+        self._store(document)
+        return InsertOneResult(document["_id"], True)
+
+    async def insert_many(self, documents: Iterable[Dict[str, Any]], ordered: bool = True,
+                          *args, **kwargs) -> InsertManyResult:
+        # pymongo.timeout()的时间已用尽时不再写入
+        _time_limit(None)
+        inserted_ids, errors = [], []
+        for index, document in enumerate(documents):
+            if "_id" not in document:
+                document["_id"] = ObjectId()
+            try:
+                self._store(document)
+                inserted_ids.append(document["_id"])
+            except (DuplicateKeyError, DocumentTooLarge) as e:
+                errors.append({
+                    "index": index,
+                    "code": getattr(e, "code", None) or 2,
+                    "errmsg": str(e),
+                    "op": document
+                })
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors,
+                "writeConcernErrors": [],
+                "nInserted": len(inserted_ids),
+                "nUpserted": 0,
+                "nMatched": 0,
+                "nModified": 0,
+                "nRemoved": 0,
+                "upserted": []
+            })
+        return InsertManyResult(inserted_ids, True)
+
+    async def update_one(self, filter: Mapping[str, Any], update: Mapping[str, Any],
+                         upsert: bool = False, *args, **kwargs) -> UpdateResult:
+        return self._update_result(*self._update(filter, update, upsert=upsert, sort=kwargs.get("sort")))
+
+    async def update_many(self, filter: Mapping[str, Any], update: Mapping[str, Any],
+                          upsert: bool = False, *args, **kwargs) -> UpdateResult:
+        return self._update_result(*self._update(filter, update, upsert=upsert, multi=True))
+
+    @staticmethod
+    def _update_result(matched: int, modified: int, upserted_id: Any, changes) -> UpdateResult:
+        raw_result = {"n": matched if upserted_id is None else 1, "nModified": modified, "ok": 1.0}
+        if upserted_id is not None:
+            raw_result["upserted"] = upserted_id
+        return UpdateResult(raw_result, True)
+
+    async def replace_one(self, filter: Mapping[str, Any], replacement: Mapping[str, Any],
+                          upsert: bool = False, *args, **kwargs) -> UpdateResult:
+        records = self._select(filter, limit=1)
+        if records:
+            document = dict(_normalize(replacement))
+            document["_id"] = records[0].document["_id"]
+            modified = bson.encode(document) != records[0].raw
+            self._store(document, previous=records[0])
+            return self._update_result(1, int(modified), None, None)
+        if not upsert:
+            return self._update_result(0, 0, None, None)
+        document = dict(_normalize(replacement))
+        document.setdefault("_id", _upsert_document(_normalize(filter)).get("_id", ObjectId()))
+        self._store(document)
+        return self._update_result(0, 0, document["_id"], None)
+
+    async def find_one_and_update(self, filter: Mapping[str, Any], update: Mapping[str, Any],
+                                  projection: Optional[Mapping[str, Any]] = None, sort: Any = None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                                  *args, **kwargs) -> Optional[Dict[str, Any]]:
+        _, _, _, changes = self._update(
+            filter, update, upsert=upsert, sort=sort, max_time_ms=kwargs.get("maxTimeMS")
+        )
+        if not changes:
+            return None
+        before, after = changes[0]
+        record = after if return_document else before
+        return self._output(record, projection) if record is not None else None
+
+    async def find_one_and_delete(self, filter: Mapping[str, Any],
+                                  projection: Optional[Mapping[str, Any]] = None, sort: Any = None,
+                                  *args, **kwargs) -> Optional[Dict[str, Any]]:
+        records = self._select(
+            filter, _sort_spec(sort) if sort else None, limit=1, max_time_ms=kwargs.get("maxTimeMS")
+        )
+        if not records:
+            return None
+        self._remove(records[0])
+        return self._output(records[0], projection)
+
+    async def delete_one(self, filter: Mapping[str, Any], *args, **kwargs) -> DeleteResult:
+        records = self._select(filter, limit=1)
+        for record in records:
+            self._remove(record)
+        return DeleteResult({"n": len(records), "ok": 1.0}, True)
+
+    async def delete_many(self, filter: Mapping[str, Any], *args, **kwargs) -> DeleteResult:
+        records = self._select(filter)
+        for record in records:
+            self._remove(record)
+        return DeleteResult({"n": len(records), "ok": 1.0}, True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, *args, **kwargs) -> BulkWriteResult:
+        result: Dict[str, Any] = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+        }
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    await self.insert_one(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    matched, modified, upserted_id, _ = self._update(
+                        request._filter, request._doc, upsert=bool(request._upsert),
+                        multi=isinstance(request, UpdateMany)
+                    )
+                    result["nMatched"] += matched
+                    result["nModified"] += modified
+                    if upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": upserted_id})
+                elif isinstance(request, ReplaceOne):
+                    replaced = await self.replace_one(request._filter, request._doc, upsert=bool(request._upsert))
+                    result["nMatched"] += replaced.matched_count
+                    result["nModified"] += replaced.modified_count
+                    if replaced.upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": replaced.upserted_id})
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    delete = self.delete_many if isinstance(request, DeleteMany) else self.delete_one
+                    result["nRemoved"] += (await delete(request._filter)).deleted_count
+                else:
+                    raise TypeError(f"不支持的批量写操作: {request!r}")
+            except (WriteError, DocumentTooLarge) as e:
+                result["writeErrors"].append({
+                    "index": index,
+                    "code": getattr(e, "code", None) or 2,
+                    "errmsg": str(e),
+                    "op": request
+                })
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    # ---- 读操作 ----
+
+    def find(self, filter: Optional[Mapping[str, Any]] = None, projection: Optional[Mapping[str, Any]] = None,
+             skip: int = 0, limit: int = 0, sort: Any = None, *args, **kwargs) -> MemoryCursor:
+        return MemoryCursor(
+            self, filter, projection, skip=skip, limit=limit, sort=sort, max_time_ms=kwargs.get("max_time_ms")
+        )
+
+    async def find_one(self, filter: Any = None, projection: Optional[Mapping[str, Any]] = None,
+                       *args, **kwargs) -> Optional[Dict[str, Any]]:
+        if filter is not None and not isinstance(filter, Mapping):
+            filter = {"_id": filter}
+        records = self._select(
+            filter, _sort_spec(kwargs["sort"]) if kwargs.get("sort") else None, limit=1,
+            max_time_ms=kwargs.get("max_time_ms")
+        )
+        return self._output(records[0], projection) if records else None
+
+    async def count_documents(self, filter: Mapping[str, Any], skip: int = 0, limit: int = 0,
+                              *args, **kwargs) -> int:
+        return len(self._select(filter, skip=skip, limit=limit, max_time_ms=kwargs.get("maxTimeMS")))
+
+    async def estimated_document_count(self, *args, **kwargs) -> int:
+        return len(self._documents)
+
+    # ---- 索引 ----
+
+    async def create_indexes(self, indexes: List[Any], *args, **kwargs) -> List[str]:
+        names = []
+        for model in indexes:
+            document = model.document
+            keys = list(document["key"].items())
+            name = document.get("name") or "_".join(f"{field}_{direction}" for field, direction in keys)
+            existing = self._indexes.get(name)
+            if existing is not None:
+                if existing.keys != keys or existing.unique != bool(document.get("unique")):
+                    raise OperationFailure(f"索引{name}已存在且定义不同", code=86)
+                names.append(name)
+                continue
+            index = _Index(name, keys, bool(document.get("unique")), document.get("expireAfterSeconds"))
+            for id_key, record in self._documents.items():
+                key = index.key_of(record.document)
+                if index.unique and index.entries.get(key):
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} index: {name}", code=11000
+                    )
+                index.add(key, id_key)
+            self._indexes[name] = index
+            names.append(name)
+        return names
+
+    async def create_index(self, keys: Any, **kwargs) -> str:
+        from pymongo import IndexModel
+        return (await self.create_indexes([IndexModel(keys, **kwargs)]))[0]
+
+    async def index_information(self) -> Dict[str, Any]:
+        information = {"_id_": {"v": 2, "key": [("_id", 1)]}}
+        for name, index in self._indexes.items():
+            information[name] = index.info()
+        return information
+
+    async def drop_index(self, name: str, *args, **kwargs):
+        if self._indexes.pop(name, None) is None:
+            raise OperationFailure(f"索引{name}不存在", code=27)
+
+    async def drop(self, *args, **kwargs):
+        self._documents.clear()
+        self._indexes.clear()
+
+
+class MemoryDatabase:
+    """与AsyncIOMotorDatabase接口兼容的进程内数据库"""
+
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, *args, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self, *args, **kwargs) -> List[str]:
+        return list(self._collections)
+
+    async def drop_collection(self, name: str, *args, **kwargs):
+        self._collections.pop(name, None)
+
+    async def command(self, command: Any, *args, **kwargs) -> Dict[str, Any]:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name in ("ping", "hello", "isMaster", "ismaster"):
+            return {"ok": 1.0}
+        raise OperationFailure(f"内存后端不支持命令: {name}", code=59)
+
+
+class MemoryClient:
+    """与AsyncIOMotorClient接口兼容的进程内客户端
+
+    同一进程内的MemoryClient共享数据（相当于连接同一个服务端），close后重新连接数据仍在。
+    """
+
+    _databases: Dict[str, MemoryDatabase] = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def get_database(self, name: str, *args, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    async def server_info(self) -> Dict[str, Any]:
+        return {"version": "memory", "ok": 1.0}
+
+    async def drop_database(self, name: str):
+        # 已取得的数据库对象仍然可用，与服务端删库后的行为一致
+        database = self._databases.get(name)
+        if database is not None:
+            database._collections.clear()
+
+    def close(self):
+        pass
@@ -0,0 +1,171 @@
+"""Prometheus指标：HTTP路由耗时、MongoDB命令耗时和连接池状态
+
+多worker部署时设置环境变量PROMETHEUS_MULTIPROC_DIR（需在启动前创建并清空），
+各进程将指标写入该目录，/metrics汇总所有worker的数据。
+"""
+import os
+import time
+from typing import Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from pymongo import monitoring
+
+
+# MongoDB命令的耗时通常远小于HTTP请求，使用更细的分桶
+_MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP请求数",
+    ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP请求耗时(秒)",
+    ["method", "route"]
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB命令耗时(秒)",
+    ["command"], buckets=_MONGO_BUCKETS
+)
+MONGO_COMMAND_ERRORS = Counter(
+    "mongodb_command_errors_total", "MongoDB命令失败数",
+    ["command", "code"]
+)
+# 多进程模式下各worker的取值相加
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "mongodb_pool_checked_out_connections", "已借出的连接数",
+    ["address"], multiprocess_mode="livesum"
+)
+MONGO_POOL_WAITING = Gauge(
+    "mongodb_pool_waiting_requests", "等待获取连接的请求数",
+    ["address"], multiprocess_mode="livesum"
+)
+MONGO_POOL_CONNECTIONS = Gauge(
+    "mongodb_pool_connections", "已建立的连接数",
+    ["address"], multiprocess_mode="livesum"
+)
+MONGO_POOL_CREATED = Counter(
+    "mongodb_pool_connections_created_total", "累计建立的连接数",
+    ["address"]
+)
+ADMISSION_SHED = Counter(
+    "http_requests_shed_total", "准入控制拒绝的请求数",
+    ["request_class", "reason"]
+)
+ADMISSION_WAIT = Histogram(
+    "http_admission_wait_seconds", "请求在准入队列中的等待时间(秒)",
+    ["request_class"], buckets=_MONGO_BUCKETS
+)
+
+
+def _address(address: Tuple[str, int]) -> str:
+    return f"{address[0]}:{address[1]}"
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """按命令名记录耗时和失败数（在驱动线程中调用，需保持轻量）"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(event.duration_micros / 1e6)
+        code = event.failure.get("codeName") or str(event.failure.get("code", "unknown"))
+        MONGO_COMMAND_ERRORS.labels(event.command_name, code).inc()
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """维护连接池的借出、等待和连接数"""
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        address = _address(event.address)
+        MONGO_POOL_CONNECTIONS.labels(address).inc()
+        MONGO_POOL_CREATED.labels(address).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.labels(_address(event.address)).dec()
+
+    def connection_check_out_started(self, event):
+        MONGO_POOL_WAITING.labels(_address(event.address)).inc()
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_WAITING.labels(_address(event.address)).dec()
+
+    def connection_checked_out(self, event):
+        address = _address(event.address)
+        MONGO_POOL_WAITING.labels(address).dec()
+        MONGO_POOL_CHECKED_OUT.labels(address).inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.labels(_address(event.address)).dec()
+
+
+class MetricsMiddleware:
+    """记录每个请求的耗时，route标签使用路由模板（如/api/generator/users/{user_id}）以控制基数"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 路由匹配后FastAPI将路由对象写入scope；未匹配的请求归为一类
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.labels(method, template).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, template, str(status_code)).inc()
+
+
+def mongo_event_listeners() -> list:
+    """注册到MongoClient的监听器"""
+    return [CommandMetricsListener(), PoolMetricsListener()]
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """导出指标文本及其Content-Type"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """worker退出时清理其存活型(livesum)指标"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,95 @@
+"""按当前压缩配置迁移graphs集合中已有的graph_data
+
+用法（在mongodbcon目录下运行）:
+    GRAPH_COMPRESSION=zlib python migrate_graph_compression.py [--dry-run] [--batch-size 200]
+    python migrate_graph_compression.py --decompress      # 全部还原为内联存储
+"""
+import argparse
+import asyncio
+import logging
+from pymongo import UpdateOne
+from config import settings
+from database import Database
+from models import Graph
+from crud import (
+    COMPRESSED_GRAPH_FIELD, GRAPH_CODEC_FIELD,
+    compress_graph_data, decompress_graph_data
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _compress_op(document):
+    compressed = compress_graph_data(document["graph_data"])
+    if not compressed:
+        return None
+    # 以版本号为条件，迁移期间被编辑过的graph保持不变
+    return UpdateOne(
+        {"_id": document["_id"], "version": document.get("version")},
+        {"$set": compressed, "$unset": {"graph_data": ""}}
+    )
+
+
+def _decompress_op(document):
+    graph_data = decompress_graph_data(document[COMPRESSED_GRAPH_FIELD], document[GRAPH_CODEC_FIELD])
+    return UpdateOne(
+        {"_id": document["_id"], "version": document.get("version")},
+        {"$set": {"graph_data": graph_data}, "$unset": {COMPRESSED_GRAPH_FIELD: "", GRAPH_CODEC_FIELD: ""}}
+    )
+
+
+async def migrate(decompress: bool, batch_size: int, dry_run: bool):
+    await Database.connect()
+    try:
+        collection = Database.get_db()[Graph.Config.collection]
+        if decompress:
+            query = {COMPRESSED_GRAPH_FIELD: {"$exists": True}}
+            build = _decompress_op
+        else:
+            # 由服务端按BSON大小筛选，只取回超过阈值的内联graph_data（需要MongoDB 4.4+）
+            query = {
+                "graph_data": {"$exists": True},
+                "$expr": {"$gte": [{"$bsonSize": "$graph_data"}, settings.GRAPH_COMPRESSION_THRESHOLD]}
+            }
+            build = _compress_op
+
+        scanned = migrated = 0
+        operations = []
+        async for document in collection.find(query, batch_size=batch_size):
+            scanned += 1
+            operation = build(document)
+            if operation is not None:
+                operations.append(operation)
+            if len(operations) >= batch_size:
+                migrated += await _flush(collection, operations, dry_run)
+                operations = []
+        if operations:
+            migrated += await _flush(collection, operations, dry_run)
+        logger.info(f"扫描{scanned}个graph，{'将' if dry_run else '已'}迁移{migrated}个")
+    finally:
+        await Database.disconnect()
+
+
+async def _flush(collection, operations, dry_run: bool) -> int:
+    if dry_run:
+        return len(operations)
+    result = await collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迁移graph_data的压缩存储格式")
+    parser.add_argument("--decompress", action="store_true", help="将压缩存储的graph_data还原为内联存储")
+    parser.add_argument("--batch-size", type=int, default=200, help="每批写入的文档数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    args = parser.parse_args()
+
+    if not args.decompress and settings.GRAPH_COMPRESSION.lower() == "none":
+        parser.error("请先通过GRAPH_COMPRESSION指定压缩方式(zlib/zstd)")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate(args.decompress, args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timezone
+from pymongo import ASCENDING, IndexModel
+from config import settings
 
 # 基础模型
 class BaseMongoModel(BaseModel):
@@ -27,6 +29,11 @@ class User(BaseMongoModel):
     
     class Config:
         collection = "users"
+        # 列表默认投影：不返回metadata
+        summary_projection = {"metadata": 0}
+        indexes = [
+            IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+        ]
 
 # 示例产品模型
 class Product(BaseMongoModel):
@@ -40,6 +47,10 @@ class Product(BaseMongoModel):
     
     class Config:
         collection = "products"
+        indexes = [
+            # 分类筛选及(category, _id)键集分页
+            IndexModel([("category", ASCENDING), ("_id", ASCENDING)], name="category_id"),
+        ]
 
 
 # Graph信息存储
@@ -56,4 +67,33 @@ class Graph(BaseMongoModel):
 
     class Config:
         collection = "graphs"
+        # 列表默认投影：不返回graph_data
+        summary_projection = {"graph_data": 0}
+        indexes = [
+            # get_graph/set_graph按(user_id, graph_id)定位，upsert依赖其唯一性
+            IndexModel([("user_id", ASCENDING), ("graph_id", ASCENDING)], unique=True, name="user_graph_unique"),
+        ]
+
+
+# 代码生成结果缓存
+class GeneratedCode(BaseMongoModel):
+    """代码生成结果"""
+
+    spec_hash: str = Field(..., description="(spec, 格式, 语言, 模板)的SHA-256")
+    generator_version: str = Field(..., description="生成器版本")
+    status: str = Field(default="pending", description="pending(生成中)或done")
+    outputs: List[str] = Field(default=[], description="与模板一一对应的生成结果")
+    size: int = Field(default=0, description="生成结果字节数")
+    lease_expires_at: Optional[datetime] = Field(None, description="生成占位的过期时间")
+
+    class Config:
+        collection = "generated_code"
+        indexes = [
+            IndexModel([("spec_hash", ASCENDING), ("generator_version", ASCENDING)], unique=True, name="spec_version_unique"),
+            IndexModel([("created_at", ASCENDING)], expireAfterSeconds=settings.GENERATED_CODE_TTL_SECONDS, name="created_at_ttl"),
+        ]
+
+
+# 需要在启动时同步索引的模型
+DOCUMENT_MODELS = [User, Product, Graph, GeneratedCode]
 
@@ -1,50 +1,163 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Callable, Dict, List, Literal, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from database import get_database
 from models import Graph, User, Product
 from schemas import (
     UserCreate, UserUpdate, UserResponse,
     ProductCreate, ProductUpdate, ProductResponse,
-    BaseResponse, PaginatedResponse, PaginationParams,
-    GraphCreate, GraphUpdate, GraphResponse
+    BaseResponse, PaginatedResponse, PaginationParams, BatchGetRequest,
+    GraphCreate, GraphUpdate, GraphResponse, GraphDataUpdate, GraphPatch
 )
-from crud import CRUDUser, CRUDProduct, CRUDGraph
+from crud import (
+    CRUDBase, CRUDUser, CRUDProduct, CRUDGraph,
+    InvalidCursorError, InvalidFieldsError, InvalidPatchError, PatchConflictError,
+    build_projection, default_projection, get_document_cache,
+    coalesce_enabled, read_flight, graph_write_buffer
+)
+from deadline import request_deadline
+from conditional import check_if_match, check_not_modified, has_read_conditions, validator_headers
+from config import settings
+from serialization import dumps, respond
+from slow_queries import slow_query_recorder
+from admission import admission_controller
 
 # 创建路由实例
-router = APIRouter(prefix="/api/generator", tags=["mongodb"])
+# 每个请求先按路由配置或请求头设置截止时间，CRUD操作据此限制MongoDB命令的执行时间
+router = APIRouter(prefix="/api/generator", tags=["mongodb"], dependencies=[Depends(request_deadline)])
 
 # 依赖项：获取数据库
 async def get_db() -> AsyncIOMotorDatabase:
     return get_database()
 
+# 由创建请求构建文档模型
+def _new_user(user_in: UserCreate) -> User:
+    return User(
+        username=user_in.username,
+        email=user_in.email,
+        full_name=user_in.full_name
+    )
+
+def _new_product(product_in: ProductCreate) -> Product:
+    return Product(
+        name=product_in.name,
+        description=product_in.description,
+        price=product_in.price,
+        category=product_in.category,
+        tags=product_in.tags
+    )
+
+def _new_graph(graph_in: GraphCreate) -> Graph:
+    return Graph(
+        user_id = graph_in.user_id,
+        graph_id = graph_in.graph_id,
+        graph_name = graph_in.graph_name,
+        graph_description = graph_in.graph_description,
+        graph_category= graph_in.graph_category,
+        graph_tags = graph_in.graph_tags,
+        graph_data = graph_in.graph_data
+    )
+
+async def _bulk_create(
+    crud: CRUDBase,
+    items: List[Dict[str, Any]],
+    build: Callable[[Dict[str, Any]], BaseModel],
+    chunk_size: Optional[int]
+) -> Dict[str, Any]:
+    """逐条校验后批量写入，返回与输入顺序一致的逐条结果"""
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单次最多提交{settings.BULK_MAX_ITEMS}条数据"
+        )
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid_indexes, documents = [], []
+    for index, item in enumerate(items):
+        try:
+            documents.append(build(item))
+            valid_indexes.append(index)
+        except ValidationError as e:
+            results[index] = {
+                "index": index,
+                "id": None,
+                "error": "数据校验失败",
+                "details": [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()]
+            }
+
+    created = await crud.create_many(documents, chunk_size=chunk_size)
+    for index, result in zip(valid_indexes, created):
+        results[index] = {"index": index, **result}
+
+    inserted = sum(1 for result in results if result["id"] is not None)
+    return {
+        "inserted": inserted,
+        "failed": len(items) - inserted,
+        "results": results
+    }
+
+async def _batch_get(crud: CRUDBase, ids: List[str], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    """按ID批量获取，返回按输入顺序排列的文档及不存在、格式无效的ID"""
+    if len(ids) > settings.BATCH_GET_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"单次最多获取{settings.BATCH_GET_MAX_IDS}条数据"
+        )
+    items, missing, invalid = await crud.get_many(ids, projection=projection)
+    return {
+        "items": items,
+        "missing": missing,
+        "invalid": invalid
+    }
+
+# 导出时攒够该字节数再向客户端写出一次
+_EXPORT_CHUNK_BYTES = 64 * 1024
+
+async def _ndjson_stream(documents: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """将文档流编码为NDJSON（每行一个JSON对象）"""
+    buffer = []
+    buffered = 0
+    async for document in documents:
+        line = dumps(document) + b"\n"
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= _EXPORT_CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+def _export_response(documents: AsyncIterator[Dict[str, Any]], name: str) -> StreamingResponse:
+    return StreamingResponse(
+        _ndjson_stream(documents),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{name}.ndjson"'}
+    )
+
 # 用户路由
 @router.post("/users", response_model=BaseResponse, status_code=status.HTTP_201_CREATED)
 async def create_user(user_in: UserCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     """创建用户"""
     try:
-        # 检查用户是否已存在
-        existing_user = await db[User.Config.collection].find_one({"username": user_in.username})
-        if existing_user:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="用户名已存在"
-            )
-        
-        # 创建用户
-        user = User(
-            username=user_in.username,
-            email=user_in.email,
-            full_name=user_in.full_name
-        )
+        # 创建用户（用户名唯一性由username_unique索引保证）
+        user = _new_user(user_in)
         
         crud_user = CRUDUser(db[User.Config.collection])
         user_id = await crud_user.create(user)
         
-        return BaseResponse(
+        return respond(
             status="success",
             message="用户创建成功",
-            data={"id": user_id}
+            data={"id": user_id},
+            status_code=status.HTTP_201_CREATED
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="用户名已存在"
         )
     except HTTPException:
         raise
@@ -54,12 +167,95 @@ async def create_user(user_in: UserCreate, db: AsyncIOMotorDatabase = Depends(ge
             detail=f"创建用户失败: {str(e)}"
         )
 
-@router.get("/users/{user_id}", response_model=BaseResponse)
-async def get_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
-    """获取用户信息"""
+@router.post("/users/bulk", response_model=BaseResponse)
+async def create_users_bulk(
+    items: List[Dict[str, Any]],
+    chunk_size: Optional[int] = Query(None, ge=1, le=10000, description="每批写入条数"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """批量创建用户"""
+    try:
+        crud_user = CRUDUser(db[User.Config.collection])
+        result = await _bulk_create(crud_user, items, lambda item: _new_user(UserCreate(**item)), chunk_size)
+        return respond(
+            status="success",
+            message="批量创建用户完成",
+            data=result
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量创建用户失败: {str(e)}"
+        )
+
+@router.post("/users/batch-get", response_model=BaseResponse)
+async def batch_get_users(
+    request: BatchGetRequest,
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """按ID批量获取用户"""
     try:
         crud_user = CRUDUser(db[User.Config.collection])
-        user = await crud_user.get(user_id)
+        result = await _batch_get(crud_user, request.ids, build_projection(User, fields))
+        return respond(
+            status="success",
+            message="批量获取用户成功",
+            data=result
+        )
+    except HTTPException:
+        raise
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量获取用户失败: {str(e)}"
+        )
+
+@router.get("/users/export")
+async def export_users(
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    batch_size: Optional[int] = Query(None, ge=1, le=10000, description="游标每批取回的文档数"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """以NDJSON流式导出用户"""
+    filters = {}
+    try:
+        projection = build_projection(User, fields)
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    crud_user = CRUDUser(db[User.Config.collection])
+    return _export_response(
+        crud_user.iter_documents(filters, projection, batch_size),
+        "users"
+    )
+
+@router.get("/users/{user_id}", response_model=BaseResponse)
+async def get_user(
+    user_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """获取用户信息（支持If-None-Match/If-Modified-Since条件请求）"""
+    try:
+        crud_user = CRUDUser(db[User.Config.collection], coalesce=coalesce_enabled("get_user"))
+        projection = build_projection(User, fields)
+        updated_at = None
+        if has_read_conditions(request):
+            # 只取updated_at判断是否变化，未变化时不读取完整文档
+            updated_at = await crud_user.get_updated_at(user_id)
+            check_not_modified(request, user_id, updated_at, projection)
+        user = await crud_user.get(user_id, projection=projection)
         
         if not user:
             raise HTTPException(
@@ -67,13 +263,23 @@ async def get_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
                 detail="用户不存在"
             )
         
-        return BaseResponse(
+        if "updated_at" in user:
+            updated_at = user["updated_at"]
+        elif updated_at is None:
+            updated_at = await crud_user.get_updated_at(user_id)
+        return respond(
             status="success",
             message="获取用户信息成功",
-            data=user
+            data=user,
+            headers=validator_headers(user_id, updated_at, projection)
         )
     except HTTPException:
         raise
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -83,20 +289,42 @@ async def get_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
 @router.get("/users", response_model=BaseResponse)
 async def get_users(
     pagination: PaginationParams = Depends(),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，*表示全部，默认为摘要字段"),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """获取用户列表"""
     try:
-        crud_user = CRUDUser(db[User.Config.collection])
+        crud_user = CRUDUser(db[User.Config.collection], coalesce=coalesce_enabled("get_users"))
+        projection = default_projection(User, fields)
+        if pagination.cursor is not None:
+            # 键集分页
+            users, next_cursor = await crud_user.get_page_after(
+                cursor=pagination.cursor,
+                limit=pagination.size,
+                projection=projection
+            )
+            total = await crud_user.count() if pagination.with_total else None
+            return respond(
+                status="success",
+                message="获取用户列表成功",
+                data={
+                    "items": users,
+                    "total": total,
+                    "size": pagination.size,
+                    "next_cursor": next_cursor
+                }
+            )
+
         users = await crud_user.get_multi(
             skip=(pagination.page - 1) * pagination.size,
-            limit=pagination.size
+            limit=pagination.size,
+            projection=projection
         )
         
-        total = await crud_user.count()
-        pages = (total + pagination.size - 1) // pagination.size
+        total = await crud_user.count() if pagination.with_total else None
+        pages = (total + pagination.size - 1) // pagination.size if total is not None else None
         
-        return BaseResponse(
+        return respond(
             status="success",
             message="获取用户列表成功",
             data={
@@ -107,6 +335,13 @@ async def get_users(
                 "pages": pages
             }
         )
+    except (InvalidCursorError, InvalidFieldsError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -117,9 +352,10 @@ async def get_users(
 async def update_user(
     user_id: str,
     user_in: UserUpdate,
+    request: Request,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """更新用户信息"""
+    """更新用户信息（带If-Match时仅在ETag一致时更新）"""
     try:
         crud_user = CRUDUser(db[User.Config.collection])
         user_data = user_in.dict(exclude_unset=True)
@@ -130,18 +366,32 @@ async def update_user(
                 detail="没有提供更新数据"
             )
         
-        user = User(**user_data)
-        updated = await crud_user.update(user_id, user)
+        conditions = None
+        if "if-match" in request.headers:
+            # 比较并更新：只在updated_at仍为校验时的值时写入
+            updated_at = await crud_user.get_updated_at(user_id, fresh=True)
+            check_if_match(request, user_id, updated_at)
+            conditions = {"updated_at": updated_at}
+
+        # 一次往返完成更新并取回更新后的文档
+        user = await crud_user.update(user_id, user_in, return_document=True, conditions=conditions)
         
-        if not updated:
+        if not user:
+            if conditions is not None:
+                raise HTTPException(
+                    status_code=status.HTTP_412_PRECONDITION_FAILED,
+                    detail="资源不存在或已被修改"
+                )
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="用户不存在"
             )
         
-        return BaseResponse(
+        return respond(
             status="success",
-            message="用户信息更新成功"
+            message="用户信息更新成功",
+            data=user,
+            headers=validator_headers(user_id, user.get("updated_at"))
         )
     except HTTPException:
         raise
@@ -164,7 +414,7 @@ async def delete_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
                 detail="用户不存在"
             )
         
-        return BaseResponse(
+        return respond(
             status="success",
             message="用户删除成功"
         )
@@ -181,34 +431,117 @@ async def delete_user(user_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
 async def create_product(product_in: ProductCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     """创建产品"""
     try:
-        product = Product(
-            name=product_in.name,
-            description=product_in.description,
-            price=product_in.price,
-            category=product_in.category,
-            tags=product_in.tags
-        )
+        product = _new_product(product_in)
         
         crud_product = CRUDProduct(db[Product.Config.collection])
         product_id = await crud_product.create(product)
         
-        return BaseResponse(
+        return respond(
             status="success",
             message="产品创建成功",
-            data={"id": product_id}
+            data={"id": product_id},
+            status_code=status.HTTP_201_CREATED
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"创建产品失败: {str(e)}"
         )
 
-@router.get("/products/{product_id}", response_model=BaseResponse)
-async def get_product(product_id: str, db: AsyncIOMotorDatabase = Depends(get_db)):
-    """获取产品信息"""
+@router.post("/products/bulk", response_model=BaseResponse)
+async def create_products_bulk(
+    items: List[Dict[str, Any]],
+    chunk_size: Optional[int] = Query(None, ge=1, le=10000, description="每批写入条数"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """批量创建产品"""
+    try:
+        crud_product = CRUDProduct(db[Product.Config.collection])
+        result = await _bulk_create(crud_product, items, lambda item: _new_product(ProductCreate(**item)), chunk_size)
+        return respond(
+            status="success",
+            message="批量创建产品完成",
+            data=result
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量创建产品失败: {str(e)}"
+        )
+
+@router.post("/products/batch-get", response_model=BaseResponse)
+async def batch_get_products(
+    request: BatchGetRequest,
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """按ID批量获取产品"""
     try:
         crud_product = CRUDProduct(db[Product.Config.collection])
-        product = await crud_product.get(product_id)
+        result = await _batch_get(crud_product, request.ids, build_projection(Product, fields))
+        return respond(
+            status="success",
+            message="批量获取产品成功",
+            data=result
+        )
+    except HTTPException:
+        raise
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量获取产品失败: {str(e)}"
+        )
+
+@router.get("/products/export")
+async def export_products(
+    category: Optional[str] = Query(None, description="产品分类筛选"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    batch_size: Optional[int] = Query(None, ge=1, le=10000, description="游标每批取回的文档数"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """以NDJSON流式导出产品"""
+    try:
+        filters = {}
+        if category:
+            filters["category"] = category
+        projection = build_projection(Product, fields)
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    crud_product = CRUDProduct(db[Product.Config.collection])
+    return _export_response(
+        crud_product.iter_documents(filters, projection, batch_size),
+        "products"
+    )
+
+@router.get("/products/{product_id}", response_model=BaseResponse)
+async def get_product(
+    product_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """获取产品信息（支持If-None-Match/If-Modified-Since条件请求）"""
+    try:
+        crud_product = CRUDProduct(db[Product.Config.collection], coalesce=coalesce_enabled("get_product"))
+        projection = build_projection(Product, fields)
+        updated_at = None
+        if has_read_conditions(request):
+            # 只取updated_at判断是否变化，未变化时不读取完整文档
+            updated_at = await crud_product.get_updated_at(product_id)
+            check_not_modified(request, product_id, updated_at, projection)
+        product = await crud_product.get(product_id, projection=projection)
         
         if not product:
             raise HTTPException(
@@ -216,13 +549,23 @@ async def get_product(product_id: str, db: AsyncIOMotorDatabase = Depends(get_db
                 detail="产品不存在"
             )
         
-        return BaseResponse(
+        if "updated_at" in product:
+            updated_at = product["updated_at"]
+        elif updated_at is None:
+            updated_at = await crud_product.get_updated_at(product_id)
+        return respond(
             status="success",
             message="获取产品信息成功",
-            data=product
+            data=product,
+            headers=validator_headers(product_id, updated_at, projection)
         )
     except HTTPException:
         raise
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -233,6 +576,7 @@ async def get_product(product_id: str, db: AsyncIOMotorDatabase = Depends(get_db
 async def get_products(
     pagination: PaginationParams = Depends(),
     category: Optional[str] = Query(None, description="产品分类筛选"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，*表示全部，默认为摘要字段"),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """获取产品列表"""
@@ -242,17 +586,40 @@ async def get_products(
         if category:
             filters["category"] = category
             
-        crud_product = CRUDProduct(db[Product.Config.collection])
+        crud_product = CRUDProduct(db[Product.Config.collection], coalesce=coalesce_enabled("get_products"))
+        projection = default_projection(Product, fields)
+        if pagination.cursor is not None:
+            # 键集分页：按分类筛选时沿(category, _id)遍历
+            products, next_cursor = await crud_product.get_page_after(
+                cursor=pagination.cursor,
+                limit=pagination.size,
+                filters=filters,
+                sort_keys=["category", "_id"] if category else None,
+                projection=projection
+            )
+            total = await crud_product.count(filters) if pagination.with_total else None
+            return respond(
+                status="success",
+                message="获取产品列表成功",
+                data={
+                    "items": products,
+                    "total": total,
+                    "size": pagination.size,
+                    "next_cursor": next_cursor
+                }
+            )
+
         products = await crud_product.get_multi(
             skip=(pagination.page - 1) * pagination.size,
             limit=pagination.size,
-            filters=filters
+            filters=filters,
+            projection=projection
         )
         
-        total = await crud_product.count(filters)
-        pages = (total + pagination.size - 1) // pagination.size
+        total = await crud_product.count(filters) if pagination.with_total else None
+        pages = (total + pagination.size - 1) // pagination.size if total is not None else None
         
-        return BaseResponse(
+        return respond(
             status="success",
             message="获取产品列表成功",
             data={
@@ -263,6 +630,13 @@ async def get_products(
                 "pages": pages
             }
         )
+    except (InvalidCursorError, InvalidFieldsError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -273,9 +647,10 @@ async def get_products(
 async def update_product(
     product_id: str,
     product_in: ProductUpdate,
+    request: Request,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """更新产品信息"""
+    """更新产品信息（带If-Match时仅在ETag一致时更新）"""
     try:
         crud_product = CRUDProduct(db[Product.Config.collection])
         product_data = product_in.dict(exclude_unset=True)
@@ -286,18 +661,32 @@ async def update_product(
                 detail="没有提供更新数据"
             )
         
-        product = Product(**product_data)
-        updated = await crud_product.update(product_id, product)
+        conditions = None
+        if "if-match" in request.headers:
+            # 比较并更新：只在updated_at仍为校验时的值时写入
+            updated_at = await crud_product.get_updated_at(product_id, fresh=True)
+            check_if_match(request, product_id, updated_at)
+            conditions = {"updated_at": updated_at}
+
+        # 一次往返完成更新并取回更新后的文档
+        product = await crud_product.update(product_id, product_in, return_document=True, conditions=conditions)
         
-        if not updated:
+        if not product:
+            if conditions is not None:
+                raise HTTPException(
+                    status_code=status.HTTP_412_PRECONDITION_FAILED,
+                    detail="资源不存在或已被修改"
+                )
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="产品不存在"
             )
         
-        return BaseResponse(
+        return respond(
             status="success",
-            message="产品信息更新成功"
+            message="产品信息更新成功",
+            data=product,
+            headers=validator_headers(product_id, product.get("updated_at"))
         )
     except HTTPException:
         raise
@@ -320,7 +709,7 @@ async def delete_product(product_id: str, db: AsyncIOMotorDatabase = Depends(get
                 detail="产品不存在"
             )
         
-        return BaseResponse(
+        return respond(
             status="success",
             message="产品删除成功"
         )
@@ -338,28 +727,354 @@ async def delete_product(product_id: str, db: AsyncIOMotorDatabase = Depends(get
 async def create_graph(graph_in: GraphCreate, db: AsyncIOMotorDatabase = Depends(get_db)):
     """创建graph"""
     try:
-        graph = Graph(
-            user_id = graph_in.user_id,
-            graph_id = graph_in.graph_id,
-            graph_name = graph_in.graph_name,
-            graph_description = graph_in.graph_description,
-            graph_category= graph_in.graph_category,
-            graph_tags = graph_in.graph_tags,
-            graph_data = graph_in.graph_data
-        )
+        graph = _new_graph(graph_in)
         
          # 使用正确的 CRUD 类
         crud_graph = CRUDGraph(db[Graph.Config.collection])
         graph_id = await crud_graph.create(graph)
 
-        return BaseResponse(
+        return respond(
             status="success",
             message="graph创建成功",
-            data={"id": graph_id}
+            data={"id": graph_id},
+            status_code=status.HTTP_201_CREATED
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="graph已存在"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"创建graph失败: {str(e)}"
         )
 
+@router.post("/graphs/bulk", response_model=BaseResponse)
+async def create_graphs_bulk(
+    items: List[Dict[str, Any]],
+    chunk_size: Optional[int] = Query(None, ge=1, le=10000, description="每批写入条数"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """批量创建graph"""
+    try:
+        crud_graph = CRUDGraph(db[Graph.Config.collection])
+        result = await _bulk_create(crud_graph, items, lambda item: _new_graph(GraphCreate(**item)), chunk_size)
+        return respond(
+            status="success",
+            message="批量创建graph完成",
+            data=result
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量创建graph失败: {str(e)}"
+        )
+
+@router.post("/graphs/batch-get", response_model=BaseResponse)
+async def batch_get_graphs(
+    request: BatchGetRequest,
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """按ID批量获取Graph"""
+    try:
+        crud_graph = CRUDGraph(db[Graph.Config.collection])
+        result = await _batch_get(crud_graph, request.ids, build_projection(Graph, fields))
+        return respond(
+            status="success",
+            message="批量获取Graph成功",
+            data=result
+        )
+    except HTTPException:
+        raise
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量获取Graph失败: {str(e)}"
+        )
+
+@router.get("/graphs", response_model=BaseResponse)
+async def get_graphs(
+    pagination: PaginationParams = Depends(),
+    user_id: Optional[str] = Query(None, description="用户ID筛选"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，*表示全部，默认为摘要字段"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """获取graph列表"""
+    try:
+        # 构建筛选条件
+        filters = {}
+        if user_id:
+            filters["user_id"] = user_id
+
+        crud_graph = CRUDGraph(db[Graph.Config.collection], coalesce=coalesce_enabled("get_graphs"))
+        projection = default_projection(Graph, fields)
+        if pagination.cursor is not None:
+            # 键集分页
+            graphs, next_cursor = await crud_graph.get_page_after(
+                cursor=pagination.cursor,
+                limit=pagination.size,
+                filters=filters,
+                projection=projection
+            )
+            total = await crud_graph.count(filters) if pagination.with_total else None
+            return respond(
+                status="success",
+                message="获取graph列表成功",
+                data={
+                    "items": graphs,
+                    "total": total,
+                    "size": pagination.size,
+                    "next_cursor": next_cursor
+                }
+            )
+
+        graphs = await crud_graph.get_multi(
+            skip=(pagination.page - 1) * pagination.size,
+            limit=pagination.size,
+            filters=filters,
+            projection=projection
+        )
+
+        total = await crud_graph.count(filters) if pagination.with_total else None
+        pages = (total + pagination.size - 1) // pagination.size if total is not None else None
+
+        return respond(
+            status="success",
+            message="获取graph列表成功",
+            data={
+                "items": graphs,
+                "total": total,
+                "page": pagination.page,
+                "size": pagination.size,
+                "pages": pages
+            }
+        )
+    except (InvalidCursorError, InvalidFieldsError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取graph列表失败: {str(e)}"
+        )
+
+@router.get("/graphs/export")
+async def export_graphs(
+    user_id: Optional[str] = Query(None, description="用户ID筛选"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    batch_size: Optional[int] = Query(None, ge=1, le=10000, description="游标每批取回的文档数"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """以NDJSON流式导出graph"""
+    try:
+        filters = {}
+        if user_id:
+            filters["user_id"] = user_id
+        projection = build_projection(Graph, fields)
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    crud_graph = CRUDGraph(db[Graph.Config.collection])
+    return _export_response(
+        crud_graph.iter_documents(filters, projection, batch_size),
+        "graphs"
+    )
+
+@router.get("/graphs/{user_id}/{graph_id}", response_model=BaseResponse)
+async def get_graph(
+    user_id: str,
+    graph_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，默认全部"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """获取graph（支持If-None-Match/If-Modified-Since条件请求）"""
+    try:
+        crud_graph = CRUDGraph(db[Graph.Config.collection], coalesce=coalesce_enabled("get_graph"))
+        projection = build_projection(Graph, fields)
+        key = f"{user_id}/{graph_id}"
+        updated_at = None
+        if has_read_conditions(request):
+            # 只取updated_at判断是否变化，未变化的graph不读取和序列化graph_data
+            updated_at = await crud_graph.get_graph_updated_at(user_id, graph_id)
+            check_not_modified(request, key, updated_at, projection)
+        graph = await crud_graph.get_graph(user_id, graph_id, projection=projection)
+
+        if not graph:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="graph不存在"
+            )
+
+        if "updated_at" in graph:
+            updated_at = graph["updated_at"]
+        elif updated_at is None:
+            updated_at = await crud_graph.get_graph_updated_at(user_id, graph_id)
+        return respond(
+            status="success",
+            message="获取graph成功",
+            data=graph,
+            headers=validator_headers(key, updated_at, projection)
+        )
+    except HTTPException:
+        raise
+    except InvalidFieldsError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取graph失败: {str(e)}"
+        )
+
+@router.put("/graphs/{user_id}/{graph_id}", response_model=BaseResponse)
+async def save_graph(
+    user_id: str,
+    graph_id: str,
+    graph_in: GraphDataUpdate,
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """保存graph数据（带If-Match时仅在ETag一致时保存）"""
+    try:
+        crud_graph = CRUDGraph(db[Graph.Config.collection])
+        key = f"{user_id}/{graph_id}"
+        expected_updated_at = None
+        if "if-match" in request.headers:
+            expected_updated_at = await crud_graph.get_graph_updated_at(user_id, graph_id, fresh=True)
+            check_if_match(request, key, expected_updated_at)
+        updated_at = await crud_graph.set_graph(user_id, graph_id, graph_in.graph_data, expected_updated_at)
+
+        if updated_at is None:
+            raise HTTPException(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                detail="资源不存在或已被修改"
+            )
+
+        return respond(
+            status="success",
+            message="graph保存成功",
+            headers=validator_headers(key, updated_at)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"保存graph失败: {str(e)}"
+        )
+
+
+@router.patch("/graphs/{user_id}/{graph_id}", response_model=BaseResponse)
+async def patch_graph(
+    user_id: str,
+    graph_id: str,
+    patch_in: GraphPatch,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """按JSON Patch局部更新graph数据"""
+    try:
+        crud_graph = CRUDGraph(db[Graph.Config.collection])
+        version = await crud_graph.patch_graph(
+            user_id,
+            graph_id,
+            [operation.model_dump(exclude_unset=True) for operation in patch_in.operations],
+            expected_version=patch_in.expected_version
+        )
+
+        if version is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="graph不存在"
+            )
+
+        return respond(
+            status="success",
+            message="graph更新成功",
+            data={"version": version}
+        )
+    except HTTPException:
+        raise
+    except InvalidPatchError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except PatchConflictError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": str(e), "current_version": e.current_version}
+        )
+    except OperationFailure as e:
+        # 由服务端拒绝的补丁(如写入后的文档超出大小限制)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"补丁无法应用: {e.details.get('errmsg') if e.details else str(e)}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"更新graph失败: {str(e)}"
+        )
+
+# 缓存统计
+@router.get("/cache/stats", response_model=BaseResponse)
+async def get_cache_stats():
+    """获取文档缓存命中/未命中/淘汰计数、读合并计数及graph写缓冲状态"""
+    cache = get_document_cache()
+    return respond(
+        status="success",
+        message="获取缓存统计成功",
+        data={
+            "documents": cache.stats() if cache is not None else None,
+            "coalescing": read_flight.stats(),
+            "graph_write_behind": graph_write_buffer.stats()
+        }
+    )
+
+@router.get("/admin/slow-queries", response_model=BaseResponse)
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=200, description="返回的查询结构数"),
+    sort: Literal["total_ms", "max_ms", "count"] = Query("total_ms", description="排序依据")
+):
+    """获取最慢的查询结构（取值已脱敏），plan为抽样explain得到的获胜执行计划"""
+    return respond(
+        status="success",
+        message="获取慢查询成功",
+        data={
+            "threshold_ms": slow_query_recorder.threshold_ms,
+            "explain_sample_rate": slow_query_recorder.sample_rate,
+            "shapes": slow_query_recorder.top(limit, sort)
+        }
+    )
+
+@router.get("/admin/admission", response_model=BaseResponse)
+async def get_admission_stats():
+    """获取准入控制的并发、排队及拒绝(shed)统计"""
+    return respond(
+        status="success",
+        message="获取准入控制统计成功",
+        data={
+            "enabled": settings.ADMISSION_CONTROL,
+            **admission_controller.stats()
+        }
+    )
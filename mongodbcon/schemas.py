@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 from enum import Enum
 
@@ -21,6 +21,8 @@ class PaginationParams(BaseModel):
     """分页参数"""
     page: int = Field(1, ge=1, description="页码")
     size: int = Field(10, ge=1, le=100, description="每页大小")
+    cursor: Optional[str] = Field(None, description="分页游标，传入时使用键集分页(空字符串表示第一页)，忽略page")
+    with_total: bool = Field(True, description="是否返回总数，false时跳过计数")
 
 # 分页响应
 class PaginatedResponse(BaseResponse):
@@ -30,6 +32,11 @@ class PaginatedResponse(BaseResponse):
     size: int = 10
     pages: int = 0
 
+# 按ID批量获取
+class BatchGetRequest(BaseModel):
+    """按ID批量获取请求"""
+    ids: List[str] = Field(..., min_length=1, description="文档ID列表，结果按此顺序返回")
+
 # 用户相关模式
 class UserCreate(BaseModel):
     """创建用户请求"""
@@ -107,6 +114,21 @@ class GraphUpdate(BaseModel):
     graph_tags: List[str] = Field(default=[],description="Graph标签")
     graph_data: Dict[str, Any] = Field(..., description="Graph数据")
 
+class GraphDataUpdate(BaseModel):
+    """保存Graph数据请求"""
+    graph_data: Dict[str, Any] = Field(..., description="Graph数据")
+
+class JsonPatchOperation(BaseModel):
+    """JSON Patch操作(RFC 6902)，路径相对于graph_data"""
+    op: Literal["add", "remove", "replace", "test"]
+    path: str = Field(..., description="JSON Pointer，如 /nodes/0/position")
+    value: Any = None
+
+class GraphPatch(BaseModel):
+    """局部更新Graph数据请求"""
+    operations: List[JsonPatchOperation] = Field(..., min_length=1, description="JSON Patch操作列表")
+    expected_version: Optional[int] = Field(None, ge=0, description="期望的当前版本号，不一致时返回409")
+
 class GraphResponse(BaseModel):
     """Graph响应"""
     id: str
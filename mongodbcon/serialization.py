@@ -0,0 +1,70 @@
+"""响应序列化
+
+FastAPI对response_model=BaseResponse的返回值会再校验一遍并用jsonable_encoder逐层遍历，
+列表和graph_data较大时开销明显。启用FAST_JSON_RESPONSES后，respond直接把相同结构的
+响应体编码为JSON，datetime和ObjectId在编码时处理。
+"""
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Optional
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from config import settings
+from schemas import BaseResponse
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时退回标准库json
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"无法序列化类型: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """编码为UTF-8 JSON；orjson原生处理datetime和Enum，ObjectId经_default转为字符串"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """不经校验直接编码的JSON响应"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def respond(
+    status: str = "success",
+    message: Optional[str] = None,
+    data: Any = None,
+    error_code: Optional[str] = None,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None
+):
+    """构造与BaseResponse结构相同的响应
+
+    未启用FAST_JSON_RESPONSES且没有附加响应头时返回BaseResponse，由FastAPI按response_model处理；
+    返回Response对象时路由装饰器上的status_code不生效，需通过status_code传入。
+    """
+    if not settings.FAST_JSON_RESPONSES:
+        body = BaseResponse(status=status, message=message, data=data, error_code=error_code)
+        if not headers:
+            return body
+        return JSONResponse(jsonable_encoder(body), status_code=status_code, headers=headers)
+    return FastJSONResponse(
+        {"status": status, "message": message, "data": data, "error_code": error_code},
+        status_code=status_code,
+        headers=headers
+    )
@@ -0,0 +1,246 @@
+"""慢查询记录
+
+通过命令监听记录耗时超过SLOW_QUERY_MS的命令，按"集合+命令+脱敏后的查询结构"聚合；
+按SLOW_QUERY_EXPLAIN_SAMPLE_RATE抽样在事件循环中异步执行explain，保存获胜的执行计划，
+未走索引的查询会显示为COLLSCAN。
+"""
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import monitoring
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 命令名 -> 命令中携带查询条件的字段
+_FILTER_FIELDS = {
+    "find": ("filter", "sort", "projection"),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort"),
+    "aggregate": ("pipeline",),
+    "update": ("updates",),
+    "delete": ("deletes",),
+    "insert": (),
+}
+
+# explain时去掉的会话、事务及读写关注等字段
+_EXPLAIN_DROP_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+
+def redact(value: Any) -> Any:
+    """保留字段名和操作符，将取值替换为"?" """
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $and/$or/管道等由文档组成的数组保留结构，取值数组整体脱敏
+        if value and all(isinstance(item, dict) for item in value):
+            return [redact(item) for item in value]
+        return "?"
+    return "?"
+
+
+def command_shape(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    """提取命令中与执行计划相关的部分并脱敏"""
+    shape = {}
+    for field in _FILTER_FIELDS.get(command_name, ()):
+        if field not in command:
+            continue
+        value = command[field]
+        if field in ("updates", "deletes"):
+            # 批量写只取第一条语句的查询条件
+            value = value[0].get("q", {}) if value else {}
+        elif field == "key":
+            shape[field] = value
+            continue
+        elif field in ("sort", "projection"):
+            shape[field] = {key: item for key, item in value.items()}
+            continue
+        shape[field] = redact(value)
+    return shape
+
+
+def _plan_summary(plan: Dict[str, Any]) -> str:
+    """将获胜计划的阶段树概括为"FETCH > IXSCAN(category_1__id_1)"形式"""
+    stages = []
+    node = plan.get("queryPlan", plan)
+    while node:
+        stage = node.get("stage", "?")
+        if node.get("indexName"):
+            stage = f"{stage}({node['indexName']})"
+        stages.append(stage)
+        if "inputStage" in node:
+            node = node["inputStage"]
+        elif node.get("inputStages"):
+            stages.append("[" + ", ".join(_plan_summary(child) for child in node["inputStages"]) + "]")
+            break
+        else:
+            break
+    return " > ".join(stages)
+
+
+def _explain_command(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    explained = {
+        key: value for key, value in command.items()
+        if not key.startswith("$") and key not in _EXPLAIN_DROP_FIELDS
+    }
+    # explain只接受单条写语句
+    for field in ("updates", "deletes"):
+        if field in explained:
+            explained[field] = explained[field][:1]
+    return {"explain": explained, "verbosity": "queryPlanner"}
+
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    """记录慢命令并按查询结构聚合
+
+    监听方法在驱动的I/O线程中调用，统计数据用锁保护；explain通过call_soon_threadsafe交给事件循环执行。
+    """
+
+    def __init__(self, threshold_ms: float, sample_rate: float = 0.0, max_shapes: int = 1000):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        # (connection_id, request_id) -> 已开始但未结束的命令
+        self._started: Dict[Tuple[Any, int], Tuple[str, str, Dict[str, Any]]] = {}
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self._explaining = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop, client):
+        """绑定用于执行explain的事件循环和客户端"""
+        self._loop = loop
+        self._client = client
+
+    def unbind(self):
+        self._loop = None
+        self._client = None
+
+    def started(self, event):
+        if event.command_name not in _FILTER_FIELDS:
+            return
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (
+                event.database_name, event.command_name, event.command
+            )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        if event.command_name not in _FILTER_FIELDS:
+            return
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if started is None or duration_ms < self.threshold_ms:
+            return
+
+        database_name, command_name, command = started
+        collection = command.get(command_name)
+        namespace = f"{database_name}.{collection}"
+        shape = command_shape(command_name, command)
+        key = json.dumps([namespace, command_name, shape], sort_keys=True, default=str)
+        logger.warning(
+            f"慢查询: {namespace} {command_name} 耗时{duration_ms:.1f}ms"
+            f"{' (失败)' if failed else ''} shape={json.dumps(shape, default=str, ensure_ascii=False)}"
+        )
+
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    # 淘汰累计耗时最少的结构
+                    coldest = min(self._shapes, key=lambda k: self._shapes[k]["total_ms"])
+                    del self._shapes[coldest]
+                entry = self._shapes[key] = {
+                    "namespace": namespace,
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "failed": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "last_seen": None,
+                    "plan": None,
+                    "collscan": None
+                }
+            entry["count"] += 1
+            entry["failed"] += int(failed)
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = time.time()
+            explain = (
+                command_name != "insert"
+                and key not in self._explaining
+                and self._loop is not None
+                and random.random() < self.sample_rate
+            )
+            if explain:
+                self._explaining.add(key)
+
+        if explain:
+            try:
+                self._loop.call_soon_threadsafe(
+                    self._start_explain, key, database_name, _explain_command(command_name, command)
+                )
+            except RuntimeError:
+                # 事件循环已关闭
+                with self._lock:
+                    self._explaining.discard(key)
+
+    def _start_explain(self, key: str, database_name: str, command: Dict[str, Any]):
+        asyncio.ensure_future(self._explain(key, database_name, command))
+
+    async def _explain(self, key: str, database_name: str, command: Dict[str, Any]):
+        try:
+            client = self._client
+            if client is None:
+                return
+            result = await client[database_name].command(command)
+            planner = result.get("queryPlanner") or result.get("stages", [{}])[0].get("$cursor", {}).get("queryPlanner", {})
+            winning = planner.get("winningPlan")
+            if winning:
+                summary = _plan_summary(winning)
+                with self._lock:
+                    entry = self._shapes.get(key)
+                    if entry is not None:
+                        entry["plan"] = summary
+                        entry["collscan"] = "COLLSCAN" in summary
+        except Exception as e:
+            logger.warning(f"慢查询explain失败: {e}")
+        finally:
+            with self._lock:
+                self._explaining.discard(key)
+
+    def top(self, limit: int = 20, sort: str = "total_ms") -> List[Dict[str, Any]]:
+        """按累计耗时(total_ms)、最大耗时(max_ms)或次数(count)返回前limit个慢查询结构"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._shapes.values()]
+        entries.sort(key=lambda entry: entry[sort], reverse=True)
+        for entry in entries:
+            entry["avg_ms"] = round(entry["total_ms"] / entry["count"], 3)
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+# 慢查询记录器实例；SLOW_QUERY_MS<=0时不注册
+slow_query_recorder = SlowQueryRecorder(
+    threshold_ms=settings.SLOW_QUERY_MS,
+    sample_rate=settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+    max_shapes=settings.SLOW_QUERY_MAX_SHAPES
+)
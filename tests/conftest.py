@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# mongodbcon内的模块以平铺方式相互导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mongodbcon"))
+
+from memory_backend import MemoryClient  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def memory_databases():
+    """同一进程内的MemoryClient共享数据，每个测试从空库开始"""
+    MemoryClient._databases.clear()
+    yield
+    MemoryClient._databases.clear()
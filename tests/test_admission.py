@@ -0,0 +1,142 @@
+"""准入控制：请求分类、按优先级分配名额、队列满时挤出、等待超时和503响应"""
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionMiddleware, classify
+
+
+@pytest.mark.parametrize("method, path, expected", [
+    ("GET", "/api/generator/users/abc", "read"),
+    ("GET", "/api/generator/products", "list"),
+    ("PATCH", "/api/generator/graphs/u/g", "write"),
+    ("POST", "/api/generator/users/bulk", "bulk"),
+    ("POST", "/api/generator/products/batch-get", "bulk"),
+    ("GET", "/api/generator/admin/stats", None),
+    ("GET", "/health", None),
+])
+def test_classify(method, path, expected):
+    assert classify(method, path) == expected
+
+
+def _controller(max_concurrency=1, max_queue=10, queue_timeout=5.0, **limits):
+    return AdmissionController(
+        max_concurrency=max_concurrency,
+        limits={"read": 10, "write": 10, "list": 10, "bulk": 10, **limits},
+        max_queue=max_queue,
+        queue_timeout=queue_timeout
+    )
+
+
+def test_waiters_are_admitted_by_priority():
+    controller = _controller()
+    admitted = []
+
+    async def request(request_class):
+        assert await controller.acquire(request_class)
+        admitted.append(request_class)
+        await asyncio.sleep(0)
+        controller.release(request_class)
+
+    async def main():
+        assert await controller.acquire("bulk")
+        tasks = [asyncio.ensure_future(request(name)) for name in ("bulk", "list", "write", "read")]
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == {"read": 1, "write": 1, "list": 1, "bulk": 1}
+        controller.release("bulk")
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert admitted == ["read", "write", "list", "bulk"]
+    assert controller.stats()["in_flight"] == {"read": 0, "write": 0, "list": 0, "bulk": 0}
+
+
+def test_class_limit_does_not_block_other_classes():
+    controller = _controller(max_concurrency=4, bulk=1)
+
+    async def main():
+        assert await controller.acquire("bulk")
+        waiting = asyncio.ensure_future(controller.acquire("bulk"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        assert await controller.acquire("read")
+        controller.release("bulk")
+        assert await waiting
+
+    asyncio.run(main())
+
+
+def test_full_queue_evicts_lower_priority_waiter():
+    controller = _controller(max_queue=1)
+
+    async def main():
+        assert await controller.acquire("write")
+        bulk = asyncio.ensure_future(controller.acquire("bulk"))
+        await asyncio.sleep(0)
+        read = asyncio.ensure_future(controller.acquire("read"))
+        # 被挤出的等待者立即得到拒绝
+        assert await bulk is False
+        # 队列中的等待者优先级更高或相同时，新请求直接被拒绝
+        assert await controller.acquire("list") is False
+        controller.release("write")
+        assert await read
+
+    asyncio.run(main())
+    shed = controller.stats()["shed"]
+    assert shed["bulk"]["queue_full"] == 1
+    assert shed["list"]["queue_full"] == 1
+
+
+def test_queue_timeout_sheds_request():
+    controller = _controller(queue_timeout=0.01)
+
+    async def main():
+        assert await controller.acquire("read")
+        assert await controller.acquire("read") is False
+        controller.release("read")
+        # 超时的等待者不会占用之后释放的名额
+        assert await controller.acquire("read")
+
+    asyncio.run(main())
+    assert controller.stats()["shed"]["read"]["timeout"] == 1
+    assert controller.stats()["queued"]["read"] == 0
+
+
+def test_middleware_returns_503_with_retry_after():
+    controller = _controller(max_queue=0)
+    release = None
+
+    async def app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(app, controller, retry_after=3)
+
+    async def call(method, path):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware({"type": "http", "method": method, "path": path}, receive, send)
+        return messages
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(call("GET", "/api/generator/users/1"))
+        await asyncio.sleep(0)
+        shed = await call("GET", "/api/generator/users/2")
+        release.set()
+        return await first, shed, await call("GET", "/api/generator/users/3")
+
+    first, shed, after = asyncio.run(main())
+    assert first[0]["status"] == 200
+    assert shed[0]["status"] == 503
+    assert dict(shed[0]["headers"])[b"retry-after"] == b"3"
+    assert after[0]["status"] == 200
+    assert controller.stats()["in_flight"]["read"] == 0
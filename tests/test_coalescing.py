@@ -0,0 +1,95 @@
+import asyncio
+
+from crud import CRUDGraph, SingleFlight
+from memory_backend import MemoryClient
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": len(calls)}
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert results == [{"value": 1}] * 5
+    assert len(calls) == 1
+    assert flight.executed == 1
+    assert flight.coalesced == 4
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_forget_prefix():
+    flight = SingleFlight()
+    release = None
+    calls = []
+
+    async def slow():
+        calls.append("slow")
+        await release.wait()
+        return "old"
+
+    async def fast():
+        calls.append("fast")
+        return "new"
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(flight.do('["db.graphs","get"]', slow))
+        other = asyncio.ensure_future(flight.do('["db.users","get"]', slow))
+        await asyncio.sleep(0)
+        flight.forget_prefix('["db.graphs",')
+        # 写之后发起的读不再加入写之前的查询
+        second = await flight.do('["db.graphs","get"]', fast)
+        # 其他集合的查询不受影响
+        joined = asyncio.ensure_future(flight.do('["db.users","get"]', fast))
+        release.set()
+        return await first, second, await other, await joined
+
+    assert asyncio.run(main()) == ("old", "new", "old", "old")
+    assert calls == ["slow", "slow", "fast"]
+
+
+def test_read_after_patch_does_not_join_earlier_read():
+    async def main():
+        database = MemoryClient()["test"]
+        collection = database["graphs"]
+        crud = CRUDGraph(collection, coalesce=True)
+        await collection.insert_one({"user_id": "u", "graph_id": "g", "graph_data": {"name": "old"}, "version": 1})
+
+        # 第一次读阻塞在查询中，模拟写之前发起、尚未返回的读
+        release = asyncio.Event()
+        started = asyncio.Event()
+        find_one = collection.find_one
+        blocked = []
+
+        async def slow_find_one(*args, **kwargs):
+            document = await find_one(*args, **kwargs)
+            if not blocked:
+                blocked.append(1)
+                started.set()
+                await release.wait()
+            return document
+
+        collection.find_one = slow_find_one
+        first = asyncio.ensure_future(crud.get_graph("u", "g"))
+        await started.wait()
+
+        version = await crud.patch_graph("u", "g", [{"op": "replace", "path": "/name", "value": "new"}])
+        assert version == 2
+        try:
+            second = await asyncio.wait_for(crud.get_graph("u", "g"), 1)
+        finally:
+            release.set()
+        return await first, second
+
+    first, second = asyncio.run(main())
+    assert first["graph_data"] == {"name": "old"}
+    assert second["graph_data"] == {"name": "new"}
+    assert second["version"] == 2
@@ -0,0 +1,99 @@
+"""键集分页：游标编码/解析和get_page_after逐页遍历"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from crud import CRUDBase, InvalidCursorError, decode_cursor, encode_cursor
+from memory_backend import MemoryClient
+
+
+@pytest.mark.parametrize("values", [
+    [ObjectId()],
+    ["category-1", 12.5, ObjectId()],
+    [None, datetime(2024, 5, 1, 12, 30, 15, 123000), ObjectId()],
+    ["含/和+的字符串", ObjectId()],
+])
+def test_cursor_round_trip(values):
+    cursor = encode_cursor(values)
+    # URL安全，不带填充
+    assert not set(cursor) & set("+/=")
+    assert decode_cursor(cursor, len(values)) == values
+
+
+@pytest.mark.parametrize("cursor, size", [
+    ("not a cursor!", 1),
+    (encode_cursor([ObjectId()]), 2),
+    ("eyJhIjogMX0", 1),  # {"a": 1}
+    ("", 1),
+])
+def test_invalid_cursor(cursor, size):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, size)
+
+
+def _products():
+    collection = MemoryClient()["test"]["products"]
+    # 价格有重复，同价格按_id区分先后
+    documents = [{"name": f"p{i}", "price": float(i % 4), "category": f"c{i % 2}"} for i in range(25)]
+    return collection, CRUDBase(collection, coalesce=False), documents
+
+
+async def _walk(crud, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        page, cursor = await crud.get_page_after(cursor, limit, **kwargs)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_document_once_in_order():
+    async def main():
+        collection, crud, documents = _products()
+        await collection.insert_many(documents)
+        pages = await _walk(crud, 10, sort_keys=["price"])
+        expected = sorted(documents, key=lambda document: (document["price"], document["_id"]))
+        return pages, [str(document["_id"]) for document in expected]
+
+    pages, expected = asyncio.run(main())
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [document["id"] for page in pages for document in page] == expected
+
+
+def test_pages_with_filters_and_projection():
+    async def main():
+        collection, crud, documents = _products()
+        await collection.insert_many(documents)
+        pages = await _walk(crud, 4, filters={"category": "c1"}, projection={"name": 1})
+        expected = sorted(
+            (document for document in documents if document["category"] == "c1"),
+            key=lambda document: document["_id"]
+        )
+        return pages, expected
+
+    pages, expected = asyncio.run(main())
+    found = [document for page in pages for document in page]
+    assert [document["id"] for document in found] == [str(document["_id"]) for document in expected]
+    assert all(set(document) == {"id", "name"} for document in found)
+
+
+def test_exact_last_page_has_no_next_cursor():
+    async def main():
+        collection, crud, documents = _products()
+        await collection.insert_many(documents[:10])
+        return await crud.get_page_after(None, 10)
+
+    page, cursor = asyncio.run(main())
+    assert len(page) == 10
+    assert cursor is None
+
+
+def test_get_page_after_rejects_cursor_for_other_sort():
+    async def main():
+        _, crud, _ = _products()
+        await crud.get_page_after(encode_cursor([ObjectId()]), 10, sort_keys=["price"])
+
+    with pytest.raises(InvalidCursorError):
+        asyncio.run(main())
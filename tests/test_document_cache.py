@@ -0,0 +1,98 @@
+"""文档缓存：失效代数防止并发写之前读到的旧文档被写回缓存"""
+import asyncio
+
+from crud import CRUDBase, CRUDGraph, LRUDocumentCache
+from memory_backend import MemoryClient
+
+
+def test_set_is_skipped_after_delete():
+    async def main():
+        cache = LRUDocumentCache(max_size=10, ttl=60)
+        generation = await cache.generation("a")
+        await cache.delete("a")
+        await cache.set("a", {"v": 1}, generation)
+        assert await cache.get("a") is None
+
+        # 其他键的失效不影响
+        generation = await cache.generation("a")
+        await cache.delete("b")
+        await cache.set("a", {"v": 2}, generation)
+        assert await cache.get("a") == {"v": 2}
+        assert cache.stats()["stale_sets"] == 1
+
+    asyncio.run(main())
+
+
+def test_pruned_invalidations_skip_older_generations():
+    async def main():
+        cache = LRUDocumentCache(max_size=2, ttl=60)
+        generation = await cache.generation("a")
+        await cache.delete("a", "b", "c")
+        # a的失效记录已被清理，无法判断，跳过写入
+        await cache.set("a", {"v": 1}, generation)
+        assert await cache.get("a") is None
+        # 清理之后读取的代数不受影响
+        generation = await cache.generation("a")
+        await cache.set("a", {"v": 2}, generation)
+        assert await cache.get("a") == {"v": 2}
+
+    asyncio.run(main())
+
+
+def _block_first_find_one(collection):
+    """第一次find_one查到文档后阻塞，直到返回的事件被设置"""
+    release = asyncio.Event()
+    started = asyncio.Event()
+    find_one = collection.find_one
+    blocked = []
+
+    async def slow_find_one(*args, **kwargs):
+        document = await find_one(*args, **kwargs)
+        if not blocked:
+            blocked.append(1)
+            started.set()
+            await release.wait()
+        return document
+
+    collection.find_one = slow_find_one
+    return started, release
+
+
+def test_read_racing_update_does_not_cache_stale_document():
+    async def main():
+        collection = MemoryClient()["test"]["users"]
+        cache = LRUDocumentCache(max_size=10, ttl=60)
+        crud = CRUDBase(collection, cache=cache, coalesce=False)
+        id = str((await collection.insert_one({"name": "old"})).inserted_id)
+
+        started, release = _block_first_find_one(collection)
+        read = asyncio.ensure_future(crud.get(id))
+        await started.wait()
+        # 读已查到旧文档、尚未写入缓存时，写操作完成并使缓存失效
+        await crud.update(id, {"name": "new"})
+        release.set()
+        assert (await read)["name"] == "old"
+
+        assert await cache.get(crud._cache_key(id)) is None
+        assert (await crud.get(id))["name"] == "new"
+
+    asyncio.run(main())
+
+
+def test_graph_read_racing_set_graph_does_not_cache_stale_graph():
+    async def main():
+        collection = MemoryClient()["test"]["graphs"]
+        cache = LRUDocumentCache(max_size=10, ttl=60)
+        crud = CRUDGraph(collection, cache=cache, coalesce=False)
+        await crud.set_graph("u", "g", {"name": "old"})
+
+        started, release = _block_first_find_one(collection)
+        read = asyncio.ensure_future(crud.get_graph("u", "g"))
+        await started.wait()
+        await crud.set_graph("u", "g", {"name": "new"})
+        release.set()
+        assert (await read)["graph_data"] == {"name": "old"}
+
+        assert (await crud.get_graph("u", "g"))["graph_data"] == {"name": "new"}
+
+    asyncio.run(main())
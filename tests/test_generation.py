@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("langgraphgenpy")
+
+from generation import GenerationService  # noqa: E402
+
+
+class BrokenExecutor:
+    """提交的任务都以BrokenProcessPool结束，模拟子进程异常退出"""
+
+    def __init__(self):
+        self.shutdown_calls = []
+
+    def submit(self, fn, *args):
+        future = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().call_later(0.01, future.set_exception, BrokenProcessPool("worker died"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shutdown_calls.append(wait)
+
+
+def test_broken_pool_does_not_discard_rebuilt_pool(monkeypatch):
+    service = GenerationService(workers=2, queue_limit=2)
+    broken = BrokenExecutor()
+    rebuilt = BrokenExecutor()
+    service._executor = broken
+
+    async def fake_run_in_executor(self, executor, fn, *args):
+        return await executor.submit(fn, *args)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        monkeypatch.setattr(type(loop), "run_in_executor", fake_run_in_executor)
+        first = asyncio.ensure_future(service._submit("spec", "yaml", "python", ["t"], True))
+        second = asyncio.ensure_future(service._submit("spec", "yaml", "python", ["t"], True))
+        await asyncio.sleep(0)
+        # 第一个请求失败前，进程池已被其他请求重建
+        service._executor = rebuilt
+        for task in (first, second):
+            with pytest.raises(BrokenProcessPool):
+                await task
+
+    asyncio.run(main())
+    assert service._executor is rebuilt
+    assert rebuilt.shutdown_calls == []
+    assert broken.shutdown_calls == [False, False]
+    assert service.failed == 2
+    assert service.pending == 0
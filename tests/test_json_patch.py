@@ -0,0 +1,160 @@
+"""json_patch_to_update：JSON Patch在graph_data上的应用及转换出的MongoDB更新"""
+import asyncio
+
+import pytest
+
+from crud import InvalidPatchError, PatchConflictError, json_patch_to_update
+from memory_backend import MemoryClient
+
+
+def test_numeric_object_key_is_set_not_pushed():
+    document = {"nodes_by_id": {"123": {"x": 1}}}
+    patched, update = json_patch_to_update(document, [
+        {"op": "add", "path": "/nodes_by_id/456", "value": {"x": 2}},
+        {"op": "remove", "path": "/nodes_by_id/123"}
+    ], "graph_data")
+    assert patched == {"nodes_by_id": {"456": {"x": 2}}}
+    assert update == {
+        "$set": {"graph_data.nodes_by_id.456": {"x": 2}},
+        "$unset": {"graph_data.nodes_by_id.123": ""}
+    }
+
+
+def test_array_remove_keeps_existing_nulls():
+    patched, update = json_patch_to_update({"nodes": [None, 1, 2]}, [
+        {"op": "remove", "path": "/nodes/1"}
+    ], "graph_data")
+    assert patched == {"nodes": [None, 2]}
+    assert update == {"$set": {"graph_data.nodes": [None, 2]}}
+
+
+def test_array_indices_apply_sequentially():
+    patched, update = json_patch_to_update({"nodes": ["a", "b", "c"]}, [
+        {"op": "remove", "path": "/nodes/0"},
+        {"op": "remove", "path": "/nodes/0"},
+        {"op": "add", "path": "/nodes/1", "value": "d"},
+        {"op": "add", "path": "/nodes/-", "value": "e"}
+    ], "graph_data")
+    assert patched == {"nodes": ["c", "d", "e"]}
+    assert update == {"$set": {"graph_data.nodes": ["c", "d", "e"]}}
+
+
+def test_element_replace_writes_only_that_element():
+    _, update = json_patch_to_update({"nodes": [{"x": 1}, {"x": 2}]}, [
+        {"op": "replace", "path": "/nodes/1/x", "value": 5}
+    ], "graph_data")
+    assert update == {"$set": {"graph_data.nodes.1.x": 5}}
+
+
+def test_paths_under_rewritten_array_are_not_written_separately():
+    patched, update = json_patch_to_update({"nodes": [{"x": 1}, {"x": 2}]}, [
+        {"op": "replace", "path": "/nodes/1/x", "value": 5},
+        {"op": "remove", "path": "/nodes/0"}
+    ], "graph_data")
+    assert patched == {"nodes": [{"x": 5}]}
+    assert update == {"$set": {"graph_data.nodes": [{"x": 5}]}}
+
+
+def test_append_is_pushed():
+    patched, update = json_patch_to_update({"nodes": ["a", "b"]}, [
+        {"op": "add", "path": "/nodes/-", "value": "c"},
+        {"op": "add", "path": "/nodes/3", "value": "d"}
+    ], "graph_data")
+    assert patched == {"nodes": ["a", "b", "c", "d"]}
+    assert update == {"$push": {"graph_data.nodes": {"$each": ["c", "d"]}}}
+
+
+def test_contiguous_insert_is_pushed_with_position():
+    patched, update = json_patch_to_update({"nodes": ["a", "b", "c"]}, [
+        {"op": "add", "path": "/nodes/1", "value": "x"},
+        {"op": "add", "path": "/nodes/1", "value": "w"},
+        {"op": "add", "path": "/nodes/3", "value": "y"},
+        {"op": "replace", "path": "/nodes/2", "value": "X"}
+    ], "graph_data")
+    assert patched == {"nodes": ["a", "w", "X", "y", "b", "c"]}
+    assert update == {"$push": {"graph_data.nodes": {"$each": ["w", "X", "y"], "$position": 1}}}
+
+
+@pytest.mark.parametrize("operations", [
+    # 不连续的插入
+    [{"op": "add", "path": "/nodes/0", "value": "x"}, {"op": "add", "path": "/nodes/-", "value": "y"}],
+    # 插入后删除
+    [{"op": "add", "path": "/nodes/-", "value": "x"}, {"op": "remove", "path": "/nodes/0"}],
+    # 同一数组内还有其他元素要写入
+    [{"op": "replace", "path": "/nodes/0", "value": "x"}, {"op": "add", "path": "/nodes/-", "value": "y"}],
+    [{"op": "add", "path": "/nodes/-", "value": {"ports": []}}, {"op": "add", "path": "/nodes/2/ports/-", "value": 1}],
+])
+def test_inserts_fall_back_to_whole_array(operations):
+    patched, update = json_patch_to_update({"nodes": ["a", "b"]}, operations, "graph_data")
+    assert update == {"$set": {"graph_data.nodes": patched["nodes"]}}
+
+
+def test_push_under_written_parent_is_not_written_separately():
+    patched, update = json_patch_to_update({"graph": {"nodes": []}}, [
+        {"op": "add", "path": "/graph/nodes/-", "value": 1},
+        {"op": "replace", "path": "/graph", "value": {"nodes": [2]}},
+        {"op": "add", "path": "/graph/nodes/-", "value": 3}
+    ], "graph_data")
+    assert update == {"$set": {"graph_data.graph": {"nodes": [2, 3]}}}
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "add", "path": "/nodes/-", "value": {"id": 9}}, {"op": "replace", "path": "/meta/name", "value": "n"}],
+    [{"op": "add", "path": "/nodes/0", "value": {"id": 0}}, {"op": "add", "path": "/edges/-", "value": [0, 1]}],
+    [{"op": "add", "path": "/edges/0/-", "value": 5}, {"op": "replace", "path": "/nodes/1/id", "value": 7}],
+    [{"op": "add", "path": "/nodes/1", "value": {"id": 5}}, {"op": "remove", "path": "/edges/0"}],
+])
+def test_update_reproduces_patched_document(operations):
+    document = {"nodes": [{"id": 1}, {"id": 2}], "edges": [[1, 2]], "meta": {"name": "g"}}
+    patched, update = json_patch_to_update(document, operations, "graph_data")
+
+    async def apply():
+        collection = MemoryClient()["test"]["graphs"]
+        await collection.insert_one({"_id": 1, "graph_data": document})
+        await collection.update_one({"_id": 1}, update)
+        return (await collection.find_one({"_id": 1}))["graph_data"]
+
+    assert asyncio.run(apply()) == patched
+
+
+def test_input_document_is_not_modified():
+    document = {"nodes": [1, 2], "meta": {"a": 1}}
+    json_patch_to_update(document, [
+        {"op": "remove", "path": "/nodes/0"},
+        {"op": "replace", "path": "/meta/a", "value": 2}
+    ], "graph_data")
+    assert document == {"nodes": [1, 2], "meta": {"a": 1}}
+
+
+def test_test_operation():
+    _, update = json_patch_to_update({"meta": {"a": 1}}, [
+        {"op": "test", "path": "/meta/a", "value": 1}
+    ], "graph_data")
+    assert update == {}
+    with pytest.raises(PatchConflictError):
+        json_patch_to_update({"meta": {"a": 1}}, [{"op": "test", "path": "/meta/a", "value": True}], "graph_data")
+    # test看到的是之前的操作生效后的值
+    with pytest.raises(PatchConflictError):
+        json_patch_to_update({"meta": {"a": 1}}, [
+            {"op": "replace", "path": "/meta/a", "value": 2},
+            {"op": "test", "path": "/meta/a", "value": 1}
+        ], "graph_data")
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "remove", "path": "/missing"},
+    {"op": "replace", "path": "/missing", "value": 1},
+    {"op": "add", "path": "/missing/a", "value": 1},
+    {"op": "remove", "path": "/nodes/2"},
+    {"op": "add", "path": "/nodes/3", "value": 1},
+    {"op": "add", "path": "/nodes/01", "value": 1},
+    {"op": "add", "path": "/nodes/x", "value": 1},
+    {"op": "add", "path": "/a.b", "value": 1},
+    {"op": "add", "path": "/$a", "value": 1},
+    {"op": "add", "path": "nodes", "value": 1},
+    {"op": "add", "path": "/meta"},
+    {"op": "move", "path": "/meta", "from": "/nodes"}
+])
+def test_invalid_operations(operation):
+    with pytest.raises(InvalidPatchError):
+        json_patch_to_update({"nodes": [1, 2], "meta": {}}, [operation], "graph_data")
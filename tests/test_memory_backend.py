@@ -0,0 +1,50 @@
+"""memory_backend：按_id排序的范围查询沿有序_id扫描，结果与逐条筛选后排序一致"""
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from memory_backend import MemoryClient
+
+
+@pytest.mark.parametrize("bounds, extra, direction, skip, limit", [
+    ({}, {}, 1, 0, 5),
+    ({}, {}, -1, 3, 5),
+    ({"$gt": 10}, {}, 1, 0, 4),
+    ({"$gte": 10, "$lt": 20}, {}, -1, 0, 0),
+    ({"$lte": 15}, {"n": {"$gte": 5}}, 1, 2, 3),
+])
+def test_id_ordered_scan_matches_filter_then_sort(bounds, extra, direction, skip, limit):
+    ids = sorted(ObjectId() for _ in range(30))
+    # 插入顺序与_id顺序不同
+    documents = [{"_id": id, "n": i % 7} for i, id in reversed(list(enumerate(ids)))]
+    condition = {op: ids[i] for op, i in bounds.items()}
+    filter = {**extra, "_id": condition} if condition else dict(extra)
+
+    def matches(document):
+        id = document["_id"]
+        checks = {"$gt": id.__gt__, "$gte": id.__ge__, "$lt": id.__lt__, "$lte": id.__le__}
+        return all(checks[op](bound) for op, bound in condition.items()) and \
+            ("n" not in extra or document["n"] >= 5)
+
+    expected = sorted((document for document in documents if matches(document)),
+                      key=lambda document: document["_id"], reverse=direction < 0)
+    expected = expected[skip:skip + limit if limit else None]
+
+    async def main():
+        collection = MemoryClient()["test"]["items"]
+        await collection.insert_many(documents)
+        assert collection._id_ordered(filter, direction) is not None
+        return await collection.find(filter).sort("_id", direction).skip(skip).limit(limit).to_list(None)
+
+    assert asyncio.run(main()) == expected
+
+
+def test_non_objectid_ids_fall_back_to_sort():
+    async def main():
+        collection = MemoryClient()["test"]["items"]
+        await collection.insert_many([{"_id": 3}, {"_id": 1}, {"_id": ObjectId()}])
+        assert collection._id_ordered({}, 1) is None
+        return await collection.find({}).sort("_id", 1).limit(2).to_list(None)
+
+    assert [document["_id"] for document in asyncio.run(main())] == [1, 3]
@@ -0,0 +1,163 @@
+"""GraphWriteBuffer：合并保存、版本号计算、写入失败放回缓冲、重复键重试与停止时写入"""
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import crud
+from crud import CRUDGraph, GraphWriteBuffer
+from memory_backend import MemoryClient
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    # 只由测试显式flush，后台不会自行写入
+    buffer = GraphWriteBuffer(flush_interval=3600, max_pending=1000)
+    monkeypatch.setattr(crud, "graph_write_buffer", buffer)
+    return buffer
+
+
+def _graphs():
+    collection = MemoryClient()["test"]["graphs"]
+    return collection, CRUDGraph(collection, coalesce=False)
+
+
+def test_saves_are_coalesced_and_versions_count_every_save(buffer):
+    async def main():
+        collection, graphs = _graphs()
+        buffer.start(collection)
+        for i in range(3):
+            await graphs.set_graph("u", "g", {"step": i})
+        # 未落库时读以缓冲为准，版本号与逐次写入一致
+        graph = await graphs.get_graph("u", "g")
+        assert (graph["graph_data"], graph["version"]) == ({"step": 2}, 3)
+        assert await collection.count_documents({}) == 0
+
+        await buffer.flush()
+        stored = await collection.find_one({"user_id": "u", "graph_id": "g"})
+        assert (stored["graph_data"], stored["version"]) == ({"step": 2}, 3)
+        assert (await graphs.get_graph("u", "g"))["version"] == 3
+
+        await graphs.set_graph("u", "g", {"step": 3})
+        assert (await graphs.get_graph("u", "g"))["version"] == 4
+        await buffer.stop()
+        stored = await collection.find_one({"user_id": "u", "graph_id": "g"})
+        assert (stored["graph_data"], stored["version"]) == ({"step": 3}, 4)
+
+    asyncio.run(main())
+    assert not buffer.running
+    assert buffer.stats()["coalesced"] == 2
+    assert buffer.stats()["written"] == 2
+
+
+def test_failed_write_is_requeued_and_merged_with_newer_saves(buffer):
+    async def main():
+        collection, graphs = _graphs()
+        buffer.start(collection)
+        await graphs.set_graph("u", "g", {"step": 0})
+        await graphs.set_graph("u", "g", {"step": 1})
+        bulk_write = collection.bulk_write
+
+        async def failing_bulk_write(*args, **kwargs):
+            # 写入期间又有一次保存，随后整批写入失败
+            await graphs.set_graph("u", "g", {"step": 2})
+            raise AutoReconnect("connection reset")
+
+        collection.bulk_write = failing_bulk_write
+        with pytest.raises(AutoReconnect):
+            await buffer.flush()
+        assert buffer.get("u", "g").saves == 3
+        assert buffer.get("u", "g").graph_data == {"step": 2}
+
+        collection.bulk_write = bulk_write
+        await buffer.stop()
+        return await collection.find_one({"user_id": "u", "graph_id": "g"})
+
+    stored = asyncio.run(main())
+    assert (stored["graph_data"], stored["version"]) == ({"step": 2}, 3)
+    assert buffer.stats()["failed"] == 1
+    assert buffer.stats()["pending"] == 0
+
+
+def test_duplicate_key_is_retried_once(buffer):
+    async def main():
+        collection, graphs = _graphs()
+        buffer.start(collection)
+        await graphs.set_graph("u", "g", {"step": 0})
+        await graphs.set_graph("u", "other", {"step": 0})
+        bulk_write = collection.bulk_write
+        calls = []
+
+        async def racing_bulk_write(operations, *args, **kwargs):
+            calls.append(len(operations))
+            if len(calls) > 1:
+                return await bulk_write(operations, *args, **kwargs)
+            # 第一条与并发upsert冲突，第二条写入成功
+            await bulk_write(operations[1:], *args, **kwargs)
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000"}]})
+
+        collection.bulk_write = racing_bulk_write
+        await buffer.flush()
+        # 冲突的保存放回缓冲，读仍以其为准
+        assert buffer.get("u", "g").retried
+        assert (await graphs.get_graph("u", "g"))["version"] == 1
+        await buffer.flush()
+        await buffer.stop()
+        return calls, await collection.find_one({"user_id": "u", "graph_id": "g"})
+
+    calls, stored = asyncio.run(main())
+    assert calls == [2, 1]
+    assert (stored["graph_data"], stored["version"]) == ({"step": 0}, 1)
+    assert buffer.stats()["written"] == 2
+    assert buffer.stats()["failed"] == 0
+    assert buffer.stats()["recent_errors"] == []
+
+
+def test_other_write_errors_are_recorded_and_dropped(buffer):
+    async def main():
+        collection, graphs = _graphs()
+        buffer.start(collection)
+        await graphs.set_graph("u", "g", {"step": 0})
+
+        async def rejecting_bulk_write(operations, *args, **kwargs):
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "validation failed"}]})
+
+        collection.bulk_write = rejecting_bulk_write
+        await buffer.flush()
+        assert buffer.get("u", "g") is None
+        await buffer.stop()
+
+    asyncio.run(main())
+    errors = buffer.stats()["recent_errors"]
+    assert [(error["graph_id"], error["code"]) for error in errors] == [("g", 121)]
+    assert buffer.stats()["failed"] == 1
+
+
+def test_stop_waits_for_background_write(monkeypatch):
+    # 缓冲数达到max_pending时由后台任务写入
+    buffer = GraphWriteBuffer(flush_interval=3600, max_pending=1)
+    monkeypatch.setattr(crud, "graph_write_buffer", buffer)
+
+    async def main():
+        collection, graphs = _graphs()
+        buffer.start(collection)
+        bulk_write = collection.bulk_write
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_bulk_write(*args, **kwargs):
+            started.set()
+            await release.wait()
+            return await bulk_write(*args, **kwargs)
+
+        collection.bulk_write = slow_bulk_write
+        await graphs.set_graph("u", "g", {"step": 0})
+        await started.wait()
+        stopping = asyncio.ensure_future(buffer.stop())
+        await asyncio.sleep(0)
+        release.set()
+        await stopping
+        return await collection.find_one({"user_id": "u", "graph_id": "g"})
+
+    stored = asyncio.run(main())
+    assert (stored["graph_data"], stored["version"]) == ({"step": 0}, 1)
+    assert not buffer.running